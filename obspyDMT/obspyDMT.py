@@ -12,14 +12,23 @@
 # -----------------------------------------------------------------------
 # ----------------Import required Modules (Python and Obspy)-------------
 # -----------------------------------------------------------------------
+import multiprocessing
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:
+    from multiprocessing.queues import SimpleQueue
+import os
 import sys
 import time
 
-from .utils.data_handler import get_data
+from .utils.data_handler import get_data, get_data_scheduled
 from .utils.event_handler import get_time_window
 from .utils.input_handler import command_parse, read_input_command
+from .utils.inventory_handler import inventory_span
 from .utils.local_handler import process_data, plot_unit, event_filter
 from .utils.metadata_handler import get_metadata
+from .utils.plan_handler import read_plan_rates, plan_event, plan_report
+from .utils.plan_handler import plan_measure
 from .utils.plotxml_handler import plot_xml_response
 from .utils.utility_codes import header_printer, goodbye_printer
 from .utils.utility_codes import print_event_catalogs, print_data_sources
@@ -67,8 +76,27 @@ def dmt_core(input_dics, **kwargs):
         print("\n#Events after filtering: %s" % len(events))
         if len(events) == 0:
             return input_dics
+        # time span of all events for --inventory_cache
+        if input_dics['inventory_cache']:
+            input_dics['inventory_span'] = inventory_span(events)
+    # ------------------planning (no download)---------------------------------
+    if input_dics['plan'] and not input_dics['event_info'] and \
+            input_dics['primary_mode'] in ['event_based', 'continuous']:
+        dmt_plan(input_dics, events)
+        return input_dics
+    # ------------------pipelined availability/data/processing-----------------
+    scheduled = input_dics['req_np_total'] and \
+        not input_dics['event_info'] and input_dics['meta_data'] and \
+        input_dics['primary_mode'] in ['event_based', 'continuous']
+    pipelined = input_dics['pipeline'] and not input_dics['event_info'] and \
+        input_dics['meta_data'] and not scheduled and \
+        input_dics['primary_mode'] in ['event_based', 'continuous']
+    if scheduled:
+        dmt_scheduled(input_dics, events)
+    elif pipelined:
+        dmt_pipeline(input_dics, events)
     # ------------------checking the availability------------------------------
-    if not input_dics['event_info']:
+    elif not input_dics['event_info']:
         for ev in range(len(events)):
             info_event = '%s/%s' % (ev+1, len(events))
             if input_dics['meta_data']:
@@ -80,10 +108,15 @@ def dmt_core(input_dics, **kwargs):
             if input_dics['primary_mode'] in ['event_based', 'continuous']:
                 get_data(stas_avail, events[ev], input_dics,
                          info_event=info_event)
+    # ------------------measured rates for the planner-------------------------
+    if input_dics['metrics'] and not input_dics['event_info'] and \
+            input_dics['primary_mode'] in ['event_based', 'continuous']:
+        plan_measure(input_dics, events)
     # ------------------processing---------------------------------------------
     # From this section, we do not need to connect to the data sources anymore.
     # This consists of pre_processing and plotting tools.
-    if input_dics['pre_process'] or input_dics['select_data']:
+    if (input_dics['pre_process'] or input_dics['select_data']) and \
+            not (pipelined or scheduled):
         for ev in range(len(events)):
             process_data(input_dics, events[ev])
     # ------------------plotting-----------------------------------------------
@@ -95,6 +128,240 @@ def dmt_core(input_dics, **kwargs):
     # ------------------exit the program---------------------------------------
     return input_dics
 
+# =============================================================================
+# ############################## dmt_avail_events #############################
+# =============================================================================
+
+
+def dmt_avail_events(input_dics, events):
+    """
+    generator of the available stations of each event, the availability
+    of an event is only checked when the download scheduler requests it
+    :param input_dics:
+    :param events:
+    :return: (event, stas_avail, info_event)
+    """
+    for ev in range(len(events)):
+        info_event = '%s/%s' % (ev+1, len(events))
+        stas_avail = get_metadata(input_dics, events[ev],
+                                  info_avail=info_event)
+        if not len(stas_avail) > 0:
+            continue
+        yield events[ev], stas_avail, info_event
+
+# =============================================================================
+# ############################## dmt_scheduled ################################
+# =============================================================================
+
+
+def dmt_scheduled(input_dics, events):
+    """
+    retrieve all events with the download scheduler (--req_np_total).
+    Each event is processed in the processing stage of dmt_pipeline as
+    soon as its data is retrieved, the events without available stations
+    at the end.
+    :param input_dics:
+    :param events:
+    :return:
+    """
+    processing = input_dics['pre_process'] or input_dics['select_data']
+    if not processing:
+        get_data_scheduled(dmt_avail_events(input_dics, events), input_dics)
+        return
+    ev_index = dict([(events[ev]['event_id'], ev)
+                     for ev in range(len(events))])
+    processed = set()
+    process_queue = SimpleQueue()
+
+    def event_retrieved(event):
+        processed.add(ev_index[event['event_id']])
+        process_queue.put(ev_index[event['event_id']])
+
+    # forked before the workers of the scheduler, the queue of the
+    # processing stage is not bounded so that it never stops the downloads
+    process_stage = multiprocessing.Process(
+        target=pipeline_process,
+        args=(input_dics, events, process_queue, None))
+    process_stage.start()
+    try:
+        get_data_scheduled(dmt_avail_events(input_dics, events), input_dics,
+                           event_retrieved=event_retrieved)
+        for ev in range(len(events)):
+            if ev not in processed:
+                process_queue.put(ev)
+    except BaseException:
+        process_stage.terminate()
+        raise
+    finally:
+        process_queue.put(None)
+    process_stage.join()
+
+# =============================================================================
+# ############################## dmt_plan #####################################
+# =============================================================================
+
+
+def dmt_plan(input_dics, events):
+    """
+    estimate the number of requests, the volume and the runtime of the
+    download from the availability of each event (--plan)
+    :param input_dics:
+    :param events:
+    :return:
+    """
+    rates = read_plan_rates()
+    event_plans = []
+    for ev in range(len(events)):
+        info_event = '%s/%s' % (ev+1, len(events))
+        stas_avail = get_metadata(input_dics, events[ev],
+                                  info_avail=info_event)
+        event_plans.append(plan_event(stas_avail, events[ev], input_dics,
+                                      rates))
+    plan_report(input_dics, events, event_plans)
+
+# =============================================================================
+# ############################## dmt_pipeline #################################
+# =============================================================================
+
+
+def dmt_pipeline(input_dics, events):
+    """
+    pipelined version of the availability-->data-->processing loop:
+    the availability of event N+1 is checked while the waveforms of
+    event N are retrieved, and event N is processed as soon as its data
+    is retrieved. The stages are connected by bounded queues
+    (--pipeline_queue). The availability and processing stages run in
+    their own processes: the main process forks the download workers and
+    should not have other threads at that time.
+    :param input_dics:
+    :param events:
+    :return:
+    """
+    meta_queue = SimpleQueue()
+    meta_slots = multiprocessing.Semaphore(input_dics['pipeline_queue'])
+    process_queue = SimpleQueue()
+    process_slots = multiprocessing.Semaphore(input_dics['pipeline_queue'])
+
+    # the stages are forked before any thread is started in this process
+    pipeline_stages = [multiprocessing.Process(
+        target=pipeline_metadata,
+        args=(input_dics, events, meta_queue, meta_slots))]
+    if input_dics['pre_process'] or input_dics['select_data']:
+        pipeline_stages.append(multiprocessing.Process(
+            target=pipeline_process,
+            args=(input_dics, events, process_queue, process_slots)))
+    for pipeline_stage in pipeline_stages:
+        pipeline_stage.start()
+
+    # waveforms are retrieved in the main process
+    try:
+        while True:
+            meta_item = meta_queue.get()
+            meta_slots.release()
+            if meta_item is None:
+                break
+            ev, info_event, stas_avail = meta_item
+            if stas_avail is not None:
+                get_data(stas_avail, events[ev], input_dics,
+                         info_event=info_event)
+            if len(pipeline_stages) > 1:
+                process_slots.acquire()
+                process_queue.put(ev)
+    except BaseException:
+        for pipeline_stage in pipeline_stages:
+            pipeline_stage.terminate()
+        raise
+    finally:
+        if len(pipeline_stages) > 1:
+            process_queue.put(None)
+    for pipeline_stage in pipeline_stages:
+        pipeline_stage.join()
+
+# =============================================================================
+# ############################## pipeline_metadata ############################
+# =============================================================================
+
+
+def pipeline_metadata(input_dics, events, meta_queue, meta_slots):
+    """
+    availability stage of dmt_pipeline, the events without available
+    stations are passed on without stations (stas_avail: None) so that
+    they are processed as in the serial flow
+    :param input_dics:
+    :param events:
+    :param meta_queue:
+    :param meta_slots: semaphore bounding the number of queued events
+    :return:
+    """
+    try:
+        for ev in range(len(events)):
+            info_event = '%s/%s' % (ev+1, len(events))
+            try:
+                stas_avail = get_metadata(input_dics, events[ev],
+                                          info_avail=info_event)
+                if not len(stas_avail) > 0:
+                    pipeline_exception(
+                        input_dics, events[ev],
+                        'availability -- no available station')
+                    stas_avail = None
+            except Exception as error:
+                pipeline_exception(input_dics, events[ev],
+                                   'availability -- %s' % error)
+                stas_avail = None
+            meta_slots.acquire()
+            meta_queue.put((ev, info_event, stas_avail))
+    finally:
+        meta_queue.put(None)
+
+# =============================================================================
+# ############################## pipeline_process #############################
+# =============================================================================
+
+
+def pipeline_process(input_dics, events, process_queue, process_slots):
+    """
+    processing stage of dmt_pipeline
+    :param input_dics:
+    :param events:
+    :param process_queue:
+    :param process_slots: semaphore bounding the number of queued events
+        (None: not bounded)
+    :return:
+    """
+    while True:
+        ev = process_queue.get()
+        if ev is None:
+            break
+        if process_slots is not None:
+            process_slots.release()
+        try:
+            process_data(input_dics, events[ev])
+        except Exception as error:
+            pipeline_exception(input_dics, events[ev],
+                               'processing -- %s' % error)
+
+# =============================================================================
+# ############################## pipeline_exception ###########################
+# =============================================================================
+
+
+def pipeline_exception(input_dics, event, ee):
+    """
+    report an error of a pipeline stage in info/exception of the event
+    :param input_dics:
+    :param event:
+    :param ee: error message
+    :return:
+    """
+    print('[WARNING] %s: %s' % (event['event_id'], ee))
+    info_path = os.path.join(input_dics['datapath'], event['event_id'],
+                             'info')
+    if not os.path.isdir(info_path):
+        return
+    exc_file = open(os.path.join(info_path, 'exception'), 'at+')
+    exc_file.writelines('%s\n' % ee)
+    exc_file.close()
+
 # =============================================================================
 ###############################################################################
 # =============================================================================
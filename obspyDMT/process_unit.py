@@ -108,7 +108,7 @@ def process_unit(tr_add, target_path, input_dics, staev_ar):
     if not tr:
         pass
     elif input_dics['waveform_format'] == 'sac':
-        tr = convert_to_sac(tr, save_path, staev_ar)
+        tr = convert_to_sac(tr, save_path, staev_ar, target_path)
         tr.write(save_path, format='SAC')
     else:
         try:
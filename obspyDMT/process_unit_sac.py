@@ -77,7 +77,7 @@ def process_unit(tr_add, target_path, input_dics, staev_ar):
         return False
 
     # -------------- PROCESSING -----------------------------------------------
-    tr = convert_to_sac(tr, save_path, staev_ar)
+    tr = convert_to_sac(tr, save_path, staev_ar, target_path)
     tr.write(save_path, format='SAC')
 
     p = subprocess.Popen(['sac'],
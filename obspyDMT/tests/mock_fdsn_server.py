@@ -0,0 +1,774 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  mock_fdsn_server.py
+#   Purpose:   local FDSN web service (station, dataselect, event) for
+#              testing and benchmarking the download engines
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+from __future__ import print_function
+from fnmatch import fnmatch
+from glob import glob
+from io import BytesIO
+import math
+import numpy as np
+import os
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+
+from obspy import read, Stream, Trace, UTCDateTime
+from obspy.core.event import Catalog, Event, Origin, Magnitude
+from obspy.core.inventory import Inventory, Network, Station, Channel
+from obspy.core.inventory import Site, Response
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fdsn_waveforms')
+
+# parameters of the query methods in the WADL of each service,
+# obspy validates the requests against them
+WADL_PARAMS = {
+    'dataselect': [
+        ('starttime', 'xs:dateTime'), ('endtime', 'xs:dateTime'),
+        ('network', 'xs:string'), ('station', 'xs:string'),
+        ('location', 'xs:string'), ('channel', 'xs:string'),
+        ('quality', 'xs:string'), ('minimumlength', 'xs:double'),
+        ('longestonly', 'xs:boolean'), ('format', 'xs:string'),
+        ('nodata', 'xs:int')],
+    'station': [
+        ('starttime', 'xs:dateTime'), ('endtime', 'xs:dateTime'),
+        ('startbefore', 'xs:dateTime'), ('startafter', 'xs:dateTime'),
+        ('endbefore', 'xs:dateTime'), ('endafter', 'xs:dateTime'),
+        ('network', 'xs:string'), ('station', 'xs:string'),
+        ('location', 'xs:string'), ('channel', 'xs:string'),
+        ('minlatitude', 'xs:double'), ('maxlatitude', 'xs:double'),
+        ('minlongitude', 'xs:double'), ('maxlongitude', 'xs:double'),
+        ('latitude', 'xs:double'), ('longitude', 'xs:double'),
+        ('minradius', 'xs:double'), ('maxradius', 'xs:double'),
+        ('level', 'xs:string'), ('includerestricted', 'xs:boolean'),
+        ('includeavailability', 'xs:boolean'),
+        ('updatedafter', 'xs:dateTime'), ('matchtimeseries', 'xs:boolean'),
+        ('format', 'xs:string'), ('nodata', 'xs:int')],
+    'event': [
+        ('starttime', 'xs:dateTime'), ('endtime', 'xs:dateTime'),
+        ('minlatitude', 'xs:double'), ('maxlatitude', 'xs:double'),
+        ('minlongitude', 'xs:double'), ('maxlongitude', 'xs:double'),
+        ('latitude', 'xs:double'), ('longitude', 'xs:double'),
+        ('minradius', 'xs:double'), ('maxradius', 'xs:double'),
+        ('mindepth', 'xs:double'), ('maxdepth', 'xs:double'),
+        ('minmagnitude', 'xs:double'), ('maxmagnitude', 'xs:double'),
+        ('magnitudetype', 'xs:string'), ('includeallorigins', 'xs:boolean'),
+        ('includeallmagnitudes', 'xs:boolean'),
+        ('includearrivals', 'xs:boolean'), ('eventid', 'xs:string'),
+        ('limit', 'xs:int'), ('offset', 'xs:int'), ('orderby', 'xs:string'),
+        ('catalog', 'xs:string'), ('contributor', 'xs:string'),
+        ('updatedafter', 'xs:dateTime'), ('format', 'xs:string'),
+        ('nodata', 'xs:int')],
+}
+
+# ##################### MockFDSNServer ##################################
+
+
+class MockFDSNServer(object):
+    """
+    FDSN web service (station, dataselect and event) running in a thread
+    of the current process.
+    The channels are either read from fixture files (SAC waveforms and
+    SACPZ responses, see tests/fdsn_waveforms) or synthetic.
+    Latency, bandwidth and errors are injected into the query requests:
+
+    :param fixture_dir: directory with the fixture files, None for
+        synthetic channels
+    :param num_stations: number of synthetic stations
+    :param channels: channels of each synthetic station
+    :param sampling_rate: sampling rate of the synthetic channels
+    :param latency: delay before each query is answered (seconds)
+    :param bandwidth: bytes/s per request (None: no limit)
+    :param error_rate: fraction of the queries answered with error_code
+    :param error_code: HTTP status code of the injected errors
+    :param slow_rate: fraction of the queries delayed by slow_latency
+    :param slow_latency: additional delay of the slow queries (seconds)
+    :param seed: seed of the synthetic data and of the injected errors
+    :param port: 0 selects a free port
+
+    >>> with MockFDSNServer(latency=0.05) as server:  # doctest: +SKIP
+    ...     server.register('MOCK')
+    ...     Client('MOCK').get_stations(level='channel')
+    """
+    def __init__(self, fixture_dir=None, num_stations=10,
+                 channels=('BHZ', 'BHN', 'BHE'), sampling_rate=20.,
+                 latency=0., bandwidth=None, error_rate=0., error_code=503,
+                 slow_rate=0., slow_latency=0., seed=0, port=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.seed = seed
+        self.port = port
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+        self.registered = []
+        self.reset_stats()
+
+        self.traces = {}
+        if fixture_dir:
+            self.events, self.channels = fixture_channels(fixture_dir,
+                                                          self.traces)
+        else:
+            self.events, self.channels = synthetic_channels(
+                num_stations, channels, sampling_rate)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.httpd.server_address[1]
+
+    def start(self):
+        self.httpd = MockHTTPServer(('127.0.0.1', self.port),
+                                    MockFDSNHandler)
+        self.httpd.mock = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+        # the names are removed from the global URL_MAPPINGS of obspy
+        url_mappings = mock_url_mappings()
+        for name in self.registered:
+            url_mappings.pop(name, None)
+        self.registered = []
+
+    def register(self, name='MOCK'):
+        """
+        make the server available as a data source/event catalog name
+        (obspy URL_MAPPINGS), e.g. --data_source MOCK
+        :param name:
+        :return:
+        """
+        mock_url_mappings()[name.upper()] = self.url
+        if name.upper() not in self.registered:
+            self.registered.append(name.upper())
+        return name.upper()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'queries': 0, 'bytes': 0,
+                          'errors': 0, 'services': {}, 'status': {}}
+
+    def count(self, service, status, n_bytes):
+        """
+        count one request
+        :param service: service of a query, None for the other requests
+            (WADL, version...)
+        :param status:
+        :param n_bytes:
+        :return:
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += n_bytes
+            if service:
+                self.stats['queries'] += 1
+                self.stats['services'][service] = \
+                    self.stats['services'].get(service, 0) + 1
+            self.stats['status'][status] = \
+                self.stats['status'].get(status, 0) + 1
+            if status >= 400:
+                self.stats['errors'] += 1
+
+    def inject(self):
+        """
+        draw the injected delay and error of one query
+        :return: delay in seconds, error status code or None
+        """
+        with self.lock:
+            delay = self.latency
+            if self.slow_rate and self.rand.random() < self.slow_rate:
+                delay += self.slow_latency
+            error = None
+            if self.error_rate and self.rand.random() < self.error_rate:
+                error = self.error_code
+        return delay, error
+
+    def trace(self, channel):
+        """
+        waveform of one channel, synthetic traces are generated once
+        :param channel:
+        :return:
+        """
+        st_id = channel_id(channel)
+        with self.lock:
+            if st_id not in self.traces:
+                self.traces[st_id] = synthetic_trace(
+                    channel, self.events[0]['time'],
+                    self.seed + self.channels.index(channel))
+            return self.traces[st_id]
+
+# ##################### MockHTTPServer ##################################
+
+
+class MockHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+# ##################### MockFDSNHandler #################################
+
+
+class MockFDSNHandler(BaseHTTPRequestHandler):
+    """
+    routes of the FDSN web services:
+    /fdsnws/<service>/1/(query|application.wadl|version)
+    /fdsnws/event/1/(catalogs|contributors)
+    """
+    # keep-alive, used by --req_engine 'session'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.route(dict(parse_qsl(urlparse(self.path).query)))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('ascii', 'ignore')
+        self.route({}, body)
+
+    def route(self, params, body=None):
+        mock = self.server.mock
+        path = urlparse(self.path).path.rstrip('/').split('/')
+        if len(path) != 5 or path[1] != 'fdsnws' or \
+                path[2] not in WADL_PARAMS:
+            return self.reply(404, b'Not found', 'text/plain', None)
+        service, method = path[2], path[4]
+        if method == 'application.wadl':
+            return self.reply(200, service_wadl(service, mock.url),
+                              'application/xml', None)
+        if method == 'version':
+            return self.reply(200, b'1.1.0', 'text/plain', None)
+        if service == 'event' and method in ['catalogs', 'contributors']:
+            return self.reply(200, ('<%s><%s>MOCK</%s></%s>'
+                                    % (method.title(), method[:-1].title(),
+                                       method[:-1].title(), method.title())
+                                    ).encode(),
+                              'application/xml', None)
+        if method != 'query':
+            return self.reply(404, b'Not found', 'text/plain', None)
+
+        delay, error = mock.inject()
+        time.sleep(delay)
+        if error:
+            return self.reply(error, b'Service temporarily unavailable',
+                              'text/plain', service)
+        try:
+            if service == 'dataselect':
+                content, content_type = \
+                    dataselect_query(mock, params, body)
+            elif service == 'station':
+                content, content_type = station_query(mock, params)
+            else:
+                content, content_type = event_query(mock, params)
+        except Exception as error:
+            return self.reply(400, ('Bad request: %s' % error).encode(),
+                              'text/plain', service)
+        if content is None:
+            return self.reply(int(params.get('nodata', 204)), b'',
+                              'text/plain', service)
+        self.reply(200, content, content_type, service,
+                   bandwidth=mock.bandwidth)
+
+    def reply(self, status, content, content_type, service, bandwidth=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        if status in [429, 503]:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        chunk_size = 16*1024
+        for i in range(0, len(content), chunk_size):
+            self.wfile.write(content[i:i+chunk_size])
+            if bandwidth:
+                time.sleep(len(content[i:i+chunk_size])/float(bandwidth))
+        self.server.mock.count(service, status, len(content))
+
+# ##################### service_wadl ####################################
+
+
+def service_wadl(service, url):
+    """
+    WADL of one service
+    :param service:
+    :param url:
+    :return:
+    """
+    params = '\n'.join(['        <param name="%s" style="query" type="%s"/>'
+                        % (name, param_type)
+                        for name, param_type in WADL_PARAMS[service]])
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<application xmlns="http://wadl.dev.java.net/2009/02" '
+            'xmlns:xs="http://www.w3.org/2001/XMLSchema">\n'
+            '  <resources base="%s/fdsnws/%s/1/">\n'
+            '    <resource path="query">\n'
+            '      <method name="GET" id="query"><request>\n%s\n'
+            '      </request></method>\n'
+            '      <method name="POST" id="postQuery"/>\n'
+            '    </resource>\n'
+            '  </resources>\n'
+            '</application>\n' % (url, service, params)).encode()
+
+# ##################### mock_url_mappings ###############################
+
+
+def mock_url_mappings():
+    """
+    URL_MAPPINGS of obspy (data center name --> URL)
+    :return:
+    """
+    try:
+        from obspy.clients.fdsn.header import URL_MAPPINGS
+    except ImportError:
+        from obspy.fdsn.header import URL_MAPPINGS
+    return URL_MAPPINGS
+
+# ##################### channel_id ######################################
+
+
+def channel_id(channel):
+    return '%s.%s.%s.%s' % (channel['network'], channel['station'],
+                            channel['location'], channel['channel'])
+
+# ##################### synthetic_channels ##############################
+
+
+def synthetic_channels(num_stations, channels, sampling_rate):
+    """
+    one event and num_stations stations spread over the globe
+    :param num_stations:
+    :param channels:
+    :param sampling_rate:
+    :return: events, channels
+    """
+    events = [{'time': UTCDateTime('2011-03-11T05:46:23.200'),
+               'latitude': 38.2963, 'longitude': 142.498, 'depth': 19.7,
+               'magnitude': 9.1}]
+    sta_channels = []
+    for num_sta in range(num_stations):
+        # golden-angle spiral: evenly distributed stations
+        lat = math.degrees(math.asin(-1. + 2.*(num_sta + 0.5) /
+                                     num_stations))
+        lon = (num_sta*137.508) % 360. - 180.
+        for cha in channels:
+            sta_channels.append({
+                'network': 'XX', 'station': 'S%03i' % num_sta,
+                'location': '', 'channel': cha,
+                'latitude': round(lat, 4), 'longitude': round(lon, 4),
+                'elevation': 100., 'depth': 0.,
+                'azimuth': {'E': 90.}.get(cha[-1], 0.),
+                'dip': {'Z': -90.}.get(cha[-1], 0.),
+                'sampling_rate': sampling_rate,
+                'start': UTCDateTime('2000-01-01'), 'end': None,
+                'zeros': [0j, 0j],
+                'poles': [-0.037+0.037j, -0.037-0.037j,
+                          -251.3+0j, -131.0+467.3j, -131.0-467.3j],
+                'sensitivity': 6.e8, 'input_units': 'M/S'})
+    return events, sta_channels
+
+# ##################### synthetic_trace #################################
+
+
+def synthetic_trace(channel, event_time, seed, before=3600., after=7200.):
+    """
+    random walk waveform of one channel around event_time
+    :param channel:
+    :param event_time:
+    :param seed:
+    :param before: seconds of data before event_time
+    :param after: seconds of data after event_time
+    :return:
+    """
+    npts = int((before + after)*channel['sampling_rate'])
+    data = np.cumsum(np.random.RandomState(seed).randint(
+        -100, 101, npts)).astype(np.int32)
+    return Trace(data=data, header={
+        'network': channel['network'], 'station': channel['station'],
+        'location': channel['location'], 'channel': channel['channel'],
+        'sampling_rate': channel['sampling_rate'],
+        'starttime': event_time - before})
+
+# ##################### fixture_channels ################################
+
+
+def fixture_channels(fixture_dir, traces):
+    """
+    channels of the SAC fixture files (and SACPZ files, if any)
+    :param fixture_dir:
+    :param traces: dictionary to be filled with the waveforms
+    :return: events, channels
+    """
+    events = []
+    sta_channels = []
+    for sac_path in sorted(glob(os.path.join(fixture_dir, '*.*.*.*'))):
+        if os.path.basename(sac_path).startswith('SACPZ'):
+            continue
+        tr = read(sac_path)[0]
+        sac = tr.stats.sac
+        if len(events) == 0:
+            events.append({'time': tr.stats.starttime - sac.get('b', 0.),
+                           'latitude': float(sac.evla),
+                           'longitude': float(sac.evlo),
+                           'depth': float(sac.evdp),
+                           'magnitude': 9.1})
+        channel = {'network': tr.stats.network, 'station': tr.stats.station,
+                   'location': tr.stats.location, 'channel': tr.stats.channel,
+                   'latitude': float(sac.stla),
+                   'longitude': float(sac.stlo),
+                   'elevation': float(sac.get('stel', 0.)), 'depth': 0.,
+                   'azimuth': 0., 'dip': -90.,
+                   'sampling_rate': tr.stats.sampling_rate,
+                   'start': tr.stats.starttime - 10*365*86400., 'end': None,
+                   'zeros': [0j, 0j], 'poles': [-0.037+0.037j,
+                                                -0.037-0.037j],
+                   'sensitivity': 6.e8, 'input_units': 'M/S'}
+        sacpz_path = os.path.join(
+            fixture_dir, 'SACPZ.%s.%s.%s.%s'
+            % (channel['network'], channel['station'],
+               channel['location'] or '--', channel['channel']))
+        if os.path.isfile(sacpz_path):
+            channel.update(read_sacpz(sacpz_path))
+        traces[channel_id(channel)] = tr
+        sta_channels.append(channel)
+    return events, sta_channels
+
+# ##################### read_sacpz ######################################
+
+
+def read_sacpz(sacpz_path):
+    """
+    poles, zeros, sensitivity and normalization factor (A0) of a SACPZ file
+    (the response is in displacement, input_units: M)
+    :param sacpz_path:
+    :return:
+    """
+    paz = {'zeros': [], 'poles': [], 'input_units': 'M'}
+    key = None
+    for line in open(sacpz_path):
+        words = line.split()
+        if len(words) == 0:
+            continue
+        if words[0] == '*':
+            if len(words) > 3 and words[1] == 'SENSITIVITY':
+                paz['sensitivity'] = float(words[3])
+            elif len(words) > 3 and words[1] == 'A0':
+                paz['a0'] = float(words[3])
+            continue
+        if words[0] in ['ZEROS', 'POLES']:
+            key = words[0].lower()
+            num_roots = int(words[1])
+            paz[key] = [0j]*num_roots
+            num_root = 0
+        elif words[0] == 'CONSTANT':
+            key = None
+        elif key:
+            paz[key][num_root] = complex(float(words[0]), float(words[1]))
+            num_root += 1
+    return paz
+
+# ##################### match_codes #####################################
+
+
+def match_codes(code, patterns):
+    """
+    check a SEED code against a comma separated list of patterns
+    (?, * wildcards, -- for an empty location code)
+    :param code:
+    :param patterns:
+    :return:
+    """
+    if patterns in [None, '', '*']:
+        return True
+    for pattern in patterns.split(','):
+        pattern = pattern.strip()
+        if pattern == '--':
+            pattern = ''
+        if fnmatch(code, pattern):
+            return True
+    return False
+
+# ##################### select_channels #################################
+
+
+def select_channels(mock, params):
+    """
+    channels of the mock server which match the request parameters
+    :param mock:
+    :param params:
+    :return:
+    """
+    t_start = params.get('starttime')
+    t_end = params.get('endtime')
+    sel_channels = []
+    for channel in mock.channels:
+        if not (match_codes(channel['network'], params.get('network')) and
+                match_codes(channel['station'], params.get('station')) and
+                match_codes(channel['location'], params.get('location')) and
+                match_codes(channel['channel'], params.get('channel'))):
+            continue
+        if t_end and UTCDateTime(t_end) < channel['start']:
+            continue
+        if t_start and channel['end'] and \
+                UTCDateTime(t_start) > channel['end']:
+            continue
+        if not in_region(channel['latitude'], channel['longitude'], params):
+            continue
+        sel_channels.append(channel)
+    return sel_channels
+
+# ##################### in_region #######################################
+
+
+def in_region(lat, lon, params):
+    """
+    check a location against the rectangular and circular region
+    parameters of a query
+    :param lat:
+    :param lon:
+    :param params:
+    :return:
+    """
+    if float(params.get('minlatitude', -90)) > lat or \
+            float(params.get('maxlatitude', 90)) < lat or \
+            float(params.get('minlongitude', -180)) > lon or \
+            float(params.get('maxlongitude', 180)) < lon:
+        return False
+    if params.get('latitude') is not None and \
+            params.get('longitude') is not None:
+        lat1, lon1 = (math.radians(float(params['latitude'])),
+                      math.radians(float(params['longitude'])))
+        lat2, lon2 = math.radians(lat), math.radians(lon)
+        hav = math.sin((lat2 - lat1)/2.)**2 + \
+            math.cos(lat1)*math.cos(lat2)*math.sin((lon2 - lon1)/2.)**2
+        dist = math.degrees(2.*math.asin(min(1., math.sqrt(hav))))
+        if float(params.get('minradius', 0)) > dist or \
+                float(params.get('maxradius', 180)) < dist:
+            return False
+    return True
+
+# ##################### dataselect_query ################################
+
+
+def dataselect_query(mock, params, body=None):
+    """
+    miniSEED of a GET or POST (bulk) dataselect query
+    :param mock:
+    :param params:
+    :param body: POST body, one 'NET STA LOC CHA START END' line per request
+    :return: content (None if no data), content type
+    """
+    requests = []
+    if body is None:
+        requests.append(params)
+    else:
+        for line in body.splitlines():
+            words = line.split()
+            if len(words) != 6 or '=' in line:
+                continue
+            requests.append({'network': words[0], 'station': words[1],
+                             'location': words[2], 'channel': words[3],
+                             'starttime': words[4], 'endtime': words[5]})
+    st = Stream()
+    for req in requests:
+        for channel in select_channels(mock, req):
+            tr = mock.trace(channel).slice(UTCDateTime(req['starttime']),
+                                           UTCDateTime(req['endtime']))
+            if tr.stats.npts > 0:
+                st.append(tr)
+    if len(st) == 0:
+        return None, None
+    content = BytesIO()
+    st.write(content, format='MSEED')
+    return content.getvalue(), 'application/vnd.fdsn.mseed'
+
+# ##################### station_query ###################################
+
+
+def station_query(mock, params):
+    """
+    StationXML (or FDSN text) of a station query
+    :param mock:
+    :param params:
+    :return: content (None if no data), content type
+    """
+    sel_channels = select_channels(mock, params)
+    if len(sel_channels) == 0:
+        return None, None
+    level = params.get('level', 'station')
+    if params.get('format') == 'text':
+        return station_text(sel_channels, level), 'text/plain'
+
+    networks = {}
+    for channel in sel_channels:
+        if channel['network'] not in networks:
+            networks[channel['network']] = \
+                Network(code=channel['network'], stations=[])
+        network = networks[channel['network']]
+        stations = [sta for sta in network.stations
+                    if sta.code == channel['station']]
+        if len(stations) == 0:
+            stations = [Station(code=channel['station'],
+                                latitude=channel['latitude'],
+                                longitude=channel['longitude'],
+                                elevation=channel['elevation'],
+                                creation_date=channel['start'],
+                                site=Site(name=channel['station']))]
+            network.stations.append(stations[0])
+        if level in ['channel', 'response']:
+            response = None
+            if level == 'response':
+                response = Response.from_paz(
+                    zeros=channel['zeros'], poles=channel['poles'],
+                    stage_gain=channel['sensitivity'],
+                    input_units=channel['input_units'],
+                    output_units='COUNTS',
+                    normalization_factor=channel.get('a0', 1.))
+            stations[0].channels.append(Channel(
+                code=channel['channel'],
+                location_code=channel['location'],
+                latitude=channel['latitude'],
+                longitude=channel['longitude'],
+                elevation=channel['elevation'],
+                depth=channel['depth'],
+                azimuth=channel['azimuth'],
+                dip=channel['dip'],
+                sample_rate=channel['sampling_rate'],
+                start_date=channel['start'],
+                end_date=channel['end'],
+                response=response))
+    inv = Inventory(networks=[networks[net] for net in sorted(networks)],
+                    source='obspyDMT mock FDSN server')
+    content = BytesIO()
+    inv.write(content, format='STATIONXML')
+    return content.getvalue(), 'application/xml'
+
+# ##################### station_text ####################################
+
+
+def station_text(sel_channels, level):
+    """
+    FDSN text format of a station query
+    :param sel_channels:
+    :param level:
+    :return:
+    """
+    if level in ['channel', 'response']:
+        lines = ['#Network|Station|Location|Channel|Latitude|Longitude|'
+                 'Elevation|Depth|Azimuth|Dip|SensorDescription|Scale|'
+                 'ScaleFreq|ScaleUnits|SampleRate|StartTime|EndTime']
+        for channel in sel_channels:
+            lines.append('|'.join([
+                channel['network'], channel['station'],
+                channel['location'], channel['channel'],
+                str(channel['latitude']), str(channel['longitude']),
+                str(channel['elevation']), str(channel['depth']),
+                str(channel['azimuth']), str(channel['dip']), 'Mock sensor',
+                str(channel['sensitivity']), '1.0', channel['input_units'],
+                str(channel['sampling_rate']),
+                channel['start'].strftime('%Y-%m-%dT%H:%M:%S'),
+                channel['end'].strftime('%Y-%m-%dT%H:%M:%S')
+                if channel['end'] else '']))
+    else:
+        lines = ['#Network|Station|Latitude|Longitude|Elevation|SiteName|'
+                 'StartTime|EndTime']
+        sta_codes = []
+        for channel in sel_channels:
+            if (channel['network'], channel['station']) in sta_codes:
+                continue
+            sta_codes.append((channel['network'], channel['station']))
+            lines.append('|'.join([
+                channel['network'], channel['station'],
+                str(channel['latitude']), str(channel['longitude']),
+                str(channel['elevation']), channel['station'],
+                channel['start'].strftime('%Y-%m-%dT%H:%M:%S'), '']))
+    return ('\n'.join(lines) + '\n').encode()
+
+# ##################### event_query #####################################
+
+
+def event_query(mock, params):
+    """
+    QuakeML of an event query
+    :param mock:
+    :param params:
+    :return: content (None if no data), content type
+    """
+    cat = Catalog()
+    for num_ev, ev in enumerate(mock.events):
+        if (params.get('starttime') and
+                UTCDateTime(params['starttime']) > ev['time']) or \
+                (params.get('endtime') and
+                 UTCDateTime(params['endtime']) < ev['time']) or \
+                float(params.get('minmagnitude', -10)) > ev['magnitude'] or \
+                float(params.get('maxmagnitude', 20)) < ev['magnitude'] or \
+                float(params.get('mindepth', -10)) > ev['depth'] or \
+                float(params.get('maxdepth', 1000)) < ev['depth'] or \
+                not in_region(ev['latitude'], ev['longitude'], params):
+            continue
+        origin = Origin(resource_id='smi:local/origin/%s' % num_ev,
+                        time=ev['time'], latitude=ev['latitude'],
+                        longitude=ev['longitude'], depth=ev['depth']*1000.)
+        magnitude = Magnitude(resource_id='smi:local/magnitude/%s' % num_ev,
+                              mag=ev['magnitude'], magnitude_type='Mw',
+                              origin_id=origin.resource_id)
+        cat.append(Event(resource_id='smi:local/event/%s' % num_ev,
+                         origins=[origin], magnitudes=[magnitude],
+                         preferred_origin_id=origin.resource_id,
+                         preferred_magnitude_id=magnitude.resource_id))
+    if len(cat) == 0:
+        return None, None
+    content = BytesIO()
+    cat.write(content, format='QUAKEML')
+    return content.getvalue(), 'application/xml'
+
+# ##################### main ############################################
+
+
+if __name__ == '__main__':
+    with MockFDSNServer(fixture_dir=FIXTURE_DIR) as server:
+        print('mock FDSN server: %s (Ctrl-C to stop)' % server.url)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
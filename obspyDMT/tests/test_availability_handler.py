@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_availability_handler.py
+#   Purpose:   testing the columnar availability store
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import os
+import shutil
+import tempfile
+
+from obspyDMT.utils.availability_handler import avail_append, avail_load
+from obspyDMT.utils.availability_handler import avail_unique, avail_rows
+
+# ##################### test_avail_store ################################
+
+
+def test_avail_store():
+    target_path = tempfile.mkdtemp(prefix='dmt_avail_')
+    os.mkdir(os.path.join(target_path, 'info'))
+    try:
+        stas_1 = [['IU', 'ANMO', '00', 'BHZ', 34.9, -106.5, 1850., 100.,
+                   'IRIS', 'IU_ANMO_00_BHZ', 0., -90.],
+                  ['GE', 'WLF', '', 'HHZ', 49.7, 6.2, 295., 0.,
+                   'ARCLINK', 'GE_WLF__HHZ', 'NA', 'NA']]
+        stas_2 = [['IU', 'ANMO', '00', 'BHZ', 34.9, -106.5, 1850., 100.,
+                   'IRIS', 'IU_ANMO_00_BHZ', 0., -90.],
+                  ['IU', 'ANMO', '00', 'BHZ', 34.9, -106.5, 1850., 100.,
+                   'ORFEUS', 'IU_ANMO_00_BHZ', None, None]]
+        avail_arr, sources = avail_append(target_path, stas_1)
+        assert len(avail_arr) == 2
+        assert sources == ['ARCLINK', 'IRIS']
+        avail_arr, sources = avail_append(target_path, stas_2)
+        assert sources == ['ARCLINK', 'IRIS', 'ORFEUS']
+
+        # the store is compacted: one record per channel and source
+        avail_arr, sources = avail_load(target_path)
+        assert len(avail_arr) == 3
+        stas = avail_rows(avail_unique(avail_arr), sources)
+        assert stas.shape == (3, 12)
+        assert list(stas[0]) == ['GE', 'WLF', '', 'HHZ', '49.7', '6.2',
+                                 '295.0', '0.0', 'ARCLINK', 'GE_WLF__HHZ',
+                                 'NA', 'NA']
+        assert list(stas[1][8:]) == ['IRIS', 'IU_ANMO_00_BHZ', '0.0',
+                                     '-90.0']
+        assert list(stas[2][8:]) == ['ORFEUS', 'IU_ANMO_00_BHZ', 'NA', 'NA']
+
+        # availability.txt is written for the scripts of the users
+        txt_fio = open(os.path.join(target_path, 'info', 'availability.txt'),
+                       'rt')
+        txt_lines = txt_fio.readlines()
+        txt_fio.close()
+        assert len(txt_lines) == 3
+        assert txt_lines[0] == 'GE,WLF,,HHZ,49.7,6.2,295.0,0.0,ARCLINK,' \
+                               'GE_WLF__HHZ,NA,NA\n'
+
+        # codes longer than the fields are rejected, not truncated
+        avail_arr, sources = avail_append(
+            target_path, [['XX', 'LONGSTATION', '', 'BHZ', 0., 0., 0., 0.,
+                           'IRIS', 'XX_LONGSTATION__BHZ', 'NA', 'NA']])
+        assert len(avail_arr) == 0
+        assert len(avail_load(target_path)[0]) == 3
+
+        # availability.txt of an older version
+        shutil.rmtree(os.path.join(target_path, 'info'))
+        os.mkdir(os.path.join(target_path, 'info'))
+        txt_fio = open(os.path.join(target_path, 'info', 'availability.txt'),
+                       'wt')
+        txt_fio.writelines('IU,ANMO,00,BHZ,34.9,-106.5,1850.0,100.0,IRIS,'
+                           'IU_ANMO_00_BHZ,0.0,-90.0\n')
+        txt_fio.close()
+        avail_arr, sources = avail_load(target_path)
+        assert len(avail_arr) == 1
+        assert list(avail_rows(avail_arr, sources)[0][:4]) == \
+            ['IU', 'ANMO', '00', 'BHZ']
+    finally:
+        shutil.rmtree(target_path)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_client_handler.py
+#   Purpose:   testing the cached service discovery of FDSN clients
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import os
+import shutil
+import tempfile
+import time
+
+from obspyDMT.utils import client_handler
+from obspyDMT.utils.client_handler import read_services, write_services
+from obspyDMT.utils.client_handler import services_cache_path
+from obspyDMT.utils.client_handler import fdsn_client, event_client
+
+# ##################### test_services_cache #############################
+
+
+def test_services_cache():
+    home_orig = os.environ.get('HOME')
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='dmt_services_')
+    try:
+        base_url = 'http://service.example.org'
+        services = {'dataselect': {'network': {'required': False}},
+                    'station': {}}
+        assert read_services(base_url, 24) is None
+        write_services(base_url, services)
+        assert read_services(base_url, 24) == services
+        # disabled cache
+        assert read_services(base_url, 0) is None
+        # another data center
+        assert read_services('http://other.example.org', 24) is None
+
+        # expired
+        cache_path = services_cache_path(base_url)
+        t_old = time.time() - 25*3600.
+        os.utime(cache_path, (t_old, t_old))
+        assert read_services(base_url, 24) is None
+        assert read_services(base_url, 48) == services
+    finally:
+        shutil.rmtree(os.environ['HOME'], ignore_errors=True)
+        if home_orig is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = home_orig
+
+# ##################### test_shared_client ##############################
+
+
+def test_shared_client(monkeypatch):
+    created = []
+
+    def new_client(base_url, user, password, timeout, ttl):
+        created.append((base_url, timeout))
+        return len(created)
+
+    monkeypatch.setattr(client_handler, 'clients', {})
+    monkeypatch.setattr(client_handler, 'new_fdsn_client', new_client)
+    monkeypatch.setitem(client_handler.URL_MAPPINGS, 'DMT_TEST',
+                        'http://127.0.0.1:8001')
+    input_dics = {'req_timeout': 30, 'username_fdsn': None,
+                  'password_fdsn': None, 'services_ttl': 24}
+    # one client per data center, shared by the events
+    assert fdsn_client(input_dics, 'dmt_test') == 1
+    assert fdsn_client(input_dics, 'DMT_TEST') == 1
+    assert event_client(input_dics, 'DMT_TEST') == 2
+    assert event_client(input_dics, 'DMT_TEST') == 2
+    assert created == [('DMT_TEST', 30), ('DMT_TEST', 30)]
+
+    # the name is mapped to another server
+    client_handler.URL_MAPPINGS['DMT_TEST'] = 'http://127.0.0.1:8002'
+    assert fdsn_client(input_dics, 'DMT_TEST') == 3
+    assert event_client(input_dics, 'DMT_TEST') == 4
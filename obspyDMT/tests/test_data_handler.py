@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_data_handler.py
+#   Purpose:   testing the bulk requests of the station responses
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import numpy as np
+from obspy import read, read_inventory, Stream, Trace, UTCDateTime
+import os
+import shutil
+import tempfile
+import time
+
+from obspyDMT.tests.test_response_handler import stationxml
+from obspyDMT.utils import data_handler
+from obspyDMT.utils.data_handler import split_bulk_inventory
+from obspyDMT.utils.data_handler import fdsn_bulk_response
+from obspyDMT.utils.data_handler import fdsn_download_core
+from obspyDMT.utils.data_handler import coalesce_stas, fdsn_coalesce_core
+from obspyDMT.utils.data_handler import syngine_bulk_request
+from obspyDMT.utils.data_handler import update_sta_ev_file
+from obspyDMT.utils.availability_handler import avail_append, avail_path
+from obspyDMT.utils.metrics_handler import read_metrics
+from obspyDMT.utils.input_handler import command_parse, read_input_command
+
+# ##################### bulk_inputs #####################################
+
+
+def bulk_inputs():
+    return {'force_response': False, 'response_cache': False,
+            'cut_time_phase': False, 'state_db': False, 'metrics': False,
+            'bulk_chunk': 1000, 'req_parallel': True, 'req_np': 4}
+
+
+def bulk_target():
+    target_path = tempfile.mkdtemp(prefix='dmt_bulk_')
+    os.mkdir(os.path.join(target_path, 'resp'))
+    os.mkdir(os.path.join(target_path, 'info'))
+    return target_path
+
+
+def core_inputs(datapath, **kwargs):
+    """
+    default input_dics of obspyDMT, changed by kwargs
+    """
+    (options, args, parser) = command_parse()
+    input_dics = read_input_command(parser)
+    input_dics['datapath'] = datapath
+    input_dics.update(kwargs)
+    return input_dics
+
+
+def event_target(datapath, event_id):
+    target_path = os.path.join(datapath, event_id)
+    for sub_dir in ['raw', 'resp', 'info']:
+        os.makedirs(os.path.join(target_path, sub_dir))
+    return target_path
+
+# ##################### test_split_bulk_inventory #######################
+
+
+def test_split_bulk_inventory():
+    target_path = bulk_target()
+    t_start = UTCDateTime(2010, 1, 1)
+    t_end = UTCDateTime(2010, 1, 2)
+    try:
+        # example inventory of obspy: GR.FUR, GR.WET and BW.RJOB
+        bulk_chunk = [('GR', 'FUR', '--', 'BHZ', t_start, t_end),
+                      ('BW', 'RJOB', '--', 'EHZ', t_start, t_end),
+                      ('XX', 'NONE', '--', 'BHZ', t_start, t_end),
+                      ('GR', 'WET', '--', 'BHZ',
+                       UTCDateTime(1990, 1, 1), UTCDateTime(1990, 1, 2))]
+        assert split_bulk_inventory(read_inventory(), bulk_chunk,
+                                    {'event_id': 'x'}, target_path,
+                                    bulk_inputs(), False) == 2
+        assert sorted(os.listdir(os.path.join(target_path, 'resp'))) == \
+            ['STXML.BW.RJOB..EHZ', 'STXML.GR.FUR..BHZ']
+        st_inv = read_inventory(os.path.join(target_path, 'resp',
+                                             'STXML.BW.RJOB..EHZ'))
+        assert st_inv.get_contents()['channels'] == ['BW.RJOB..EHZ']
+        assert st_inv[0][0][0].response is not None
+    finally:
+        shutil.rmtree(target_path)
+
+# ##################### test_bulk_response_error ########################
+
+
+def test_bulk_response_error(monkeypatch):
+    class FakeClient(object):
+        def __init__(self):
+            self.requests = 0
+
+        def get_stations_bulk(self, bulk, level=None):
+            self.requests += 1
+            if self.requests == 1:
+                raise Exception('HTTP Error 500')
+            return read_inventory()
+
+    client = FakeClient()
+    monkeypatch.setattr(data_handler, 'fdsn_client_init',
+                        lambda input_dics, req_cli: (client, None))
+    target_path = bulk_target()
+    event = {'event_id': 'x', 't1': UTCDateTime(2010, 1, 1),
+             't2': UTCDateTime(2010, 1, 2)}
+    input_dics = bulk_inputs()
+    input_dics['bulk_chunk'] = 1
+    try:
+        # the failing chunk does not stop the next one
+        fdsn_bulk_response([['GR', 'FUR', '', 'BHZ'],
+                            ['BW', 'RJOB', '', 'EHZ']], event, target_path,
+                           'IRIS', input_dics)
+        assert client.requests == 2
+        assert os.listdir(os.path.join(target_path, 'resp')) == \
+            ['STXML.BW.RJOB..EHZ']
+        exc_fio = open(os.path.join(target_path, 'info', 'exception'), 'rt')
+        assert 'chunk 1/2 -- HTTP Error 500' in exc_fio.read()
+        exc_fio.close()
+    finally:
+        shutil.rmtree(target_path)
+
+# ##################### test_response_cache_hits ########################
+
+
+def test_response_cache_hits(monkeypatch):
+    class FakeClient(object):
+        def __init__(self):
+            self.requests = 0
+
+        def get_stations(self, filename=None, **kwargs):
+            self.requests += 1
+            # open epoch, closed by the cache at the time of the download
+            stationxml(filename, '2000-01-01T00:00:00')
+
+    stored = []
+    cache_store = data_handler.cache_store
+    monkeypatch.setattr(data_handler, 'cache_store',
+                        lambda *args: stored.append(args) or
+                        cache_store(*args))
+    datapath = tempfile.mkdtemp(prefix='dmt_core_')
+    client = FakeClient()
+    try:
+        input_dics = core_inputs(datapath, waveform=False,
+                                 response_cache=True)
+        for event_id in ['20110311_054624.a', '20110312_054624.a',
+                         '20110313_054624.a']:
+            event = {'event_id': event_id,
+                     't1': UTCDateTime(2011, 3, 11),
+                     't2': UTCDateTime(2011, 3, 11, 1)}
+            target_path = event_target(datapath, event_id)
+            fdsn_download_core(['IU', 'ANMO', '00', 'BHZ'], event,
+                               input_dics, target_path, client, None,
+                               'IRIS', '[test]')
+            assert os.path.isfile(os.path.join(target_path, 'resp',
+                                               'STXML.IU.ANMO.00.BHZ'))
+        # one download, two hits and one entry in the index
+        assert client.requests == 1
+        assert len(stored) == 1
+        assert len(os.listdir(os.path.join(datapath, 'RESPONSE-CACHE',
+                                           'index', 'IU.ANMO.00.BHZ'))) == 1
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_coalesce_core ##############################
+
+
+def test_coalesce_core(monkeypatch):
+    class FakeClient(object):
+        def __init__(self):
+            self.requests = []
+
+        def get_waveforms(self, network, station, location, channel,
+                          starttime, endtime):
+            self.requests.append((station, location, channel))
+            st = Stream()
+            for loc in location.split(','):
+                for cha in channel.split(','):
+                    st.append(Trace(
+                        data=np.arange(100, dtype=np.int32),
+                        header={'network': network, 'station': station,
+                                'location': loc.replace('--', ''),
+                                'channel': cha, 'starttime': starttime}))
+            return st
+
+    states = []
+    monkeypatch.setattr(data_handler, 'state_update',
+                        lambda input_dics, event, st_id, product, status,
+                        **kwargs: states.append((st_id, status)))
+    datapath = tempfile.mkdtemp(prefix='dmt_coalesce_')
+    client = FakeClient()
+    event = {'event_id': '20110311_054624.a', 't1': UTCDateTime(2011, 3, 11),
+             't2': UTCDateTime(2011, 3, 11, 1)}
+    try:
+        input_dics = core_inputs(datapath, response=False, metrics=True)
+        target_path = event_target(datapath, event['event_id'])
+        stas_avail = [['IU', 'ANMO', '00', 'BHZ'], ['IU', 'ANMO', '00', 'BHE'],
+                      ['IU', 'ANMO', '10', 'BHZ'], ['II', 'AAK', '--', 'BHZ']]
+        st_groups = coalesce_stas(stas_avail, event, input_dics)
+        assert [len(st_group) for st_group in st_groups] == [3, 1]
+        for st_group in st_groups:
+            fdsn_coalesce_core(st_group, event, input_dics, target_path,
+                               client, None, 'IRIS', '[test]')
+        # one request per station, split back per channel
+        assert client.requests == [('ANMO', '00,10', 'BHE,BHZ'),
+                                   ('AAK', '--', 'BHZ')]
+        raw_files = sorted(os.listdir(os.path.join(target_path, 'raw')))
+        assert raw_files == ['II.AAK..BHZ', 'IU.ANMO.00.BHE',
+                             'IU.ANMO.00.BHZ', 'IU.ANMO.10.BHZ']
+        tr = read(os.path.join(target_path, 'raw', 'IU.ANMO.00.BHE'))
+        assert [tr_raw.id for tr_raw in tr] == ['IU.ANMO.00.BHE']
+
+        # in-flight before the request, done after the split
+        assert [state for state in states if state[1] == 'in-flight'] == \
+            [('IU.ANMO.00.BHZ', 'in-flight'), ('IU.ANMO.00.BHE', 'in-flight'),
+             ('IU.ANMO.10.BHZ', 'in-flight'), ('II.AAK..BHZ', 'in-flight')]
+        assert states.index(('IU.ANMO.10.BHZ', 'in-flight')) < \
+            states.index(('IU.ANMO.00.BHZ', 'done'))
+
+        # bytes of the written files
+        metrics = read_metrics([os.path.join(target_path, 'info',
+                                             'metrics.jsonl')])
+        assert len(metrics) == 2
+        assert metrics[0]['bytes'] == sum(
+            [os.path.getsize(os.path.join(target_path, 'raw', st_id))
+             for st_id in raw_files if st_id.startswith('IU')])
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_syngine_bulk ###############################
+
+
+def test_syngine_bulk(monkeypatch):
+    class FakeSyngine(object):
+        def __init__(self):
+            self.requests = []
+
+        def get_waveforms_bulk(self, model, bulk, components, starttime,
+                               **kwargs):
+            self.requests.append(([rcv['stationcode'] for rcv in bulk],
+                                  components))
+            st = Stream()
+            for rcv in bulk:
+                for component in components:
+                    st.append(Trace(
+                        data=np.arange(100, dtype=np.float32),
+                        header={'network': rcv['networkcode'],
+                                'station': rcv['stationcode'],
+                                'location': 'SE', 'channel': 'MX%s'
+                                % component, 'starttime': starttime}))
+            return st
+
+    client = FakeSyngine()
+    monkeypatch.setattr(data_handler, 'syngine_client',
+                        lambda req_timeout: client)
+    datapath = tempfile.mkdtemp(prefix='dmt_syngine_')
+    event = {'event_id': '20110311_054624.a', 't1': UTCDateTime(2011, 3, 11),
+             't2': UTCDateTime(2011, 3, 11, 1), 'latitude': 38.3,
+             'longitude': 142.4, 'depth': 20., 'focal_mechanism': False,
+             'datetime': UTCDateTime(2011, 3, 11)}
+    try:
+        input_dics = core_inputs(datapath, syngine=True, bulk_chunk=2)
+        target_path = event_target(datapath, event['event_id'])
+        stas_avail = []
+        for sta in ['ANMO', 'COLA', 'HRV']:
+            for cha in ['BHZ', 'BH1']:
+                stas_avail.append(['IU', sta, '00', cha, 34., -106.])
+        stas_avail.append(['II', 'AAK', '--', 'BHZ', 42., 74.])
+        syngine_bulk_request(stas_avail, event, input_dics, target_path,
+                             'IRIS')
+        # receivers with the same components, at most bulk_chunk of them
+        # in one request
+        assert sorted(client.requests) == [(['AAK'], 'Z'),
+                                           (['ANMO', 'COLA'], 'EZ'),
+                                           (['HRV'], 'EZ')]
+        syn_dir = os.path.join(target_path, 'syngine_%s'
+                               % input_dics['syngine_bg_model'])
+        assert sorted(os.listdir(syn_dir)) == \
+            ['II.AAK..BHZ', 'IU.ANMO.00.BHE', 'IU.ANMO.00.BHZ',
+             'IU.COLA.00.BHE', 'IU.COLA.00.BHZ', 'IU.HRV.00.BHE',
+             'IU.HRV.00.BHZ']
+        syn_tr = read(os.path.join(syn_dir, 'IU.COLA.00.BHE'))
+        assert [tr.id for tr in syn_tr] == ['IU.COLA.00.BHE']
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_update_sta_ev_file #########################
+
+
+def test_update_sta_ev_file():
+    datapath = tempfile.mkdtemp(prefix='dmt_sta_ev_')
+    event = {'event_id': '20110311_054624.a', 'latitude': 38.3,
+             'longitude': 142.4, 'depth': 20.0, 'magnitude': 9.1}
+    sta_ev_add = os.path.join(datapath, event['event_id'], 'info',
+                              'station_event')
+    # lines of the former implementation (availability + event + '10')
+    sta_ev_lines = {
+        'IU.ANMO.00.BHZ': 'IU,ANMO,00,BHZ,34.9,-106.5,1850.0,100.0,IRIS,'
+                          '20110311_054624.a,38.3,142.4,20.0,9.1,0.0,'
+                          '-90.0,10,\n',
+        'IU.ANMO.00.BHE': 'IU,ANMO,00,BHE,34.9,-106.5,1850.0,100.0,IRIS,'
+                          '20110311_054624.a,38.3,142.4,20.0,9.1,90.0,'
+                          '0.0,10,\n',
+        'GE.WLF..HHZ': 'GE,WLF,,HHZ,49.7,6.2,295.0,0.0,ARCLINK,'
+                       '20110311_054624.a,38.3,142.4,20.0,9.1,NA,NA,10,\n'}
+
+    def raw_save(st_id):
+        open(os.path.join(target_path, 'raw', st_id), 'wb').close()
+
+    def sta_ev_read():
+        sta_ev_fio = open(sta_ev_add, 'rt')
+        lines = sta_ev_fio.readlines()
+        sta_ev_fio.close()
+        return lines
+
+    try:
+        target_path = event_target(datapath, event['event_id'])
+        avail_append(target_path, [
+            ['IU', 'ANMO', '00', 'BHZ', 34.9, -106.5, 1850., 100.,
+             'IRIS', 'IU_ANMO_00_BHZ', 0., -90.],
+            ['IU', 'ANMO', '00', 'BHE', 34.9, -106.5, 1850., 100.,
+             'IRIS', 'IU_ANMO_00_BHE', 90., 0.],
+            ['GE', 'WLF', '', 'HHZ', 49.7, 6.2, 295., 0.,
+             'ARCLINK', 'GE_WLF__HHZ', 'NA', 'NA'],
+            ['IU', 'COLA', '00', 'BHZ', 64.9, -147.8, 200., 0.,
+             'IRIS', 'IU_COLA_00_BHZ', 0., -90.]])
+        # saved channels, a leftover of an unfinished request and a
+        # channel without availability
+        raw_save('IU.ANMO.00.BHZ')
+        raw_save('GE.WLF..HHZ')
+        raw_save('IU.ANMO.00.BHE.part1234_0')
+        raw_save('XX.NONE.00.BHZ')
+        update_sta_ev_file(target_path, event)
+        assert sta_ev_read() == [sta_ev_lines['GE.WLF..HHZ'],
+                                 sta_ev_lines['IU.ANMO.00.BHZ']]
+
+        # a new channel is appended
+        t_now = time.time()
+        os.utime(avail_path(target_path), (t_now - 20, t_now - 20))
+        os.utime(sta_ev_add, (t_now - 10, t_now - 10))
+        raw_save('IU.ANMO.00.BHE')
+        update_sta_ev_file(target_path, event)
+        assert sta_ev_read() == [sta_ev_lines['GE.WLF..HHZ'],
+                                 sta_ev_lines['IU.ANMO.00.BHZ'],
+                                 sta_ev_lines['IU.ANMO.00.BHE']]
+
+        # a removed channel: the file is rebuilt
+        os.utime(sta_ev_add, (t_now - 10, t_now - 10))
+        os.remove(os.path.join(target_path, 'raw', 'GE.WLF..HHZ'))
+        update_sta_ev_file(target_path, event)
+        assert sta_ev_read() == [sta_ev_lines['IU.ANMO.00.BHE'],
+                                 sta_ev_lines['IU.ANMO.00.BHZ']]
+    finally:
+        shutil.rmtree(datapath)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_download_benchmark.py
+#   Purpose:   end-to-end download benchmark against a local mock
+#              FDSN server (serial, --req_parallel and --bulk)
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+from __future__ import print_function
+from glob import glob
+import json
+import os
+import pytest
+import shutil
+import sys
+import tempfile
+import time
+
+from obspyDMT.tests.mock_fdsn_server import MockFDSNServer, FIXTURE_DIR
+from obspyDMT.utils.input_handler import command_parse, read_input_command
+
+# name --> options of each benchmarked download mode
+BENCHMARK_MODES = [
+    ('serial', {}),
+    ('req_parallel', {'req_parallel': True, 'req_np': 8}),
+    ('bulk', {'bulk': True, 'req_parallel': True, 'req_np': 8}),
+]
+
+# the end-to-end benchmarks are slow, they run with DMT_SLOW_TESTS=1
+slow = pytest.mark.skipif(not os.environ.get('DMT_SLOW_TESTS'),
+                          reason='slow test, set DMT_SLOW_TESTS=1 to run it')
+
+# ##################### benchmark_input #################################
+
+
+def benchmark_input(datapath, data_source, mode_options):
+    """
+    input_dics of one benchmark run (one event, no processing)
+    :param datapath:
+    :param data_source: name of the mock server in URL_MAPPINGS
+    :param mode_options:
+    :return:
+    """
+    (options, args, parser) = command_parse()
+    input_dics = read_input_command(parser)
+
+    input_dics['datapath'] = datapath
+    input_dics['min_date'] = '2011-03-10'
+    input_dics['max_date'] = '2011-03-12'
+    input_dics['min_mag'] = 8.9
+    input_dics['event_catalog'] = data_source
+    input_dics['data_source'] = [data_source]
+    input_dics['net'] = '*'
+    input_dics['sta'] = '*'
+    input_dics['loc'] = '*'
+    input_dics['cha'] = '*'
+    input_dics['offset'] = 1800
+    input_dics['pre_process'] = False
+    input_dics['plot'] = False
+    input_dics.update(mode_options)
+    return input_dics
+
+# ##################### run_benchmark ###################################
+
+
+def run_benchmark(server, data_source, modes=BENCHMARK_MODES):
+    """
+    run dmt_core against the mock server once per download mode
+    :param server: running MockFDSNServer
+    :param data_source: name of the server in URL_MAPPINGS
+    :param modes: list of (name, options)
+    :return: list of results (one dictionary per mode)
+    """
+    results = []
+    # the caches of ~/.obspyDMT (services, rates, travel times) are kept
+    # in a temporary home directory
+    home_env = dict([(key, os.environ.get(key))
+                     for key in ['HOME', 'USERPROFILE']])
+    home_dir = tempfile.mkdtemp(prefix='dmt_benchmark_home_')
+    for key in home_env:
+        os.environ[key] = home_dir
+    try:
+        for mode, mode_options in modes:
+            results.append(run_mode(server, data_source, mode,
+                                    mode_options))
+    finally:
+        for key, value in home_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(home_dir, ignore_errors=True)
+    return results
+
+# ##################### run_mode ########################################
+
+
+def run_mode(server, data_source, mode, mode_options):
+    """
+    run dmt_core against the mock server for one download mode
+    :param server: running MockFDSNServer
+    :param data_source: name of the server in URL_MAPPINGS
+    :param mode: name of the mode
+    :param mode_options:
+    :return: result of the mode (dictionary)
+    """
+    from obspyDMT import obspyDMT
+    datapath = tempfile.mkdtemp(prefix='dmt_benchmark_%s_' % mode)
+    try:
+        input_dics = benchmark_input(datapath, data_source, mode_options)
+        server.reset_stats()
+        t_start = time.time()
+        obspyDMT.dmt_core(input_dics)
+        wall_time = time.time() - t_start
+        stats = dict(server.stats)
+        result = {
+            'mode': mode,
+            'wall_time': wall_time,
+            'queries': stats['queries'],
+            'errors': stats['errors'],
+            'mbytes': stats['bytes']/1024.**2,
+            'req_per_s': stats['queries']/wall_time,
+            'mb_per_s': stats['bytes']/1024.**2/wall_time,
+            'raw': len(glob(os.path.join(datapath, '*', 'raw', '*'))),
+            'resp': len(glob(os.path.join(datapath, '*', 'resp', '*'))),
+        }
+    finally:
+        shutil.rmtree(datapath, ignore_errors=True)
+    return result
+
+# ##################### benchmark_report ################################
+
+
+def benchmark_report(results, report_path=None):
+    """
+    print the benchmark results (and write them to a JSON file)
+    :param results:
+    :param report_path:
+    :return:
+    """
+    print('\n%-14s %9s %8s %7s %8s %8s %6s %6s'
+          % ('mode', 'wall (s)', 'queries', 'errors', 'req/s', 'MB/s',
+             'raw', 'resp'))
+    for result in results:
+        print('%-14s %9.2f %8i %7i %8.1f %8.2f %6i %6i'
+              % (result['mode'], result['wall_time'], result['queries'],
+                 result['errors'], result['req_per_s'], result['mb_per_s'],
+                 result['raw'], result['resp']))
+    if report_path:
+        report_fio = open(report_path, 'wt')
+        json.dump(results, report_fio, indent=2)
+        report_fio.close()
+
+# ##################### test_download_benchmark #########################
+
+
+@pytest.mark.slow
+@slow
+def test_download_benchmark():
+    with MockFDSNServer(fixture_dir=FIXTURE_DIR, latency=0.05) as server:
+        data_source = server.register('MOCK')
+        results = run_benchmark(server, data_source)
+    benchmark_report(results)
+
+    num_channels = len(server.channels)
+    for result in results:
+        assert result['raw'] == num_channels
+        assert result['resp'] == num_channels
+        assert result['errors'] == 0
+
+# ##################### test_download_benchmark_errors ##################
+
+
+@pytest.mark.slow
+@slow
+def test_download_benchmark_errors():
+    # transient errors are retried (--req_retry)
+    with MockFDSNServer(fixture_dir=FIXTURE_DIR, error_rate=0.3,
+                        seed=2) as server:
+        data_source = server.register('MOCK')
+        results = run_benchmark(
+            server, data_source,
+            modes=[('req_parallel', {'req_parallel': True, 'req_np': 4,
+                                     'req_retry': 10})])
+    benchmark_report(results)
+    assert results[0]['errors'] > 0
+    assert results[0]['raw'] == len(server.channels)
+
+# ##################### main ############################################
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--stations', type='int', default=50,
+                      help='number of synthetic stations (3 channels each)')
+    parser.add_option('--latency', type='float', default=0.1,
+                      help='latency of each query in seconds')
+    parser.add_option('--bandwidth', type='float', default=None,
+                      help='bandwidth of each request in MB/s')
+    parser.add_option('--error_rate', type='float', default=0.,
+                      help='fraction of the queries answered with HTTP 503')
+    parser.add_option('--slow_rate', type='float', default=0.,
+                      help='fraction of the queries delayed by --slow')
+    parser.add_option('--slow', type='float', default=2.,
+                      help='additional delay of the slow queries (seconds)')
+    parser.add_option('--report', default=None,
+                      help='write the results to this JSON file')
+    (options, args) = parser.parse_args()
+    # obspyDMT options are set by benchmark_input
+    sys.argv = sys.argv[:1]
+
+    bandwidth = options.bandwidth*1024.**2 if options.bandwidth else None
+    with MockFDSNServer(num_stations=options.stations,
+                        latency=options.latency, bandwidth=bandwidth,
+                        error_rate=options.error_rate,
+                        slow_rate=options.slow_rate,
+                        slow_latency=options.slow) as server:
+        benchmark_report(run_benchmark(server, server.register('MOCK')),
+                         options.report)
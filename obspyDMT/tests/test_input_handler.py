@@ -35,18 +35,18 @@ def test_read_input_command():
     assert len(parser.option_groups[0].option_list) == 3
     assert len(parser.option_groups[1].option_list) == 2
     assert len(parser.option_groups[2].option_list) == 4
-    assert len(parser.option_groups[3].option_list) == 14
+    assert len(parser.option_groups[3].option_list) == 15
     assert len(parser.option_groups[4].option_list) == 9
     assert len(parser.option_groups[5].option_list) == 7
-    assert len(parser.option_groups[6].option_list) == 5
+    assert len(parser.option_groups[6].option_list) == 25
     assert len(parser.option_groups[7].option_list) == 6
     assert len(parser.option_groups[8].option_list) == 11
-    assert len(parser.option_groups[9].option_list) == 1
+    assert len(parser.option_groups[9].option_list) == 2
     assert len(parser.option_groups[10].option_list) == 7
-    assert len(parser.option_groups[11].option_list) == 6
+    assert len(parser.option_groups[11].option_list) == 7
     assert len(parser.option_groups[12].option_list) == 17
     assert len(parser.option_groups[13].option_list) == 13
-    assert len(parser.option_groups[14].option_list) == 3
+    assert len(parser.option_groups[14].option_list) == 4
 
     input_dics = read_input_command(parser)
 
@@ -90,7 +90,20 @@ def test_default_inputs():
     assert input_dics['mlon_rbb'] is None
     assert input_dics['Mlon_rbb'] is None
     assert input_dics['req_np'] == 4
+    assert input_dics['req_np_total'] is False
+    assert input_dics['req_engine'] == 'obspy'
+    assert input_dics['session_np'] == 50
+    assert input_dics['req_adaptive'] is False
+    assert input_dics['req_retry'] == 0
+    assert input_dics['req_timeout'] == 120
+    assert input_dics['req_hedge'] is False
+    assert input_dics['services_ttl'] == 24
+    assert input_dics['inventory_ttl'] == 24
+    assert input_dics['response_cache_dir'] is None
+    assert input_dics['state_retry'] == 'all'
+    assert input_dics['bulk_chunk'] == 500
     assert input_dics['process_np'] == 4
+    assert input_dics['pipeline_queue'] == 2
     assert input_dics['username_fdsn'] is None
     assert input_dics['password_fdsn'] is None
     assert input_dics['username_arclink'] == 'test@obspy.org'
@@ -112,6 +125,7 @@ def test_default_inputs():
     assert input_dics['evradmin'] is None
     assert input_dics['evradmax'] is None
     assert input_dics['interval'] == 3600*24
+    assert input_dics['continuous_block'] is False
     assert input_dics['pre_process'] == 'process_unit'
     assert input_dics['select_data'] is False
     assert input_dics['corr_unit'] == 'DIS'
@@ -132,6 +146,7 @@ def test_default_inputs():
     assert input_dics['plotxml_output'] == 'VEL'
     assert input_dics['email'] is False
     assert input_dics['arc_avai_timeout'] == 40
+    assert input_dics['avail_timeout'] == 0
     assert input_dics['arc_wave_timeout'] == 2
 
 # ##################### test_tour ###############################
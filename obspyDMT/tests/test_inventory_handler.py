@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_inventory_handler.py
+#   Purpose:   testing the local availability of the inventory cache
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import numpy as np
+from obspy import UTCDateTime
+import os
+import shutil
+import tempfile
+
+from obspyDMT.utils import inventory_handler
+from obspyDMT.utils.inventory_handler import code_mask, inventory_filter
+from obspyDMT.utils.inventory_handler import inventory_load, inventory_path
+
+# ##################### inventory_inputs ################################
+
+
+def inventory_inputs(**kwargs):
+    input_dics = {'net': '*', 'sta': '*', 'loc': '*', 'cha': '*',
+                  'mlat_rbb': None, 'Mlat_rbb': None,
+                  'mlon_rbb': None, 'Mlon_rbb': None,
+                  'lat_cba': None, 'lon_cba': None,
+                  'mr_cba': None, 'Mr_cba': None}
+    input_dics.update(kwargs)
+    return input_dics
+
+
+def inventory_test():
+    t_2010 = UTCDateTime(2010, 1, 1).timestamp
+    t_2012 = UTCDateTime(2012, 1, 1).timestamp
+    return {'codes': np.array([['IU', 'ANMO', '00', 'BHZ'],
+                               ['IU', 'ANMO', '10', 'BHZ'],
+                               ['II', 'AAK', '', 'BHZ'],
+                               ['GE', 'WLF', '', 'HHZ']],
+                              dtype=np.unicode_),
+            'coords': np.array([[34.9, -106.5, 1850., 100.],
+                                [34.9, -106.5, 1850., 0.],
+                                [42.6, 74.5, 1633., 30.],
+                                [49.7, 6.2, 295., 0.]]),
+            'orient': np.array([[0., -90.], [0., -90.],
+                                [np.nan, np.nan], [0., -90.]]),
+            'epochs': np.array([[-np.inf, np.inf],
+                                [-np.inf, t_2010],
+                                [t_2010, t_2012],
+                                [t_2012, np.inf]]),
+            'span': np.array([-np.inf, np.inf])}
+
+# ##################### test_code_mask ##################################
+
+
+def test_code_mask():
+    codes = np.array(['00', '10', '', 'BHZ'], dtype=np.unicode_)
+    assert list(code_mask(codes, '*')) == [True]*4
+    assert list(code_mask(codes, '--')) == [False, False, True, False]
+    assert list(code_mask(codes, '00,--')) == [True, False, True, False]
+    assert list(code_mask(codes, 'BH?')) == [False, False, False, True]
+    assert len(code_mask(codes[:0], '*')) == 0
+
+# ##################### test_inventory_filter ###########################
+
+
+def test_inventory_filter():
+    inv = inventory_test()
+    event = {'t1': UTCDateTime(2011, 3, 11), 't2': UTCDateTime(2011, 3, 12)}
+    # channel epochs
+    assert list(inventory_filter(inv, inventory_inputs(), event)) == \
+        [True, False, True, False]
+    # channel codes
+    assert list(inventory_filter(inv, inventory_inputs(net='II,GE'),
+                                 event)) == [False, False, True, False]
+    # rectangle
+    assert list(inventory_filter(inv, inventory_inputs(mlon_rbb=0.,
+                                                       Mlon_rbb=180.),
+                                 event)) == [False, False, True, False]
+    # circle around ANMO
+    assert list(inventory_filter(inv, inventory_inputs(lat_cba=34.9,
+                                                       lon_cba=-106.5,
+                                                       mr_cba=0.,
+                                                       Mr_cba=10.),
+                                 event)) == [True, False, False, False]
+
+# ##################### test_inventory_load #############################
+
+
+def test_inventory_load(monkeypatch):
+    datapath = tempfile.mkdtemp(prefix='dmt_inventory_')
+    fetched = []
+
+    def inventory_fetch(input_dics, data_source, span, target_path):
+        fetched.append(span)
+        return dict(inventory_test(), span=np.array(span, dtype=float))
+
+    monkeypatch.setattr(inventory_handler, 'inventory_fetch',
+                        inventory_fetch)
+    monkeypatch.setattr(inventory_handler, 'inventories', {})
+    try:
+        input_dics = inventory_inputs(datapath=datapath, username_fdsn=None,
+                                      inventory_ttl=24)
+        inventory_load(input_dics, 'IRIS', (0., 10.), datapath)
+        assert len(fetched) == 1
+        # from the cache file in a new run
+        inventory_handler.inventories.clear()
+        inventory_load(input_dics, 'IRIS', (2., 8.), datapath)
+        assert len(fetched) == 1
+        # the span is extended
+        inventory_load(input_dics, 'IRIS', (5., 20.), datapath)
+        assert fetched[-1] == (0., 20.)
+        # another request has its own cache file
+        assert inventory_path(input_dics, 'IRIS') != \
+            inventory_path(dict(input_dics, cha='HH?'), 'IRIS')
+        # the cache file expires
+        inventory_handler.inventories.clear()
+        inv_path = inventory_path(input_dics, 'IRIS')
+        os.utime(inv_path, (0., 0.))
+        inventory_load(input_dics, 'IRIS', (2., 8.), datapath)
+        assert fetched[-1] == (2., 8.)
+        assert len(fetched) == 3
+    finally:
+        shutil.rmtree(datapath)
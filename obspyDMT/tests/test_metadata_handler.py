@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_metadata_handler.py
+#   Purpose:   testing the availability check of the data sources
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from obspyDMT.tests.test_data_handler import core_inputs
+from obspyDMT.utils import metadata_handler
+from obspyDMT.utils.metadata_handler import fdsn_text_available
+from obspyDMT.utils.metadata_handler import get_metadata
+from obspyDMT.utils.metadata_handler import text_unsupported
+
+# ##################### TextClient ######################################
+
+
+class TextClient(object):
+    """
+    get_stations of a FDSN client which answers with content
+    """
+    def __init__(self, content):
+        self.content = content
+
+    def get_stations(self, filename=None, **kwargs):
+        if isinstance(self.content, Exception):
+            raise self.content
+        filename.write(self.content)
+
+# ##################### test_fdsn_text_available ########################
+
+
+def test_fdsn_text_available():
+    content = b'#Network|Station|Location|Channel|Latitude|Longitude|' \
+              b'Elevation|Depth|Azimuth|Dip|SensorDescription|Scale|' \
+              b'ScaleFreq|ScaleUnits|SampleRate|StartTime|EndTime\n' \
+              b'IU|ANMO|00|BHZ|34.9459|-106.4572|1850.0|100.0|0.0|-90.0|' \
+              b'STS-1|3.3e9|0.02|M/S|20.0|2008-06-30T00:00:00|\n' \
+              b'II|AAK||BHN|42.6375|74.4942|1633.1|30.0||0.0|' \
+              b'STS-1|3.3e9|0.02|M/S|20.0|2008-06-30T00:00:00|\n'
+    sta_text = fdsn_text_available(TextClient(content), 'TEXT', {})
+    assert sta_text == [
+        ['IU', 'ANMO', '00', 'BHZ', 34.9459, -106.4572, 1850.0, 100.0,
+         'TEXT', 'IU_ANMO_00_BHZ', 0.0, -90.0],
+        ['II', 'AAK', '', 'BHN', 42.6375, 74.4942, 1633.1, 30.0,
+         'TEXT', 'II_AAK__BHN', None, 0.0]]
+
+    # StationXML instead of text
+    assert fdsn_text_available(TextClient(b'<?xml version="1.0"?>'),
+                               'XML', {}) is None
+    assert 'XML' in text_unsupported
+    # format rejected by the data source
+    assert fdsn_text_available(TextClient(Exception('Bad request')),
+                               'REJECT', {}) is None
+    assert 'REJECT' in text_unsupported
+    # no data is not a reason to use StationXML
+    try:
+        fdsn_text_available(TextClient(Exception('No data available')),
+                            'NODATA', {})
+        assert False
+    except Exception as error:
+        assert 'No data' in str(error)
+    assert 'NODATA' not in text_unsupported
+
+# ##################### test_avail_timeout ##############################
+
+
+def test_avail_timeout(monkeypatch):
+    release = threading.Event()
+
+    def source_available(input_dics, cl, event, target_path):
+        src = input_dics['data_source'][cl]
+        if src == 'SLOW':
+            release.wait(10)
+        # module state of the availability check is kept
+        text_unsupported.add(src)
+        return [['IU', 'ANMO', '00', 'BH%s' % cl, 34.9459, -106.4572,
+                 1850.0, 100.0, src, 'IU_ANMO_00_BH%s' % cl, 0.0, -90.0]]
+
+    monkeypatch.setattr(metadata_handler, 'source_available',
+                        source_available)
+    datapath = tempfile.mkdtemp(prefix='dmt_avail_')
+    event = {'event_id': '20110311_054624.a', 'latitude': 38.3,
+             'longitude': 142.4}
+    try:
+        # SLOW does not answer in time
+        input_dics = core_inputs(datapath, data_source=['FAST', 'SLOW'],
+                                 avail_timeout=0.5)
+        t_start = time.time()
+        stas_avail = get_metadata(input_dics, event, 'timeout')
+        assert time.time() - t_start < 5.
+        assert [sta[3] for sta in stas_avail] == ['BH0']
+        assert 'FAST' in text_unsupported
+        exc_fio = open(os.path.join(datapath, event['event_id'], 'info',
+                                    'exception'), 'rt')
+        assert 'SLOW -- no answer after 0.5 sec' in exc_fio.read()
+        exc_fio.close()
+
+        # both data sources answer
+        release.set()
+        input_dics['avail_timeout'] = 5.
+        stas_avail = get_metadata(input_dics, event, 'normal')
+        assert sorted([sta[3] for sta in stas_avail]) == ['BH0', 'BH1']
+        assert 'SLOW' in text_unsupported
+    finally:
+        release.set()
+        shutil.rmtree(datapath)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_metrics_handler.py
+#   Purpose:   testing the metrics of the requests
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import os
+import shutil
+import tempfile
+
+from obspyDMT.utils.metrics_handler import record_metric, read_metrics
+from obspyDMT.utils.metrics_handler import aggregate_metrics, metric_status
+from obspyDMT.utils.metrics_handler import run_metrics_report
+
+# ##################### test_record_metric ##############################
+
+
+def test_record_metric():
+    datapath = tempfile.mkdtemp(prefix='dmt_metrics_')
+    target_path = os.path.join(datapath, '20110311_054624.a')
+    os.makedirs(os.path.join(target_path, 'info'))
+    try:
+        record_metric({'metrics': False}, target_path, 'IRIS', 'waveform',
+                      'IU.ANMO.00.BHZ', 1.)
+        assert os.listdir(os.path.join(target_path, 'info')) == []
+
+        input_dics = {'metrics': True, 'datapath': datapath}
+        record_metric(input_dics, target_path, 'IRIS', 'waveform',
+                      'IU.ANMO.00.BHZ', 1.5, n_bytes=1024**2)
+        record_metric(input_dics, target_path, 'IRIS', 'waveform',
+                      'IU.ANMO.00.BHN', 0.5,
+                      error=Exception('HTTP Error 503'), retries=2)
+        record_metric(input_dics, target_path, 'IRIS', 'waveform',
+                      'IU.ANMO.00.BHE', 0.5, error=ValueError('bad value'))
+        metrics = read_metrics([os.path.join(target_path, 'info',
+                                             'metrics.jsonl')])
+        assert [metric['status'] for metric in metrics] == [200, 503, None]
+        assert metrics[1]['error_class'] == 'throttled'
+        assert metrics[1]['retries'] == 2
+
+        report = run_metrics_report(input_dics)
+        stats = report['IRIS']['waveform']
+        assert stats['requests'] == 3
+        assert stats['errors'] == 2
+        assert stats['status'] == {'200': 1, '503': 1, 'unknown': 1}
+        assert os.path.isfile(os.path.join(datapath, 'metrics_report.json'))
+        prom_fio = open(os.path.join(datapath, 'metrics.prom'), 'rt')
+        prom_lines = prom_fio.read()
+        prom_fio.close()
+        assert 'obspydmt_requests_total{data_center="IRIS",' \
+               'product="waveform",status="unknown"} 1' in prom_lines
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_aggregate_metrics ##########################
+
+
+def test_aggregate_metrics():
+    # four requests of 2 s and 1 MB each, two in parallel
+    metrics = []
+    for t_end in [102., 102., 104., 104.]:
+        metrics.append({'time': t_end, 'data_center': 'IRIS',
+                        'product': 'waveform', 'st_id': 'IU.ANMO.00.BHZ',
+                        'latency': 2., 'bytes': 1024**2, 'status': 200,
+                        'retries': 0, 'error_class': None})
+    metrics[-1]['status'] = 'None'
+    stats = aggregate_metrics(metrics)['IRIS']['waveform']
+    assert stats['wall_time'] == 4.
+    assert stats['latency_sum'] == 8.
+    # throughput of the run and of one request
+    assert stats['mb_per_s'] == 1.
+    assert stats['request_mb_per_s'] == 0.5
+    assert stats['status'] == {'200': 3, 'unknown': 1}
+
+# ##################### test_metric_status ##############################
+
+
+def test_metric_status():
+    assert metric_status({'status': 200}) == '200'
+    assert metric_status({'status': '503'}) == '503'
+    assert metric_status({'status': None}) == 'unknown'
+    assert metric_status({'status': 'None'}) == 'unknown'
+    assert metric_status({}) == 'unknown'
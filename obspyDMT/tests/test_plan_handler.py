@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_plan_handler.py
+#   Purpose:   testing the download planner (--plan)
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import numpy as np
+
+from obspyDMT.utils.plan_handler import plan_event, plan_runtime
+from obspyDMT.utils.plan_handler import sample_rate, PLAN_DEFAULTS
+
+# ##################### plan_inputs #####################################
+
+
+def plan_inputs(**kwargs):
+    input_dics = {'datapath': './dmt_plan_dir_not_existing',
+                  'waveform': True, 'response': True, 'syngine': False,
+                  'force_waveform': False, 'force_response': False,
+                  'bulk': False, 'bulk_chunk': 500, 'req_coalesce': False,
+                  'req_parallel': False, 'req_np': 4, 'req_np_total': False}
+    input_dics.update(kwargs)
+    return input_dics
+
+
+def plan_avail():
+    stas_avail = []
+    for sta in ['A01', 'A02']:
+        for cha in ['BHZ', 'BHN', 'BHE']:
+            stas_avail.append(['XX', sta, '', cha, 0., 0., 0., 0., 'IRIS',
+                               'XX.%s..%s' % (sta, cha), 0., 0.])
+    stas_avail.append(['YY', 'B01', '00', 'LHZ', 0., 0., 0., 0., 'ORFEUS',
+                       'YY.B01.00.LHZ', 0., 0.])
+    return np.array(stas_avail, dtype=object)
+
+# ##################### test_sample_rate ################################
+
+
+def test_sample_rate():
+    assert sample_rate('BHZ') == 40.
+    assert sample_rate('HHZ') == 100.
+    assert sample_rate('LHZ') == 1.
+    assert sample_rate('XYZ') == 1.
+
+# ##################### test_plan_event #################################
+
+
+def test_plan_event():
+    event = {'event_id': '20110311_054623.a', 't1': 0., 't2': 1000.}
+    plans = plan_event(plan_avail(), event, plan_inputs(), {})
+    assert sorted(plans.keys()) == ['IRIS', 'ORFEUS']
+    assert plans['IRIS']['channels'] == 6
+    # one waveform and one response request per channel
+    assert plans['IRIS']['requests'] == 12
+    assert plans['IRIS']['bytes'] == \
+        6*(40.*1000.*PLAN_DEFAULTS['bytes_per_sample'] +
+           PLAN_DEFAULTS['resp_bytes'])
+    assert plans['ORFEUS']['requests'] == 2
+
+    # one waveform request per station
+    plans = plan_event(plan_avail(), event, plan_inputs(req_coalesce=True),
+                       {})
+    assert plans['IRIS']['requests'] == 2 + 6
+    # one waveform request per chunk of channels
+    plans = plan_event(plan_avail(), event,
+                       plan_inputs(bulk=True, bulk_chunk=4), {})
+    assert plans['IRIS']['requests'] == 2 + 6
+
+    # measured rates replace the defaults
+    plans = plan_event(plan_avail(), event,
+                       plan_inputs(response=False),
+                       {'IRIS': {'bytes_per_sample': 1., 'latency': 2.}})
+    assert plans['IRIS']['bytes'] == 6*40.*1000.
+    assert plans['IRIS']['seconds'] > 6*2.
+
+# ##################### test_plan_runtime ###############################
+
+
+def test_plan_runtime():
+    event_plans = [{'IRIS': {'seconds': 80.}, 'ORFEUS': {'seconds': 20.}},
+                   {'IRIS': {'seconds': 40.}}]
+    assert plan_runtime(event_plans, plan_inputs()) == 140.
+    # data centers in parallel, 4 requests per data center
+    assert plan_runtime(event_plans, plan_inputs(req_parallel=True)) == 30.
+    # global scheduler: limited by the slowest data center
+    assert plan_runtime(event_plans,
+                        plan_inputs(req_parallel=True,
+                                    req_np_total=100)) == 30.
+    assert plan_runtime(event_plans,
+                        plan_inputs(req_parallel=True,
+                                    req_np_total=2)) == 70.
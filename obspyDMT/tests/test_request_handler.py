@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_request_handler.py
+#   Purpose:   testing the control of the requests to the data centers
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from obspyDMT.utils import request_handler
+from obspyDMT.utils.request_handler import ConcurrencyWindow, error_class
+from obspyDMT.utils.request_handler import transient_error, hedged_request
+from obspyDMT.utils.request_handler import robust_request, request_to_file
+from obspyDMT.utils.request_handler import schedule_download
+from obspyDMT.utils.request_handler import share_latencies, init_latencies
+from obspyDMT.utils.request_handler import record_latency, hedge_delay
+
+# ##################### test_window_limits ##############################
+
+
+def test_window_limits():
+    window = ConcurrencyWindow(0, 8, 20)
+    assert window.floor == 1
+    assert window.size == 8
+    window = ConcurrencyWindow(4, 2, 1)
+    assert window.ceiling == 4
+    assert window.size == 4
+
+# ##################### test_window_increase ############################
+
+
+def test_window_increase():
+    window = ConcurrencyWindow(1, 16, 2)
+    # one request more after a full window of successful requests
+    window.update(1., None)
+    window.update(1., None)
+    assert window.size == 2
+    window.update(1., None)
+    assert window.size == 3
+    for i in range(3):
+        window.update(1., None)
+    assert window.size == 4
+    # the ceiling is not exceeded
+    for i in range(200):
+        window.update(1., None)
+    assert window.size == 16
+    # an error which is not congestion does not change the window
+    window.update(1., 'no_data')
+    window.update(1., 'other')
+    assert window.size == 16
+
+# ##################### test_window_decrease ############################
+
+
+def test_window_decrease():
+    for err_class in ['throttled', 'timeout']:
+        window = ConcurrencyWindow(1, 16, 8)
+        window.update(1., err_class)
+        assert window.size == 4
+        # once per round-trip time
+        window.update(1., err_class)
+        assert window.size == 4
+        window.last_decrease = 0.
+        window.update(1., err_class)
+        assert window.size == 2
+
+    # the latency doubles
+    window = ConcurrencyWindow(1, 16, 8)
+    window.update(1., None)
+    window.update(1.5, None)
+    assert window.size == 8
+    window.update(3., None)
+    assert window.size == 4
+
+# ##################### test_window_floor ###############################
+
+
+def test_window_floor():
+    window = ConcurrencyWindow(3, 16, 4)
+    for i in range(5):
+        window.last_decrease = 0.
+        window.update(1., 'throttled')
+    assert window.size == 3
+    # no decrease because of the latency at the floor
+    window.update(1., None)
+    window.update(10., None)
+    assert window.size == 3
+    assert window.summary().startswith('final: 3, min: 3, max: 4')
+
+# ##################### test_error_class ################################
+
+
+def test_error_class():
+    assert error_class(None) is None
+    assert error_class(Exception('No data available for request.')) == \
+        'no_data'
+    assert error_class(Exception('HTTP Error 204')) == 'no_data'
+    assert error_class(Exception('HTTP Error 429: Too Many Requests')) == \
+        'throttled'
+    assert error_class(Exception('Service Unavailable')) == 'throttled'
+    assert error_class(socket.timeout('timed out')) == 'timeout'
+    assert error_class(Exception('HTTP Error 500')) == 'other'
+    assert error_class(ValueError('bad value')) == 'other'
+
+# ##################### test_transient_error ############################
+
+
+def test_transient_error():
+    assert transient_error(Exception('HTTP Error 503'))
+    assert transient_error(socket.timeout('timed out'))
+    assert transient_error(Exception('HTTP Error 502: Bad Gateway'))
+    assert transient_error(Exception('Connection reset by peer'))
+    assert not transient_error(Exception('No data available'))
+    assert not transient_error(Exception('HTTP Error 400: Bad Request'))
+    assert not transient_error(ValueError('bad value'))
+
+# ##################### test_hedged_request #############################
+
+
+def test_hedged_request():
+    calls = []
+    discarded = []
+    calls_lock = threading.Lock()
+
+    # the first attempt is slow, the duplicate answers first
+    def request():
+        with calls_lock:
+            calls.append(len(calls))
+            num_call = calls[-1]
+        time.sleep(0.5 if num_call == 0 else 0.01)
+        return num_call
+
+    assert hedged_request(request, 0.05, discarded.append) == 1
+    time.sleep(0.7)
+    assert discarded == [0]
+
+    # a fast request is not duplicated
+    del calls[:]
+    assert hedged_request(lambda: calls.append(1) or 'fast', 1.) == 'fast'
+    assert calls == [1]
+
+    # the error of the first attempt waits for the duplicate
+    del calls[:]
+
+    def request_error():
+        with calls_lock:
+            calls.append(len(calls))
+            num_call = calls[-1]
+        if num_call == 0:
+            time.sleep(0.1)
+            raise Exception('HTTP Error 503')
+        time.sleep(0.2)
+        return 'duplicate'
+
+    assert hedged_request(request_error, 0.05) == 'duplicate'
+
+    # both attempts fail
+    try:
+        hedged_request(lambda: 1/0, 0.01)
+    except ZeroDivisionError:
+        pass
+    else:
+        assert False
+
+# ##################### test_robust_request #############################
+
+
+def test_robust_request(monkeypatch):
+    monkeypatch.setattr(request_handler, 'retry_backoff', lambda n: 0.)
+    errors = [Exception('HTTP Error 503'), socket.timeout('timed out')]
+
+    def request():
+        if errors:
+            raise errors.pop(0)
+        return 'data'
+
+    # no retry by default
+    try:
+        robust_request(request, {}, 'IRIS', 'waveform')
+    except Exception as error:
+        assert error.req_retries == 0
+    else:
+        assert False
+    assert robust_request(request, {'req_retry': 2}, 'IRIS',
+                          'waveform') == ('data', 1)
+
+    # errors which are not transient are not retried
+    errors[:] = [Exception('No data available'), Exception('HTTP 503')]
+    try:
+        robust_request(request, {'req_retry': 2}, 'IRIS', 'waveform')
+    except Exception as error:
+        assert 'No data' in str(error)
+    assert len(errors) == 1
+
+# ##################### test_shared_latencies ###########################
+
+
+def latency_task(latency):
+    record_latency('IRIS', 'waveform', latency)
+
+
+def test_shared_latencies(monkeypatch):
+    monkeypatch.setattr(request_handler, 'latency_store', {})
+    input_dics = {'req_hedge': 50}
+    shared_latencies = share_latencies(input_dics)
+    try:
+        pool = multiprocessing.Pool(processes=2, initializer=init_latencies,
+                                    initargs=(shared_latencies,))
+        pool.map(latency_task, [float(i) for i in range(30)], chunksize=1)
+        pool.close()
+        pool.join()
+        # the latencies of the workers are seen by the other processes
+        assert hedge_delay(input_dics, 'IRIS', 'waveform') in [14., 15.]
+        assert hedge_delay(input_dics, 'IRIS', 'response') is None
+
+        # the history is bounded
+        for i in range(2*request_handler.HEDGE_SAMPLES):
+            record_latency('IRIS', 'waveform', 1.)
+        assert len(request_handler.latency_store['history'][
+            ('IRIS', 'waveform')]) == request_handler.HEDGE_SAMPLES
+    finally:
+        request_handler.latency_store['manager'].shutdown()
+
+# ##################### test_request_to_file ############################
+
+
+def test_request_to_file(monkeypatch):
+    monkeypatch.setattr(request_handler, 'retry_backoff', lambda n: 0.)
+    tmp_dir = tempfile.mkdtemp(prefix='dmt_request_')
+    path2write = os.path.join(tmp_dir, 'IU.ANMO.00.BHZ')
+    attempts = []
+
+    def fetch(path_tmp):
+        attempts.append(path_tmp)
+        fio = open(path_tmp, 'wb')
+        fio.write(b'part')
+        fio.close()
+        if len(attempts) == 1:
+            raise Exception('Connection reset by peer')
+        fio = open(path_tmp, 'ab')
+        fio.write(b' complete')
+        fio.close()
+
+    try:
+        assert request_to_file(fetch, path2write, {'req_retry': 1},
+                               'IRIS', 'waveform') == 1
+        fio = open(path2write, 'rb')
+        assert fio.read() == b'part complete'
+        fio.close()
+        # the file of the failed attempt is removed
+        assert os.listdir(tmp_dir) == ['IU.ANMO.00.BHZ']
+    finally:
+        shutil.rmtree(tmp_dir)
+
+# ##################### test_schedule_download ##########################
+
+
+def fake_client_init(input_dics, req_cli):
+    return ('client_%s' % req_cli,)
+
+
+def fake_download_core(st_avail, event, input_dics, target_path, client,
+                       req_cli, info_station):
+    """
+    one request of 0.1 s, its start and end are appended to a log
+    """
+    log_path = os.path.join(input_dics['datapath'], 'requests.log')
+    t_start = time.time()
+    time.sleep(0.1)
+    log_fio = open(log_path, 'at')
+    log_fio.write('%s %s %s %.6f %.6f\n' % (event['event_id'], req_cli,
+                                             st_avail[1], t_start,
+                                             time.time()))
+    log_fio.close()
+    if st_avail[1] == 'FAIL':
+        raise Exception('HTTP Error 500')
+    return {'st_id': st_avail[1], 'duration': 0.1, 'error_class': None}
+
+
+def fake_core_init(req_cli):
+    return fake_download_core, fake_client_init
+
+
+def max_overlap(intervals):
+    """
+    maximum number of overlapping (start, end) intervals
+    """
+    points = sorted([(t_start, 1) for t_start, t_end in intervals] +
+                    [(t_end, -1) for t_start, t_end in intervals])
+    num_max = num = 0
+    for t_point, step in points:
+        num += step
+        num_max = max(num_max, num)
+    return num_max
+
+
+def test_schedule_download():
+    datapath = tempfile.mkdtemp(prefix='dmt_schedule_')
+    try:
+        input_dics = {'datapath': datapath, 'req_np': 2, 'req_np_total': 3,
+                      'req_adaptive': False}
+        work_events = []
+        for ev_num in range(3):
+            event = {'event_id': 'event%s' % ev_num}
+            os.makedirs(os.path.join(datapath, event['event_id'], 'info'))
+            stas_avail = [['XX', 'STA%s' % i, '', 'BHZ', 0, 0, 0, 0, dc]
+                          for dc in ['DC_A', 'DC_B'] for i in range(4)]
+            if ev_num == 1:
+                stas_avail[0][1] = 'FAIL'
+            work_events.append((event, stas_avail, '%s/3' % ev_num))
+        events_done = []
+        schedule_download(
+            work_events, input_dics, fake_core_init,
+            lambda event: events_done.append((event['event_id'],
+                                              time.time())))
+
+        log_fio = open(os.path.join(datapath, 'requests.log'), 'rt')
+        requests = [line.split() for line in log_fio.readlines()]
+        log_fio.close()
+        assert len(requests) == 24
+        # per data center and total limits
+        for req_cli in ['DC_A', 'DC_B']:
+            assert max_overlap([(float(req[3]), float(req[4]))
+                                for req in requests
+                                if req[1] == req_cli]) <= 2
+        assert max_overlap([(float(req[3]), float(req[4]))
+                            for req in requests]) == 3
+        # each event is done once, after all its requests
+        assert sorted([ev_id for ev_id, t_done in events_done]) == \
+            ['event0', 'event1', 'event2']
+        for ev_id, t_done in events_done:
+            assert t_done >= max([float(req[4]) for req in requests
+                                  if req[0] == ev_id])
+        # errors of the workers are reported in info/exception
+        exc_fio = open(os.path.join(datapath, 'event1', 'info',
+                                    'exception'), 'rt')
+        assert 'DC_A -- scheduler -- XX.FAIL..BHZ -- HTTP Error 500' in \
+            exc_fio.read()
+        exc_fio.close()
+    finally:
+        shutil.rmtree(datapath)
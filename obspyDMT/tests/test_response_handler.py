@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_response_handler.py
+#   Purpose:   testing the shared cache of StationXML responses
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+from obspy import UTCDateTime
+import os
+import shutil
+import tempfile
+
+from obspyDMT.utils.response_handler import cache_store, cache_lookup
+from obspyDMT.utils.response_handler import cache_fetch, response_cache_dir
+
+# ##################### stationxml ######################################
+
+
+def stationxml(path2write, start_date, end_date=None):
+    end_attr = ' endDate="%s"' % end_date if end_date else ''
+    xml_fio = open(path2write, 'wt')
+    xml_fio.writelines(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<FDSNStationXML xmlns="http://www.fdsn.org/xml/station/1" '
+        'schemaVersion="1.0">\n'
+        '<Source>test</Source><Created>2016-01-01T00:00:00</Created>\n'
+        '<Network code="IU"><Station code="ANMO">\n'
+        '<Latitude>34.9</Latitude><Longitude>-106.5</Longitude>'
+        '<Elevation>1850</Elevation>\n'
+        '<Channel code="BHZ" locationCode="00" startDate="%s"%s>\n'
+        '<Latitude>34.9</Latitude><Longitude>-106.5</Longitude>'
+        '<Elevation>1850</Elevation><Depth>100</Depth>\n'
+        '</Channel></Station></Network></FDSNStationXML>\n'
+        % (start_date, end_attr))
+    xml_fio.close()
+
+# ##################### test_response_cache #############################
+
+
+def test_response_cache():
+    tmp_dir = tempfile.mkdtemp(prefix='dmt_resp_')
+    try:
+        cache_dir = response_cache_dir({'response_cache': True,
+                                        'response_cache_dir': None,
+                                        'datapath': tmp_dir})
+        assert cache_dir == os.path.join(tmp_dir, 'RESPONSE-CACHE')
+        assert not response_cache_dir({'response_cache': False})
+
+        st_id = 'IU.ANMO.00.BHZ'
+        resp_old = os.path.join(tmp_dir, 'STXML.old')
+        stationxml(resp_old, '2000-01-01T00:00:00', '2010-01-01T00:00:00')
+        resp_new = os.path.join(tmp_dir, 'STXML.new')
+        stationxml(resp_new, '2010-01-01T00:00:00')
+        cache_store(cache_dir, st_id, resp_old)
+        cache_store(cache_dir, st_id, resp_new)
+        # the same file is stored once
+        cache_store(cache_dir, st_id, resp_new)
+        assert len(os.listdir(os.path.join(cache_dir, 'index', st_id))) == 2
+
+        # the epoch has to cover the time window
+        obj_old = cache_lookup(cache_dir, st_id,
+                               UTCDateTime(2005, 1, 1),
+                               UTCDateTime(2005, 1, 2))
+        obj_new = cache_lookup(cache_dir, st_id,
+                               UTCDateTime(2011, 3, 11),
+                               UTCDateTime(2011, 3, 12))
+        assert obj_old is not None and obj_new is not None
+        assert obj_old != obj_new
+        assert cache_lookup(cache_dir, st_id, UTCDateTime(2009, 12, 31),
+                            UTCDateTime(2010, 1, 2)) is None
+        assert cache_lookup(cache_dir, 'IU.ANMO.10.BHZ',
+                            UTCDateTime(2005, 1, 1),
+                            UTCDateTime(2005, 1, 2)) is None
+        # open epochs are closed at the time of the download
+        assert cache_lookup(cache_dir, st_id, UTCDateTime() + 86400,
+                            UTCDateTime() + 2*86400) is None
+
+        # the event gets a copy, its changes do not reach the cache
+        path2write = os.path.join(tmp_dir, 'STXML.%s' % st_id)
+        assert cache_fetch(cache_dir, st_id, UTCDateTime(2011, 3, 11),
+                           UTCDateTime(2011, 3, 12), path2write)
+        assert not cache_fetch(cache_dir, st_id, UTCDateTime(1990, 1, 1),
+                               UTCDateTime(1990, 1, 2), path2write)
+        resp_fio = open(path2write, 'at')
+        resp_fio.writelines('<!-- modified -->\n')
+        resp_fio.close()
+        obj_fio = open(obj_new, 'rt')
+        assert 'modified' not in obj_fio.read()
+        obj_fio.close()
+        # the cached objects are read-only
+        assert os.stat(obj_new).st_mode & 0o222 == 0
+    finally:
+        shutil.rmtree(tmp_dir)
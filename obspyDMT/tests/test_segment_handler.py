@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_segment_handler.py
+#   Purpose:   testing the segment store of the continuous mode
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import numpy as np
+from obspy import read, Stream, Trace, UTCDateTime
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from obspyDMT.utils import request_handler
+from obspyDMT.utils.segment_handler import segment_cut, segment_path
+from obspyDMT.utils.segment_handler import block_starts, lock_stale
+from obspyDMT.utils.segment_handler import segment_fetch
+
+# ##################### FakeClient ######################################
+
+
+class FakeClient(object):
+    """
+    one sample per second since 2011-03-11, no data on 2011-03-13
+    """
+    def __init__(self, errors=()):
+        self.requests = []
+        self.errors = list(errors)
+
+    def get_waveforms(self, network, station, location, channel,
+                      starttime, endtime):
+        self.requests.append((starttime, endtime))
+        if self.errors:
+            raise self.errors.pop(0)
+        if starttime >= UTCDateTime(2011, 3, 13):
+            return Stream()
+        t_0 = UTCDateTime(2011, 3, 11)
+        return Stream([Trace(
+            data=np.arange(int(starttime - t_0), int(endtime - t_0),
+                           dtype=np.int32),
+            header={'network': network, 'station': station,
+                    'location': location, 'channel': channel,
+                    'sampling_rate': 1., 'starttime': starttime})])
+
+
+def segment_inputs(datapath, **kwargs):
+    input_dics = {'datapath': datapath, 'continuous': True,
+                  'continuous_block': 86400, 'req_timeout': 120,
+                  'req_retry': 0}
+    input_dics.update(kwargs)
+    return input_dics
+
+# ##################### test_segment_cut ################################
+
+
+def test_segment_cut():
+    datapath = tempfile.mkdtemp(prefix='dmt_segment_')
+    st_avail = ['IU', 'ANMO', '00', 'BHZ']
+    try:
+        input_dics = segment_inputs(datapath)
+        client = FakeClient()
+        path2write = os.path.join(datapath, 'IU.ANMO.00.BHZ')
+        t_start = UTCDateTime(2011, 3, 11, 20)
+        t_end = UTCDateTime(2011, 3, 12, 4)
+        assert len(block_starts(t_start, t_end, 86400)) == 2
+        assert segment_cut(client, st_avail, t_start, t_end, input_dics,
+                           'IRIS', path2write) == 0
+        assert len(client.requests) == 2
+        tr = read(path2write)[0]
+        assert tr.stats.starttime == t_start
+        assert tr.stats.endtime == t_end
+        assert tr.data[0] == 20*3600 and tr.data[-1] == 28*3600
+
+        # the stored blocks are reused by the next interval
+        segment_cut(client, st_avail, UTCDateTime(2011, 3, 12, 5),
+                    UTCDateTime(2011, 3, 12, 6), input_dics, 'IRIS',
+                    path2write)
+        assert len(client.requests) == 2
+
+        # blocks without data are marked and not requested again
+        for i in range(2):
+            try:
+                segment_cut(client, st_avail, UTCDateTime(2011, 3, 13, 1),
+                            UTCDateTime(2011, 3, 13, 2), input_dics,
+                            'IRIS', path2write)
+            except Exception as error:
+                assert 'No data' in str(error)
+            else:
+                assert False
+        assert len(client.requests) == 3
+        seg_path = segment_path(os.path.join(datapath, 'SEGMENT-STORE'),
+                                'IU.ANMO.00.BHZ',
+                                UTCDateTime(2011, 3, 13))
+        assert os.path.isfile(seg_path + '.nodata')
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_segment_retry ##############################
+
+
+def test_segment_retry(monkeypatch):
+    monkeypatch.setattr(request_handler, 'retry_backoff', lambda n: 0.)
+    datapath = tempfile.mkdtemp(prefix='dmt_segment_')
+    st_avail = ['IU', 'ANMO', '00', 'BHZ']
+    try:
+        path2write = os.path.join(datapath, 'IU.ANMO.00.BHZ')
+        # each block is retried, the blocks already stored are kept
+        client = FakeClient([Exception('HTTP Error 503')])
+        assert segment_cut(client, st_avail, UTCDateTime(2011, 3, 11, 20),
+                           UTCDateTime(2011, 3, 12, 4),
+                           segment_inputs(datapath, req_retry=1), 'IRIS',
+                           path2write) == 1
+        assert len(client.requests) == 3
+
+        client = FakeClient([Exception('HTTP Error 503')])
+        try:
+            segment_cut(client, st_avail, UTCDateTime(2011, 3, 10, 20),
+                        UTCDateTime(2011, 3, 11, 4),
+                        segment_inputs(datapath), 'IRIS', path2write)
+        except Exception as error:
+            assert '503' in str(error)
+        else:
+            assert False
+        # no lock is left behind
+        store_dir = os.path.join(datapath, 'SEGMENT-STORE', 'IU.ANMO.00.BHZ')
+        assert [fi for fi in os.listdir(store_dir)
+                if fi.endswith('.lock')] == []
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_nodata_expire ##############################
+
+
+def test_nodata_expire():
+    datapath = tempfile.mkdtemp(prefix='dmt_segment_')
+    st_avail = ['IU', 'ANMO', '00', 'BHZ']
+    store_dir = os.path.join(datapath, 'SEGMENT-STORE')
+    try:
+        input_dics = segment_inputs(datapath)
+        client = FakeClient()
+        # recent block, marked one minute ago
+        block_start = UTCDateTime(int(time.time()/86400)*86400)
+        seg_path = segment_path(store_dir, 'IU.ANMO.00.BHZ', block_start)
+        os.makedirs(os.path.dirname(seg_path))
+        open(seg_path + '.nodata', 'a').close()
+        os.utime(seg_path + '.nodata', (time.time() - 60,) * 2)
+        segment_fetch(client, st_avail, block_start, 86400, seg_path,
+                      input_dics, 'IRIS')
+        assert len(client.requests) == 0
+
+        # block marked one hour after its end, long ago: requested again
+        block_start = UTCDateTime(2011, 3, 13)
+        seg_path = segment_path(store_dir, 'IU.ANMO.00.BHZ', block_start)
+        open(seg_path + '.nodata', 'a').close()
+        t_request = UTCDateTime(2011, 3, 14, 1).timestamp
+        os.utime(seg_path + '.nodata', (t_request, t_request))
+        segment_fetch(client, st_avail, block_start, 86400, seg_path,
+                      input_dics, 'IRIS')
+        assert len(client.requests) == 1
+        # still no data: marked again at the time of this request
+        assert os.path.getmtime(seg_path + '.nodata') > t_request
+
+        # the new marker of this old block does not expire
+        os.utime(seg_path + '.nodata', (time.time() - 10*86400,) * 2)
+        segment_fetch(client, st_avail, block_start, 86400, seg_path,
+                      input_dics, 'IRIS')
+        assert len(client.requests) == 1
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_stale_lock #################################
+
+
+def test_stale_lock():
+    datapath = tempfile.mkdtemp(prefix='dmt_segment_')
+    st_avail = ['IU', 'ANMO', '00', 'BHZ']
+    try:
+        store_dir = os.path.join(datapath, 'SEGMENT-STORE')
+        lock_path = segment_path(store_dir, 'IU.ANMO.00.BHZ',
+                                 UTCDateTime(2011, 3, 11)) + '.lock'
+        os.makedirs(os.path.dirname(lock_path))
+
+        # lock of a running process (this one)
+        lock_fio = open(lock_path, 'wt')
+        lock_fio.writelines('%s %s' % (socket.gethostname(), os.getpid()))
+        lock_fio.close()
+        assert not lock_stale(lock_path, 3600)
+        assert lock_stale(lock_path, -1)
+
+        # lock of a killed process
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proc.wait()
+        lock_fio = open(lock_path, 'wt')
+        lock_fio.writelines('%s %s' % (socket.gethostname(), proc.pid))
+        lock_fio.close()
+        if os.name == 'posix':
+            assert lock_stale(lock_path, 3600)
+            t_cut = time.time()
+            client = FakeClient()
+            segment_cut(client, st_avail, UTCDateTime(2011, 3, 11, 1),
+                        UTCDateTime(2011, 3, 11, 2),
+                        segment_inputs(datapath), 'IRIS',
+                        os.path.join(datapath, 'IU.ANMO.00.BHZ'))
+            assert time.time() - t_cut < 5.
+            assert len(client.requests) == 1
+            assert not os.path.isfile(lock_path)
+    finally:
+        shutil.rmtree(datapath)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_session_handler.py
+#   Purpose:   testing the demultiplexing of bulk miniSEED responses
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+from io import BytesIO
+import numpy as np
+from obspy import read, Stream, Trace, UTCDateTime
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from obspyDMT.tests.test_data_handler import core_inputs, event_target
+from obspyDMT.utils import session_handler
+from obspyDMT.utils.data_handler import time_window
+from obspyDMT.utils.session_handler import mseed_record_info
+from obspyDMT.utils.session_handler import session_post_demux
+from obspyDMT.utils.session_handler import fdsn_service_url
+from obspyDMT.utils.session_handler import session_download
+
+# ##################### helpers #########################################
+
+
+class FakeResponse(object):
+    def __init__(self, content, chunk_size):
+        self.status_code = 200
+        self.reason = 'OK'
+        self.content = content
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.content), self.chunk_size):
+            yield self.content[i:i + self.chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, content, chunk_size):
+        self.content = content
+        self.chunk_size = chunk_size
+        self.timeouts = []
+
+    def post(self, url, data=None, auth=None, stream=False, timeout=None):
+        self.timeouts.append(timeout)
+        return FakeResponse(self.content, self.chunk_size)
+
+
+def mseed_channels(byteorder='>', reclen=512):
+    """
+    miniSEED of three channels, the records of the channels are
+    interleaved as in a bulk response
+    """
+    st = Stream()
+    for loc, cha in [('00', 'BHZ'), ('00', 'BHN'), ('10', 'BHZ')]:
+        st.append(Trace(data=np.arange(3000, dtype=np.int32),
+                        header={'network': 'IU', 'station': 'ANMO',
+                                'location': loc, 'channel': cha,
+                                'sampling_rate': 20.,
+                                'starttime': UTCDateTime(2011, 3, 11)}))
+    records = []
+    for tr in st:
+        buf = BytesIO()
+        tr.write(buf, format='MSEED', reclen=reclen, byteorder=byteorder,
+                 encoding='INT32')
+        content = buf.getvalue()
+        records.append([content[i:i + reclen]
+                        for i in range(0, len(content), reclen)])
+    content = b''
+    for rec_num in range(max([len(recs) for recs in records])):
+        for recs in records:
+            if rec_num < len(recs):
+                content += recs[rec_num]
+    return st, content
+
+# ##################### test_mseed_record_info ##########################
+
+
+def test_mseed_record_info():
+    for byteorder in ['>', '<']:
+        for reclen in [256, 512, 4096]:
+            st, content = mseed_channels(byteorder, reclen)
+            assert mseed_record_info(bytearray(content)) == \
+                ('IU.ANMO.00.BHZ', reclen)
+            assert mseed_record_info(bytearray(content[reclen:])) == \
+                ('IU.ANMO.00.BHN', reclen)
+    # header not complete
+    assert mseed_record_info(bytearray(content[:40])) is None
+
+    # records without blockette 1000: the next header gives the length
+    st, content = mseed_channels('>', 512)
+    content = bytearray(content)
+    for rec_start in range(0, len(content), 512):
+        content[rec_start + 39] = 0
+        content[rec_start + 46:rec_start + 48] = b'\x00\x00'
+    assert mseed_record_info(content) == ('IU.ANMO.00.BHZ', 512)
+    assert mseed_record_info(content[-512:]) is None
+    assert mseed_record_info(content[-512:], True) == ('IU.ANMO.10.BHZ',
+                                                       512)
+
+    # not miniSEED
+    try:
+        mseed_record_info(bytearray(b'<html>' + 100*b' '))
+    except Exception as error:
+        assert 'no miniSEED record header' in str(error)
+    else:
+        assert False
+
+# ##################### test_session_post_demux #########################
+
+
+def test_session_post_demux():
+    raw_dir = tempfile.mkdtemp(prefix='dmt_demux_')
+    try:
+        for byteorder, reclen, chunk_size in [('>', 512, 1000),
+                                              ('<', 4096, 777),
+                                              ('>', 256, 65536)]:
+            st, content = mseed_channels(byteorder, reclen)
+            session = FakeSession(content, chunk_size)
+            saved = session_post_demux(session, 'http://localhost', '',
+                                       raw_dir, {'username_fdsn': None,
+                                                 'req_timeout': 60})
+            assert session.timeouts == [60]
+            assert sorted(saved) == ['IU.ANMO.00.BHN', 'IU.ANMO.00.BHZ',
+                                     'IU.ANMO.10.BHZ']
+            assert sum(saved.values()) == len(content)
+            for tr in st:
+                tr_raw = read(os.path.join(raw_dir, tr.id))
+                assert len(tr_raw) == 1
+                assert np.all(tr_raw[0].data == tr.data)
+            assert sorted(os.listdir(raw_dir)) == sorted(saved)
+
+        # a truncated response does not leave partial files
+        shutil.rmtree(raw_dir)
+        os.mkdir(raw_dir)
+        try:
+            session_post_demux(FakeSession(content[:-100], 1000),
+                               'http://localhost', '', raw_dir,
+                               {'username_fdsn': None, 'req_timeout': 60})
+        except Exception as error:
+            assert 'incomplete miniSEED record' in str(error)
+        else:
+            assert False
+        assert os.listdir(raw_dir) == []
+    finally:
+        shutil.rmtree(raw_dir)
+
+# ##################### test_fdsn_service_url ###########################
+
+
+def test_fdsn_service_url():
+    class FakeClient(object):
+        base_url = 'http://service.iris.edu/'
+        major_versions = {'dataselect': 1, 'station': 1}
+
+    assert fdsn_service_url(FakeClient(), 'dataselect',
+                            {'username_fdsn': None}) == \
+        'http://service.iris.edu/fdsnws/dataselect/1/query'
+    assert fdsn_service_url(FakeClient(), 'station',
+                            {'username_fdsn': 'user'}) == \
+        'http://service.iris.edu/fdsnws/station/1/queryauth'
+
+# ##################### test_session_download ###########################
+
+
+def test_session_download(monkeypatch):
+    class FakeClient(object):
+        base_url = 'http://localhost'
+        major_versions = {'dataselect': 1, 'station': 1}
+
+    class SlowSession(object):
+        """
+        counts the requests in flight
+        """
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.requests = 0
+
+        def get(self, url, params=None, auth=None, stream=False,
+                timeout=None):
+            with self.lock:
+                self.requests += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight,
+                                         self.in_flight)
+            time.sleep(0.05)
+            with self.lock:
+                self.in_flight -= 1
+            return FakeResponse(b'x'*100, 100)
+
+    session = SlowSession()
+    monkeypatch.setattr(session_handler, 'get_session',
+                        lambda base_url, pool_size: session)
+    datapath = tempfile.mkdtemp(prefix='dmt_session_')
+    try:
+        event = {'event_id': '20110311_054624.a',
+                 't1': UTCDateTime(2011, 3, 11),
+                 't2': UTCDateTime(2011, 3, 11, 1)}
+        target_path = event_target(datapath, event['event_id'])
+        stas_avail = [['IU', 'STA%02i' % i, '00', 'BHZ']
+                      for i in range(40)]
+        # --session_np requests in flight, not --req_np
+        input_dics = core_inputs(datapath, response=False, session_np=20)
+        session_download(stas_avail, event, input_dics, target_path,
+                         FakeClient(), 'IRIS', '[test]', time_window)
+        assert session.requests == 40
+        assert session.max_in_flight > input_dics['req_np']
+        assert session.max_in_flight <= 20
+        assert len(os.listdir(os.path.join(target_path, 'raw'))) == 40
+    finally:
+        shutil.rmtree(datapath)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_state_handler.py
+#   Purpose:   testing the database of the download state
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import numpy as np
+import os
+import shutil
+import tempfile
+
+from obspyDMT.utils.state_handler import state_filter, state_update
+from obspyDMT.utils.state_handler import state_failed, state_summary
+from obspyDMT.utils.state_handler import state_connect
+
+# ##################### state_inputs ####################################
+
+
+def state_inputs(datapath, **kwargs):
+    input_dics = {'datapath': datapath, 'state_db': True,
+                  'waveform': True, 'response': True, 'syngine': False,
+                  'force_waveform': False, 'force_response': False,
+                  'state_retry': 'all'}
+    input_dics.update(kwargs)
+    return input_dics
+
+
+def state_channels():
+    return np.array([['IU', 'ANMO', '00', 'BHZ'],
+                     ['IU', 'ANMO', '--', 'BHN'],
+                     ['GE', 'WLF', '', 'HHZ']], dtype=object)
+
+# ##################### test_state_resume ###############################
+
+
+def test_state_resume():
+    datapath = tempfile.mkdtemp(prefix='dmt_state_')
+    try:
+        input_dics = state_inputs(datapath)
+        event = {'event_id': '20110311_054624.a'}
+        stas_avail = state_channels()
+        # first run: all the channels are registered as pending
+        assert len(state_filter(stas_avail, event, input_dics)) == 3
+        assert state_summary(input_dics, event) == \
+            [('response', 'pending', 3, None),
+             ('waveform', 'pending', 3, None)]
+
+        # the run is killed: one channel done, one in flight,
+        # one failed without data
+        wf_path = os.path.join(datapath, 'IU.ANMO.00.BHZ')
+        wf_fio = open(wf_path, 'wb')
+        wf_fio.write(b'x'*512)
+        wf_fio.close()
+        for product in ['waveform', 'response']:
+            state_update(input_dics, event, 'IU.ANMO.00.BHZ', product,
+                         'in-flight')
+            state_update(input_dics, event, 'IU.ANMO.00.BHZ', product,
+                         'done', path=wf_path, duration=1.)
+        state_update(input_dics, event, 'IU.ANMO..BHN', 'waveform',
+                     'in-flight')
+        state_failed(input_dics, event, ['GE', 'WLF', '', 'HHZ'],
+                     'initializing',
+                     Exception('No data available for request.'))
+        summary = state_summary(input_dics, event)
+        assert ('waveform', 'done', 1, 512) in summary
+        assert ('waveform', 'failed', 1, None) in summary
+        assert ('waveform', 'in-flight', 1, None) in summary
+        assert ('response', 'failed', 1, None) in summary
+
+        # resume: the done channel is skipped, the in-flight and the
+        # failed channels are requested again
+        stas_req = state_filter(stas_avail, event, input_dics)
+        assert [sta[1] + sta[3] for sta in stas_req] == ['ANMOBHN',
+                                                         'WLFHHZ']
+        # failed without data is not retried with --state_retry
+        stas_req = state_filter(stas_avail, event,
+                                state_inputs(datapath,
+                                             state_retry=['throttled',
+                                                          'timeout']))
+        assert [sta[1] + sta[3] for sta in stas_req] == ['ANMOBHN']
+        # --force_waveform requests all the channels
+        assert len(state_filter(stas_avail, event,
+                                state_inputs(datapath,
+                                             force_waveform=True))) == 3
+
+        # the attempts are counted
+        conn = state_connect(os.path.join(datapath,
+                                          'download_state.sqlite'))
+        assert conn.execute(
+            'SELECT attempts, error_class FROM items WHERE st_id=? AND '
+            'product=?', ('GE.WLF..HHZ', 'waveform')).fetchone() == \
+            (0, 'no_data')
+        assert conn.execute(
+            'SELECT attempts FROM items WHERE st_id=? AND product=?',
+            ('IU.ANMO..BHN', 'waveform')).fetchone() == (1,)
+
+        # another event is independent
+        assert len(state_filter(stas_avail, {'event_id': 'continuous1'},
+                                input_dics)) == 3
+    finally:
+        shutil.rmtree(datapath)
+
+# ##################### test_state_disabled #############################
+
+
+def test_state_disabled():
+    datapath = tempfile.mkdtemp(prefix='dmt_state_')
+    try:
+        input_dics = state_inputs(datapath, state_db=False)
+        event = {'event_id': '20110311_054624.a'}
+        stas_avail = state_channels()
+        assert state_filter(stas_avail, event, input_dics) is stas_avail
+        state_update(input_dics, event, 'IU.ANMO.00.BHZ', 'waveform', 'done')
+        assert state_summary(input_dics, event) == []
+        assert os.listdir(datapath) == []
+    finally:
+        shutil.rmtree(datapath)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_traveltime_handler.py
+#   Purpose:   testing the travel-time grid against TauP
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import numpy as np
+from obspy import UTCDateTime
+from obspy.taup import TauPyModel
+
+from obspyDMT.utils.traveltime_handler import build_tt_grid, interp_tt_grid
+from obspyDMT.utils.traveltime_handler import first_arrival, epi_distances
+from obspyDMT.utils.traveltime_handler import phase_times
+from obspyDMT.utils import traveltime_handler
+from obspyDMT.utils.utility_codes import calculate_time_phase
+from obspyDMT.utils.utility_codes import calculate_time_phase_arr
+
+# ##################### test_tt_grid ####################################
+
+
+def test_tt_grid():
+    tau_bg = TauPyModel(model='iasp91')
+    # P, Pdiff and PKIKP parts of the grid
+    for dists in [np.arange(30., 32.5, 0.5),
+                  np.arange(100., 102.5, 0.5),
+                  np.arange(150., 152.5, 0.5)]:
+        depths = np.array([10., 20., 35.])
+        tt_grid = build_tt_grid('iasp91', dists=dists, depths=depths)
+        for dist, evdp in [(dists[0] + 0.3, 12.), (dists[2] + 0.7, 27.)]:
+            tt_exact = first_arrival(tau_bg, dist, evdp)
+            tt_interp = interp_tt_grid(tt_grid, [dist], evdp)[0]
+            assert abs(tt_interp - tt_exact) < 0.5
+
+# ##################### test_epi_distances ##############################
+
+
+def test_epi_distances():
+    dists = epi_distances(0., 0., [0., 0., 90., -45.], [0., 90., 0., 180.])
+    assert np.allclose(dists, [0., 90., 90., 135.])
+
+# ##################### test_phase_times ################################
+
+
+def test_phase_times(monkeypatch):
+    monkeypatch.setattr(traveltime_handler, 'tt_grids', {})
+    monkeypatch.setattr(traveltime_handler, 'tt_direct', {})
+
+    grid_calls = []
+
+    def no_grid(*args, **kwargs):
+        grid_calls.append(args)
+        raise Exception('no grid in this test')
+
+    monkeypatch.setattr(traveltime_handler, 'build_tt_grid', no_grid)
+    monkeypatch.setattr(traveltime_handler, 'tt_cache_dir',
+                        lambda: '/nonexistent/traveltime')
+    event = {'latitude': 0., 'longitude': 0., 'depth': 10.,
+             't1': UTCDateTime(2011, 3, 11), 't2': UTCDateTime(2011, 3, 12)}
+    # a small run: exact TauP travel times, no grid
+    tau_bg = TauPyModel(model='iasp91')
+    times = phase_times(event, [0., 0.], [30., 30.])
+    assert abs(times[0] - first_arrival(tau_bg, 30., 10.)) < 1e-6
+    assert len(traveltime_handler.tt_direct) == 1
+    assert grid_calls == []
+
+    # stations without arrival are kept as NaN and skipped
+    monkeypatch.setattr(traveltime_handler, 'first_arrival',
+                        lambda tau_bg, dist, evdp: np.nan)
+    times = phase_times(event, [0., 0.], [30., 60.])
+    assert not np.isnan(times[0]) and np.isnan(times[1])
+    stas = [['IU', 'ANMO', '00', 'BHZ', 0., 30.],
+            ['IU', 'KONO', '00', 'BHZ', 0., 60.]]
+    windows = calculate_time_phase_arr(event, stas)
+    assert windows[0][0] == event['t1'] + times[0]
+    assert windows[1] is None
+    try:
+        calculate_time_phase(event, stas[1])
+    except ValueError as error:
+        assert 'no P, Pdiff or PKIKP arrival' in str(error)
+    else:
+        assert False
+
+    # many distances: the grid is computed (TauP if that fails)
+    monkeypatch.setattr(traveltime_handler, 'TT_DIRECT_MAX', 2)
+    assert np.all(np.isnan(phase_times(event, [0., 0., 0.],
+                                       [10., 20., 40.])))
+    assert len(grid_calls) == 1
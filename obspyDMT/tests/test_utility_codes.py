@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  test_utility_codes.py
+#   Purpose:   testing the distance/azimuth columns of the stations
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GPLv3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+
+# Required Python and Obspy modules will be imported in this part.
+import numpy as np
+from obspy.geodetics.base import gps2dist_azimuth
+import os
+import shutil
+import tempfile
+
+from obspyDMT.utils.utility_codes import geodesic_arr, write_geodesic
+from obspyDMT.utils.utility_codes import read_geodesic, geodesic_columns
+
+# ##################### test_geodesic_arr ###############################
+
+
+def test_geodesic_arr():
+    sta_lats = [34.9, 49.7, 34.9, -77.8]
+    sta_lons = [-106.5, 6.2, -106.5, 166.7]
+    epi_dist, azi, bazi = geodesic_arr(38.3, 142.4, sta_lats, sta_lons)
+    # WGS84 ellipsoid, as gps2dist_azimuth
+    for sti in range(len(sta_lats)):
+        dist, az, baz = gps2dist_azimuth(38.3, 142.4, sta_lats[sti],
+                                         sta_lons[sti])
+        assert np.isclose(epi_dist[sti], dist/111.194/1000.)
+        assert np.isclose(azi[sti], az)
+        assert np.isclose(bazi[sti], baz)
+    assert len(geodesic_arr(0., 0., [], [])[0]) == 0
+
+# ##################### test_geodesic_file ##############################
+
+
+def test_geodesic_file():
+    target_path = tempfile.mkdtemp(prefix='dmt_geodesic_')
+    os.mkdir(os.path.join(target_path, 'info'))
+    try:
+        event = {'latitude': 38.3, 'longitude': 142.4}
+        sta_arr = [['IU', 'ANMO', '00', 'BHZ', '34.9', '-106.5'],
+                   ['GE', 'WLF', '', 'HHZ', '49.7', '6.2']]
+        epi_dist, azi, bazi = write_geodesic(target_path, sta_arr, event)
+        geo_dict = read_geodesic(target_path)
+        assert sorted(geo_dict) == ['GE.WLF..HHZ', 'IU.ANMO.00.BHZ']
+        assert np.allclose(geo_dict['IU.ANMO.00.BHZ'],
+                           [epi_dist[0], azi[0], bazi[0]], atol=1e-4)
+
+        # the stored columns are used, the missing ones are computed
+        sta_arr.append(['IU', 'ANMO', '10', 'BHZ', '34.9', '-106.5'])
+        geo_dist, geo_azi, geo_bazi = geodesic_columns(target_path, sta_arr,
+                                                       event)
+        assert np.allclose(geo_dist[[0, 2]], epi_dist[0], atol=1e-4)
+        assert np.allclose(geo_azi[[0, 2]], azi[0], atol=1e-4)
+    finally:
+        shutil.rmtree(target_path)
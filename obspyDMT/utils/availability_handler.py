@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  availability_handler.py
+#   Purpose:   typed, columnar store of the availability of one event
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import numpy as np
+import os
+
+# Layout of the availability store (<event>/info):
+# availability.bin           fixed-size records of AVAIL_DTYPE, one per
+#                            channel and data source, merged with the
+#                            channels of each availability check
+# availability_sources.txt   one data source per line, the line number
+#                            is the 'source' code of the records
+# availability.txt           the same channels as comma-separated text
+#                            (format of the older versions of obspyDMT)
+AVAIL_DTYPE = np.dtype([('net', 'S8'), ('sta', 'S8'),
+                        ('loc', 'S8'), ('cha', 'S8'),
+                        ('lat', '<f8'), ('lon', '<f8'),
+                        ('ele', '<f8'), ('depth', '<f8'),
+                        ('azimuth', '<f8'), ('dip', '<f8'),
+                        ('source', '<u2')])
+
+# ##################### avail_path ######################################
+
+
+def avail_path(target_path):
+    """
+    path of the availability store of an event
+    :param target_path:
+    :return:
+    """
+    return os.path.join(target_path, 'info', 'availability.bin')
+
+# ##################### avail_sources ###################################
+
+
+def avail_sources(target_path, names=()):
+    """
+    data sources of the availability store, the new names are added
+    :param target_path:
+    :param names: data sources which should have a code
+    :return: list of data sources (index: code)
+    """
+    sources_path = os.path.join(target_path, 'info',
+                                'availability_sources.txt')
+    sources = []
+    if os.path.isfile(sources_path):
+        sources_fio = open(sources_path, 'rt')
+        sources = [line.strip() for line in sources_fio if line.strip()]
+        sources_fio.close()
+    new_names = sorted(set(names) - set(sources))
+    if new_names:
+        sources_fio = open(sources_path, 'at')
+        for name in new_names:
+            sources_fio.writelines('%s\n' % name)
+        sources_fio.close()
+        sources.extend(new_names)
+    return sources
+
+# ##################### avail_float #####################################
+
+
+def avail_float(value):
+    """
+    float of a column, NaN if not known (None, 'NA', ...)
+    :param value:
+    :return:
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+# ##################### avail_array #####################################
+
+
+def avail_array(stas, sources):
+    """
+    convert the availability rows (net, sta, loc, cha, lat, lon, ele,
+    depth, data_source, st_id[, azimuth, dip]) to records, the rows with
+    codes longer than the fields of AVAIL_DTYPE are rejected
+    :param stas:
+    :param sources: list of data sources (see avail_sources)
+    :return:
+    """
+    stas_ok = []
+    for sta in stas:
+        if len(sta) < 10:
+            continue
+        if any([len(('%s' % sta[col]).encode('utf-8')) >
+                AVAIL_DTYPE[col].itemsize for col in range(4)]):
+            print('[WARNING] %s.%s.%s.%s is not stored in the availability, '
+                  'the codes are too long.' % tuple(sta[:4]))
+            continue
+        stas_ok.append(sta)
+    stas = stas_ok
+    source_code = dict([(name, code) for code, name in enumerate(sources)])
+    avail_arr = np.zeros(len(stas), dtype=AVAIL_DTYPE)
+    for field, col in [('net', 0), ('sta', 1), ('loc', 2), ('cha', 3)]:
+        avail_arr[field] = [('%s' % sta[col]).encode('utf-8')
+                            for sta in stas]
+    for field, col in [('lat', 4), ('lon', 5), ('ele', 6), ('depth', 7),
+                       ('azimuth', 10), ('dip', 11)]:
+        avail_arr[field] = [avail_float(sta[col]) if len(sta) > col
+                            else np.nan for sta in stas]
+    avail_arr['source'] = [source_code['%s' % sta[8]] for sta in stas]
+    return avail_arr
+
+# ##################### avail_append ####################################
+
+
+def avail_append(target_path, stas):
+    """
+    add the availability rows of one check to the store, the channels
+    which are already in the store are not added again
+    :param target_path:
+    :param stas: list of availability rows
+    :return: records of stas, list of data sources
+    """
+    sources = avail_sources(target_path,
+                            set(['%s' % sta[8] for sta in stas
+                                 if len(sta) >= 10]))
+    avail_arr = avail_array(stas, sources)
+    store_arr = avail_unique(np.concatenate(
+        [avail_read(avail_path(target_path)), avail_arr]))
+
+    # the store is replaced at once, readers never see a partial file
+    tmp_path = '%s.%s.tmp' % (avail_path(target_path), os.getpid())
+    avail_fio = open(tmp_path, 'wb')
+    avail_fio.write(store_arr.tobytes())
+    avail_fio.close()
+    os.rename(tmp_path, avail_path(target_path))
+
+    txt_path = os.path.join(target_path, 'info', 'availability.txt')
+    tmp_path = '%s.%s.tmp' % (txt_path, os.getpid())
+    txt_fio = open(tmp_path, 'wt')
+    for sta in avail_rows(store_arr, sources):
+        txt_fio.writelines('%s\n' % ','.join(sta))
+    txt_fio.close()
+    os.rename(tmp_path, txt_path)
+    return avail_arr, sources
+
+# ##################### avail_read ######################################
+
+
+def avail_read(store_path):
+    """
+    memory-mapped records of an availability.bin file
+    :param store_path:
+    :return:
+    """
+    if not os.path.isfile(store_path):
+        return np.zeros(0, dtype=AVAIL_DTYPE)
+    num_rec = os.path.getsize(store_path) // AVAIL_DTYPE.itemsize
+    if num_rec == 0:
+        return np.zeros(0, dtype=AVAIL_DTYPE)
+    return np.memmap(store_path, dtype=AVAIL_DTYPE, mode='r',
+                     shape=(num_rec,))
+
+# ##################### avail_load ######################################
+
+
+def avail_load(target_path):
+    """
+    memory-mapped records of the availability store, an availability.txt
+    of an older version of obspyDMT is converted once
+    :param target_path:
+    :return: records, list of data sources
+    """
+    store_path = avail_path(target_path)
+    txt_path = os.path.join(target_path, 'info', 'availability.txt')
+    if not os.path.isfile(store_path) and os.path.isfile(txt_path):
+        txt_fio = open(txt_path, 'rt')
+        stas = [line.strip().split(',') for line in txt_fio]
+        txt_fio.close()
+        avail_append(target_path, stas)
+    return avail_read(store_path), avail_sources(target_path)
+
+# ##################### avail_unique ####################################
+
+
+def avail_unique(avail_arr):
+    """
+    unique channels (net, sta, loc, cha, source) of the records, sorted,
+    the first record of each channel is kept
+    :param avail_arr:
+    :return:
+    """
+    if len(avail_arr) == 0:
+        return avail_arr
+    avail_key = avail_arr['net']
+    for field in ['sta', 'loc', 'cha']:
+        avail_key = np.char.add(np.char.add(avail_key, b'#'),
+                                avail_arr[field])
+    avail_key = np.char.add(np.char.add(avail_key, b'#'),
+                            avail_arr['source'].astype('S5'))
+    avail_key_unique, avail_indx = np.unique(avail_key, return_index=True)
+    return avail_arr[avail_indx]
+
+# ##################### avail_rows ######################################
+
+
+def avail_rows(avail_arr, sources):
+    """
+    availability rows (strings, as in availability.txt) of the records:
+    net, sta, loc, cha, lat, lon, ele, depth, data_source, st_id,
+    azimuth, dip (unknown values: NA)
+    :param avail_arr:
+    :param sources:
+    :return: object array of shape (len(avail_arr), 12)
+    """
+    stas = np.empty([len(avail_arr), 12], dtype=object)
+    if len(avail_arr) == 0:
+        return stas
+    for field, col in [('net', 0), ('sta', 1), ('loc', 2), ('cha', 3)]:
+        stas[:, col] = avail_arr[field].astype(np.unicode_).astype(str)
+    for field, col in [('lat', 4), ('lon', 5), ('ele', 6), ('depth', 7),
+                       ('azimuth', 10), ('dip', 11)]:
+        stas[:, col] = ['NA' if np.isnan(val) else '%s' % val
+                        for val in avail_arr[field].tolist()]
+    stas[:, 8] = [sources[code] for code in avail_arr['source'].tolist()]
+    stas[:, 9] = ['%s_%s_%s_%s' % (sta[0], sta[1], sta[2], sta[3])
+                  for sta in stas]
+    return stas
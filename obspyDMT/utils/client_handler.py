@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  client_handler.py
+#   Purpose:   shared FDSN/routing/syngine clients with cached
+#              service discovery
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import hashlib
+try:
+    from obspy.clients.fdsn import Client as Client_fdsn
+except:
+    from obspy.fdsn import Client as Client_fdsn
+try:
+    from obspy.clients.fdsn.header import URL_MAPPINGS
+except:
+    from obspy.fdsn.header import URL_MAPPINGS
+try:
+    from obspy.clients.fdsn import RoutingClient
+except:
+    print("[WARNING] RoutingClient could not be imported.")
+try:
+    from obspy.clients.syngine import Client as Client_syngine
+except:
+    print("[WARNING] syngine Client could not be imported.")
+import os
+import pickle
+import threading
+import time
+
+# one client per (process, kind, data center, credentials, timeout),
+# clients are shared by all events, stages and threads of a process
+clients = {}
+clients_locks = {}
+clients_lock = threading.Lock()
+
+ROUTING_CLIENTS = ["iris-federator", "eida-routing"]
+
+# ##################### shared_client #################################
+
+
+def shared_client(key, create):
+    """
+    client of key, created once by create() (clients of different keys
+    are created concurrently)
+    :param key:
+    :param create: function without arguments which returns a new client
+    :return:
+    """
+    with clients_lock:
+        if key in clients:
+            return clients[key]
+        key_lock = clients_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        if key not in clients:
+            clients[key] = create()
+        return clients[key]
+
+# ##################### services_cache_path #############################
+
+
+def services_cache_path(base_url):
+    """
+    path of the cached service discovery of one data center
+    :param base_url:
+    :return:
+    """
+    url_hash = hashlib.sha1(base_url.encode('utf-8')).hexdigest()
+    return os.path.join(os.path.expanduser('~'), '.obspyDMT',
+                        'fdsn_services', '%s.pkl' % url_hash)
+
+# ##################### read_services ###################################
+
+
+def read_services(base_url, ttl):
+    """
+    cached service discovery of base_url if it is younger than ttl
+    :param base_url:
+    :param ttl: time to live in hours
+    :return: services dictionary or None
+    """
+    if not ttl:
+        return None
+    cache_path = services_cache_path(base_url)
+    try:
+        if time.time() - os.path.getmtime(cache_path) > ttl*3600.:
+            return None
+        cache_fio = open(cache_path, 'rb')
+        try:
+            cached = pickle.load(cache_fio)
+        finally:
+            cache_fio.close()
+    except Exception:
+        return None
+    if cached.get('base_url') != base_url:
+        return None
+    return cached['services']
+
+# ##################### write_services ##################################
+
+
+def write_services(base_url, services):
+    """
+    store the service discovery of base_url on disk
+    :param base_url:
+    :param services:
+    :return:
+    """
+    cache_path = services_cache_path(base_url)
+    tmp_path = '%s.%s.tmp' % (cache_path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        cache_fio = open(tmp_path, 'wb')
+        try:
+            pickle.dump({'base_url': base_url, 'services': services},
+                        cache_fio, protocol=2)
+        finally:
+            cache_fio.close()
+        os.rename(tmp_path, cache_path)
+    except Exception as error:
+        print('[WARNING] service discovery of %s could not be cached: %s'
+              % (base_url, error))
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+# ##################### new_fdsn_client #################################
+
+
+def new_fdsn_client(base_url, user, password, timeout, ttl):
+    """
+    create a FDSN client, the service discovery is read from the cache
+    if possible
+    :param base_url:
+    :param user:
+    :param password:
+    :param timeout:
+    :param ttl: time to live of the cached service discovery in hours
+    :return:
+    """
+    # the cache is keyed by URL, names in URL_MAPPINGS may be remapped
+    cache_url = URL_MAPPINGS.get(base_url, base_url)
+    services = read_services(cache_url, ttl)
+    if services is None:
+        client_fdsn = Client_fdsn(base_url=base_url, user=user,
+                                  password=password, timeout=timeout)
+        if ttl and getattr(client_fdsn, 'services', None):
+            write_services(cache_url, client_fdsn.services)
+        return client_fdsn
+    try:
+        client_fdsn = Client_fdsn(base_url=base_url, user=user,
+                                  password=password, timeout=timeout,
+                                  _discover_services=False)
+    except TypeError:
+        # older obspy, services are always discovered
+        return Client_fdsn(base_url=base_url, user=user,
+                           password=password, timeout=timeout)
+    client_fdsn.services = services
+    return client_fdsn
+
+# ##################### fdsn_client #####################################
+
+
+def fdsn_client(input_dics, data_source, timeout=None):
+    """
+    shared FDSN (or routing) client of data_source
+    :param input_dics:
+    :param data_source: name in URL_MAPPINGS, URL or routing client
+    :param timeout: timeout of the requests (default: --req_timeout)
+    :return:
+    """
+    if timeout is None:
+        timeout = input_dics['req_timeout']
+    if data_source.lower() in ROUTING_CLIENTS:
+        key = (os.getpid(), 'routing', data_source.lower(), timeout)
+        return shared_client(key, lambda: RoutingClient(data_source.lower(),
+                                                        timeout=timeout))
+    if data_source.upper() in URL_MAPPINGS:
+        data_source = data_source.upper()
+    # keyed by URL, a name may be mapped to another URL later on
+    key = (os.getpid(), 'fdsn', URL_MAPPINGS.get(data_source, data_source),
+           input_dics['username_fdsn'], input_dics['password_fdsn'], timeout)
+    return shared_client(key, lambda: new_fdsn_client(
+        data_source, input_dics['username_fdsn'],
+        input_dics['password_fdsn'], timeout, input_dics['services_ttl']))
+
+# ##################### event_client ####################################
+
+
+def event_client(input_dics, event_url):
+    """
+    shared FDSN client of an event catalog (no credentials)
+    :param input_dics:
+    :param event_url:
+    :return:
+    """
+    if event_url.upper() in URL_MAPPINGS:
+        event_url = event_url.upper()
+    timeout = input_dics['req_timeout']
+    key = (os.getpid(), 'event', URL_MAPPINGS.get(event_url, event_url),
+           timeout)
+    return shared_client(key, lambda: new_fdsn_client(
+        event_url, None, None, timeout, input_dics['services_ttl']))
+
+# ##################### syngine_client ##################################
+
+
+def syngine_client(timeout=120):
+    """
+    shared syngine client of this process
+    :param timeout: timeout of the requests in seconds
+    :return:
+    """
+    key = (os.getpid(), 'syngine', timeout)
+    return shared_client(key, lambda: Client_syngine(timeout=timeout))
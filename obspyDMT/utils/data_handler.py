@@ -13,35 +13,32 @@
 # ----------------Import required Modules (Python and Obspy)-------------
 # -----------------------------------------------------------------------
 from __future__ import print_function
+import copy
 from datetime import datetime
 import fileinput
 import glob
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
-try:
-    from obspy.clients.fdsn import Client as Client_fdsn
-except:
-    from obspy.fdsn import Client as Client_fdsn
 try:
     from obspy.clients.arclink import Client as Client_arclink
 except:
     from obspy.arclink import Client as Client_arclink
-try:
-    from obspy.clients.fdsn import RoutingClient
-except:
-    print("[WARNING] RoutingClient could not be imported.")
-from obspy.clients.syngine import Client as Client_syngine
-try:
-    from obspy.geodetics.base import gps2dist_azimuth as gps2DistAzimuth
-except:
-    try:
-        from obspy.geodetics import gps2DistAzimuth
-    except:
-        from obspy.core.util import gps2DistAzimuth
-from obspy import read_inventory
+from obspy import read_inventory, Inventory
 import os
 import pickle
 
+from .request_handler import error_class, pool_download, schedule_download
+from .request_handler import robust_request, request_to_file
+from .request_handler import share_latencies
+from .response_handler import response_cache_dir, cache_fetch, cache_store
+from .segment_handler import segment_store_dir, segment_cut
+from .availability_handler import avail_path, avail_load, avail_rows
+from .client_handler import fdsn_client, syngine_client
+from .metrics_handler import record_metric, event_metrics_report
+from .session_handler import session_bulk_download, session_download
+from .state_handler import state_filter, state_update, state_failed
+from .state_handler import state_summary
 from .utility_codes import calculate_time_phase, getFolderSize
 from .utility_codes import geocen_calc
 
@@ -72,6 +69,9 @@ def get_data(stas_avail, event, input_dics, info_event):
         stas_avail = stas_avail[0:input_dics['test_num']]
 
     if input_dics['req_parallel']:
+        # the latency history (--req_hedge) is inherited by the processes
+        # of the data centers and kept for the next events
+        share_latencies(input_dics)
         par_jobs = []
         for req_cli in req_clients:
             st_avail = stas_avail[stas_avail[:, 8] == req_cli]
@@ -88,23 +88,10 @@ def get_data(stas_avail, event, input_dics, info_event):
                                                   info_event))
                 par_jobs.append(p)
 
-        sub_par_jobs = []
-        for l in range(len(par_jobs)):
-            counter = len(req_clients)
-            while counter >= len(req_clients):
-                counter = 0
-                for ll in range(len(sub_par_jobs)):
-                    if par_jobs[sub_par_jobs[ll]].is_alive():
-                        counter += 1
-            par_jobs[l].start()
-            sub_par_jobs.append(l)
-
-        counter = len(req_clients)
-        while counter > 0:
-            counter = 0
-            for ll in range(len(par_jobs)):
-                if par_jobs[ll].is_alive():
-                    counter += 1
+        for p in par_jobs:
+            p.start()
+        for p in par_jobs:
+            p.join()
     else:
         for req_cli in req_clients:
             st_avail = stas_avail[stas_avail[:, 8] == req_cli]
@@ -113,11 +100,90 @@ def get_data(stas_avail, event, input_dics, info_event):
             elif req_cli.lower() == 'arclink':
                 arc_waveform(st_avail, event, input_dics, req_cli, info_event)
 
+    event_metrics_report(input_dics, os.path.join(input_dics['datapath'],
+                                                  event['event_id']))
+    event_summary(event, input_dics, t_wave_1)
+
+# ##################### event_summary ###############################
+
+
+def event_summary(event, input_dics, t_wave_1):
+    """
+    print the summary of a retrieved event: time, concurrency windows
+    (--req_adaptive) and download state (--state_db)
+    :param event:
+    :param input_dics:
+    :param t_wave_1: start time of the download
+    :return:
+    """
     print("\n========================")
     print("DONE with Event: %s" % event['event_id'])
     print("Time: %s" % (datetime.now() - t_wave_1))
+    if input_dics['req_adaptive']:
+        window_path = os.path.join(input_dics['datapath'], event['event_id'],
+                                   'info', 'req_window')
+        if os.path.isfile(window_path):
+            print("Concurrency windows:")
+            window_fio = open(window_path, 'rt')
+            for window_line in window_fio.readlines():
+                print(window_line.strip())
+            window_fio.close()
+    if input_dics['state_db']:
+        print("Download state:")
+        for product, status, num_items, num_bytes in \
+                state_summary(input_dics, event):
+            print("%s -- %s: %s (%s bytes)" % (product, status, num_items,
+                                              num_bytes or 0))
     print("========================")
 
+# ##################### get_data_scheduled ###############################
+
+
+def get_data_scheduled(work_events, input_dics, event_retrieved=None):
+    """
+    get the waveform/response of all events with one download scheduler
+    (--req_np_total), see request_handler.schedule_download
+    :param work_events: iterable of (event, stas_avail, info_event)
+    :param input_dics:
+    :param event_retrieved: function(event) called when the data of an
+        event is retrieved (e.g. to start its processing)
+    :return:
+    """
+    t_wave_1 = datetime.now()
+
+    def scheduled_events():
+        for event, stas_avail, info_event in work_events:
+            if input_dics['test']:
+                stas_avail = stas_avail[0:input_dics['test_num']]
+            stas_avail = state_filter(stas_avail, event, input_dics)
+            print('[INFO] %s channels of event %s are queued'
+                  % (len(stas_avail), event['event_id']))
+            yield event, stas_avail, info_event
+
+    def scheduled_event_done(event):
+        target_path = os.path.join(input_dics['datapath'], event['event_id'])
+        update_sta_ev_file(target_path, event)
+        event_metrics_report(input_dics, target_path)
+        event_summary(event, input_dics, t_wave_1)
+        if event_retrieved:
+            event_retrieved(event)
+
+    schedule_download(scheduled_events(), input_dics, download_core_init,
+                      scheduled_event_done)
+
+# ##################### download_core_init ###############################
+
+
+def download_core_init(req_cli):
+    """
+    download_core and client_init functions of a data source
+    :param req_cli:
+    :return:
+    """
+    if req_cli.lower() == 'arclink':
+        return arc_download_core, arc_client_init
+    return fdsn_download_core, fdsn_client_init
+
 # ##################### fdsn_waveform ###############################
 
 
@@ -149,6 +215,15 @@ def fdsn_waveform(stas_avail, event, input_dics, req_cli, info_event):
         print('%s bulkdataselect request is done for event: %s' \
               % (req_cli, target_path))
 
+        if input_dics['response']:
+            try:
+                fdsn_bulk_response(stas_avail, event, target_path,
+                                   req_cli, input_dics)
+            except Exception as error:
+                print('[WARNING] %s' % error)
+            print('%s bulk station request is done for event: %s'
+                  % (req_cli, target_path))
+
     fdsn_serial_parallel(stas_avail, event, input_dics, target_path,
                          req_cli, info_event)
 
@@ -169,14 +244,44 @@ def fdsn_serial_parallel(stas_avail, event, input_dics, target_path,
     """
     print('%s -- event: %s' % (req_cli, target_path))
 
-    if req_cli.lower() in ["iris-federator", "eida-routing"]:
-        client_fdsn = RoutingClient(req_cli)
-    else:
-        client_fdsn = Client_fdsn(base_url=req_cli,
-                                  user=input_dics['username_fdsn'],
-                                  password=input_dics['password_fdsn'])
-                                  #debug=True)
-    client_syngine = Client_syngine()
+    # only the pending/failed channels of the state database (--state_db)
+    stas_avail = state_filter(stas_avail, event, input_dics)
+
+    input_dics_core = input_dics
+    if input_dics['req_engine'] == 'session' and \
+            req_cli.lower() not in ["iris-federator", "eida-routing"]:
+        client_fdsn, client_syngine = fdsn_client_init(input_dics, req_cli)
+        # in continuous mode with --continuous_block, the waveforms are
+        # cut from the segment store by download_core
+        seg_store = segment_store_dir(input_dics)
+        session_download(stas_avail, event,
+                         dict(input_dics, waveform=input_dics['waveform']
+                              and not seg_store),
+                         target_path, client_fdsn, req_cli, info_event,
+                         time_window)
+        # waveforms and responses are already retrieved by the session
+        # engine, only syngine requests are left for download_core
+        input_dics_core = dict(input_dics, response=False,
+                               waveform=input_dics['waveform'] and
+                               bool(seg_store))
+        if not (input_dics['syngine'] or input_dics_core['waveform']):
+            stas_avail = []
+
+    if input_dics['syngine'] and input_dics['syngine_bulk'] and \
+            len(stas_avail) > 0:
+        syngine_bulk_request(stas_avail, event, input_dics, target_path,
+                             req_cli)
+        input_dics_core = dict(input_dics_core, syngine=False)
+        if not (input_dics_core['waveform'] or input_dics_core['response']):
+            stas_avail = []
+
+    download_core = fdsn_download_core
+    if input_dics['req_coalesce'] and input_dics_core['waveform'] and \
+            len(stas_avail) > 0 and not segment_store_dir(input_dics):
+        # one waveform request per station and time window
+        stas_avail = coalesce_stas(stas_avail, event, input_dics)
+        download_core = fdsn_coalesce_core
+        print('[INFO] %s -- %s station requests' % (req_cli, len(stas_avail)))
 
     if input_dics['req_parallel']:
         if input_dics['password_fdsn']:
@@ -187,46 +292,19 @@ def fdsn_serial_parallel(stas_avail, event, input_dics, target_path,
             num_req_np = input_dics['req_np']
         else:
             num_req_np = input_dics['req_np']
-        par_jobs = []
-        st_counter = 0
-        for st_avail in stas_avail:
-            st_counter += 1
-            info_station = '[%s-%s/%s]' % (info_event, st_counter,
-                                           len(stas_avail))
-            p = multiprocessing.Process(target=fdsn_download_core,
-                                        args=(st_avail, event,
-                                              input_dics, target_path,
-                                              client_fdsn, client_syngine,
-                                              req_cli,
-                                              info_station))
-            par_jobs.append(p)
-
-        sub_par_jobs = []
-        for l in range(len(par_jobs)):
-            counter = num_req_np
-            while counter >= num_req_np:
-                counter = 0
-                for ll in range(len(sub_par_jobs)):
-                    if par_jobs[sub_par_jobs[ll]].is_alive():
-                        counter += 1
-            par_jobs[l].start()
-            sub_par_jobs.append(l)
-
-        counter = num_req_np
-        while counter > 0:
-            counter = 0
-            for ll in range(len(par_jobs)):
-                if par_jobs[ll].is_alive():
-                    counter += 1
-    else:
+        pool_download(download_core, fdsn_client_init, stas_avail,
+                      event, input_dics_core, target_path, req_cli,
+                      info_event, num_req_np)
+    elif len(stas_avail) > 0:
+        client_fdsn, client_syngine = fdsn_client_init(input_dics, req_cli)
         st_counter = 0
         for st_avail in stas_avail:
             st_counter += 1
             info_station = '[%s-%s/%s]' % (info_event, st_counter,
                                            len(stas_avail))
-            fdsn_download_core(st_avail, event, input_dics, target_path,
-                               client_fdsn, client_syngine,
-                               req_cli, info_station)
+            download_core(st_avail, event, input_dics_core, target_path,
+                          client_fdsn, client_syngine,
+                          req_cli, info_station)
 
     update_sta_ev_file(target_path, event)
 
@@ -256,6 +334,164 @@ def fdsn_serial_parallel(stas_avail, event, input_dics, target_path,
         file_staev_open.close()
         print('DONE')
 
+# ##################### fdsn_client_init ##################################
+
+
+def fdsn_client_init(input_dics, req_cli):
+    """
+    create the FDSN and syngine clients used to retrieve data from req_cli
+    :param input_dics:
+    :param req_cli:
+    :return:
+    """
+    client_fdsn = fdsn_client(input_dics, req_cli)
+    client_syngine = syngine_client(input_dics['req_timeout'])
+    return client_fdsn, client_syngine
+
+# ##################### coalesce_stas ##################################
+
+
+def coalesce_stas(stas_avail, event, input_dics):
+    """
+    group the channels of the availability array by network, station
+    and requested time window
+    :param stas_avail:
+    :param event:
+    :param input_dics:
+    :return: list of groups (lists of channels)
+    """
+    st_groups = {}
+    st_keys = []
+    for st_avail in stas_avail:
+        if st_avail[2] == '--' or st_avail[2] == '  ':
+            st_avail[2] = ''
+        try:
+            t_start, t_end = time_window(event, st_avail, input_dics)
+        except Exception:
+            t_start, t_end = event['t1'], event['t2']
+        st_key = (st_avail[0], st_avail[1], str(t_start), str(t_end))
+        if st_key not in st_groups:
+            st_groups[st_key] = []
+            st_keys.append(st_key)
+        st_groups[st_key].append(st_avail)
+    return [st_groups[st_key] for st_key in st_keys]
+
+# ##################### fdsn_coalesce_core ##################################
+
+
+def fdsn_coalesce_core(st_group, event, input_dics, target_path,
+                       client_fdsn, client_syngine, req_cli, info_station):
+    """
+    retrieve the waveforms of all channels of one station with one
+    request, split the stream locally into raw/NET.STA.LOC.CHA files and
+    pass the channels to fdsn_download_core for response/syngine.
+    :param st_group: channels of one station with the same time window
+    :param event:
+    :param input_dics:
+    :param target_path:
+    :param client_fdsn:
+    :param client_syngine:
+    :param req_cli:
+    :param info_station:
+    :return:
+    """
+    t11 = datetime.now()
+    req_error = None
+    sta_id = '%s.%s' % (st_group[0][0], st_group[0][1])
+    try:
+        st_req = []
+        for st_avail in st_group:
+            st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                     st_avail[2], st_avail[3])
+            if os.path.isfile(os.path.join(target_path, 'raw', st_id)) \
+                    and not input_dics['force_waveform']:
+                continue
+            st_req.append(st_avail)
+
+        if len(st_req) > 0:
+            t_start, t_end = time_window(event, st_req[0], input_dics)
+            req_locs = sorted(set([st[2] if st[2] else '--' for st in st_req]))
+            req_chas = sorted(set([st[3] for st in st_req]))
+            for st_avail in st_req:
+                state_update(input_dics, event,
+                             '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                              st_avail[2], st_avail[3]),
+                             'waveform', 'in-flight')
+            dl_error = None
+            num_retry = 0
+            t_req = datetime.now()
+            try:
+                dl_waveform, num_retry = robust_request(
+                    lambda: client_fdsn.get_waveforms(
+                        network=st_req[0][0],
+                        station=st_req[0][1],
+                        location=','.join(req_locs),
+                        channel=','.join(req_chas),
+                        starttime=t_start,
+                        endtime=t_end),
+                    input_dics, req_cli, 'waveform')
+            except Exception as error:
+                dl_error = error
+                req_error = error
+                num_retry = getattr(error, 'req_retries', 0)
+                dl_waveform = []
+            req_latency = (datetime.now() - t_req).total_seconds()
+            # bytes of the miniSEED files written from this request
+            n_bytes = 0
+            for st_avail in st_req:
+                st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                         st_avail[2], st_avail[3])
+                try:
+                    if dl_error is not None:
+                        raise dl_error
+                    st_waveform = dl_waveform.select(network=st_avail[0],
+                                                     station=st_avail[1],
+                                                     location=st_avail[2],
+                                                     channel=st_avail[3])
+                    if len(st_waveform) == 0:
+                        raise Exception('No data available for request.')
+                    st_waveform.write(os.path.join(target_path, 'raw', st_id),
+                                      format='mseed')
+                    n_bytes += os.path.getsize(os.path.join(target_path,
+                                                            'raw', st_id))
+                    state_update(input_dics, event, st_id, 'waveform', 'done',
+                                 path=os.path.join(target_path, 'raw', st_id),
+                                 duration=(datetime.now() -
+                                           t11).total_seconds())
+                    print('%s -- %s -- saving waveform for: %s  ---> DONE'
+                          % (info_station, req_cli, st_id))
+                except Exception as error:
+                    ee = '%s -- %s -- %s -- %s\n' % (req_cli, 'waveform',
+                                                      st_id, error)
+                    Exception_file = open(os.path.join(target_path, 'info',
+                                                       'exception'), 'at+')
+                    Exception_file.writelines(ee)
+                    Exception_file.close()
+                    state_failed(input_dics, event, st_avail, 'waveform',
+                                 error)
+            record_metric(input_dics, target_path, req_cli, 'waveform',
+                          '%s.%s' % (sta_id, ','.join(req_chas)),
+                          req_latency, n_bytes=n_bytes,
+                          error=dl_error, retries=num_retry)
+    except Exception as error:
+        req_error = error
+        ee = '%s -- %s -- %s -- %s\n' % (req_cli, 'waveform', sta_id, error)
+        Exception_file = open(os.path.join(target_path, 'info',
+                                           'exception'), 'at+')
+        Exception_file.writelines(ee)
+        Exception_file.close()
+    t22 = datetime.now()
+
+    # responses and synthetics are still retrieved per channel
+    if input_dics['response'] or input_dics['syngine']:
+        input_dics_core = dict(input_dics, waveform=False)
+        for st_avail in st_group:
+            fdsn_download_core(st_avail, event, input_dics_core, target_path,
+                               client_fdsn, client_syngine,
+                               req_cli, info_station)
+    return {'st_id': sta_id, 'duration': (t22 - t11).total_seconds(),
+            'error_class': error_class(req_error)}
+
 # ##################### fdsn_download_core ##################################
 
 
@@ -277,75 +513,73 @@ def fdsn_download_core(st_avail, event, input_dics, target_path,
     dummy = 'initializing'
 
     t11 = datetime.now()
+    t_prod = t11
     identifier = 0
     st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
                              st_avail[2], st_avail[3])
     try:
         if st_avail[2] == '--' or st_avail[2] == '  ':
                 st_avail[2] = ''
+        state_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                    st_avail[2], st_avail[3])
 
-        if input_dics['cut_time_phase']:
-            t_start, t_end = calculate_time_phase(event, st_avail)
-        else:
-            t_start = event['t1']
-            t_end = event['t2']
-
-        if input_dics['min_azi'] or input_dics['max_azi'] or \
-                input_dics['min_epi'] or input_dics['max_epi']:
-            dist, azi, bazi = gps2DistAzimuth(event['latitude'],
-                                              event['longitude'],
-                                              float(st_avail[4]),
-                                              float(st_avail[5]))
-            epi_dist = dist/111.194/1000.
-            if input_dics['min_epi']:
-                if epi_dist < input_dics['min_epi']:
-                    raise Exception('%s out of epi range: %s'
-                                    % (st_id, epi_dist))
-            if input_dics['max_epi']:
-                if epi_dist > input_dics['max_epi']:
-                    raise Exception('%s out of epi range: %s'
-                                    % (st_id, epi_dist))
-            if input_dics['min_azi']:
-                if azi < input_dics['min_azi']:
-                    raise Exception('%s outo f Azimuth range: %s'
-                                    % (st_id, azi))
-            if input_dics['max_azi']:
-                if azi > input_dics['max_azi']:
-                    raise Exception('%s out of Azimuth range: %s'
-                                    % (st_id, azi))
+        t_start, t_end = time_window(event, st_avail, input_dics)
 
         if input_dics['waveform']:
             dummy = 'waveform'
             if (not os.path.isfile(os.path.join(target_path, 'raw', st_id)))\
                     or input_dics['force_waveform']:
                 waveforms_path2write = os.path.join(target_path, 'raw', st_id)
-                if req_cli.lower() in ["iris-federator", "eida-routing"]:
-                    dl_waveform = \
-                        client_fdsn.get_waveforms(
-                            network=st_avail[0],
-                            station=st_avail[1],
-                            location=st_avail[2],
-                            channel=st_avail[3],
-                            starttime=t_start,
-                            endtime=t_end)
-                    if len(dl_waveform) > 0:
-                        dl_waveform.write(waveforms_path2write, format='mseed')
-                    else:
-                        raise Exception
+                t_prod = datetime.now()
+                state_update(input_dics, event, state_id, dummy, 'in-flight')
+
+                def fetch_waveform(path_tmp):
+                    if req_cli.lower() in ["iris-federator",
+                                           "eida-routing"]:
+                        dl_waveform = \
+                            client_fdsn.get_waveforms(
+                                network=st_avail[0],
+                                station=st_avail[1],
+                                location=st_avail[2],
+                                channel=st_avail[3],
+                                starttime=t_start,
+                                endtime=t_end)
+                        if len(dl_waveform) > 0:
+                            dl_waveform.write(path_tmp, format='mseed')
+                        else:
+                            raise Exception
 
+                    else:
+                        client_fdsn.get_waveforms(network=st_avail[0],
+                                                  station=st_avail[1],
+                                                  location=st_avail[2],
+                                                  channel=st_avail[3],
+                                                  starttime=t_start,
+                                                  endtime=t_end,
+                                                  filename=path_tmp)
+                if segment_store_dir(input_dics):
+                    # the blocks are retried one by one in the store
+                    num_retry = segment_cut(client_fdsn, st_avail, t_start,
+                                            t_end, input_dics, req_cli,
+                                            waveforms_path2write)
                 else:
-                    client_fdsn.get_waveforms(network=st_avail[0],
-                                              station=st_avail[1],
-                                              location=st_avail[2],
-                                              channel=st_avail[3],
-                                              starttime=t_start,
-                                              endtime=t_end,
-                                              filename=waveforms_path2write)
+                    num_retry = request_to_file(fetch_waveform,
+                                                waveforms_path2write,
+                                                input_dics, req_cli, dummy)
                 identifier += 10
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=waveforms_path2write,
+                             duration=(datetime.now() -
+                                       t_prod).total_seconds())
+                record_metric(input_dics, target_path, req_cli, dummy, st_id,
+                              (datetime.now() - t_prod).total_seconds(),
+                              path=waveforms_path2write, retries=num_retry)
                 print('%s -- %s -- saving waveform for: %s  ---> DONE' \
                       % (info_station, req_cli, st_id))
             else:
                 identifier += 1
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=os.path.join(target_path, 'raw', st_id))
 
         if input_dics['response']:
             dummy = 'response'
@@ -353,35 +587,63 @@ def fdsn_download_core(st_avail, event, input_dics, target_path,
                                                 'STXML.' + st_id))) \
                     or input_dics['force_response']:
                 resp_path2write = os.path.join(target_path, 'resp', 'STXML.%s' % st_id)
-                if req_cli.lower() in ["iris-federator", "eida-routing"]:
-                    dl_response = \
-                        client_fdsn.get_stations(
-                            network=st_avail[0],
-                            station=st_avail[1],
-                            location=st_avail[2],
-                            channel=st_avail[3],
-                            starttime=t_start,
-                            endtime=t_end,
-                            level='response')
-                    if len(dl_response) > 0:
-                        dl_response.write(resp_path2write, format="stationxml")
-                    else:
-                        raise Exception
+                resp_cache = response_cache_dir(input_dics)
+                t_prod = datetime.now()
+                state_update(input_dics, event, state_id, dummy, 'in-flight')
+
+                def fetch_response(path_tmp):
+                    if req_cli.lower() in ["iris-federator", "eida-routing"]:
+                        dl_response = \
+                            client_fdsn.get_stations(
+                                network=st_avail[0],
+                                station=st_avail[1],
+                                location=st_avail[2],
+                                channel=st_avail[3],
+                                starttime=t_start,
+                                endtime=t_end,
+                                level='response')
+                        if len(dl_response) > 0:
+                            dl_response.write(path_tmp, format="stationxml")
+                        else:
+                            raise Exception
 
+                    else:
+                        client_fdsn.get_stations(network=st_avail[0],
+                                                 station=st_avail[1],
+                                                 location=st_avail[2],
+                                                 channel=st_avail[3],
+                                                 starttime=t_start,
+                                                 endtime=t_end,
+                                                 filename=path_tmp,
+                                                 level='response')
+                num_retry = 0
+                if resp_cache and (not input_dics['force_response']) and \
+                        cache_fetch(resp_cache, st_id, t_start, t_end,
+                                    resp_path2write):
+                    print("%s -- %s -- response from cache for: %s" \
+                          % (info_station, req_cli, st_id))
                 else:
-                    client_fdsn.get_stations(network=st_avail[0],
-                                             station=st_avail[1],
-                                             location=st_avail[2],
-                                             channel=st_avail[3],
-                                             starttime=t_start,
-                                             endtime=t_end,
-                                             filename=resp_path2write,
-                                             level='response')
+                    num_retry = request_to_file(fetch_response,
+                                                resp_path2write,
+                                                input_dics, req_cli, dummy)
+                    # only downloaded files are added to the cache
+                    if resp_cache and os.path.isfile(resp_path2write):
+                        cache_store(resp_cache, st_id, resp_path2write)
                 identifier += 100
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=resp_path2write,
+                             duration=(datetime.now() -
+                                       t_prod).total_seconds())
+                record_metric(input_dics, target_path, req_cli, dummy, st_id,
+                              (datetime.now() - t_prod).total_seconds(),
+                              path=resp_path2write, retries=num_retry)
                 print("%s -- %s -- saving response for: %s  ---> DONE" \
                       % (info_station, req_cli, st_id))
             else:
                 identifier += 1
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=os.path.join(target_path, 'resp',
+                                               'STXML.%s' % st_id))
 
         if input_dics['syngine']:
             dummy = 'syngine_waveform'
@@ -391,6 +653,8 @@ def fdsn_download_core(st_avail, event, input_dics, target_path,
                 os.makedirs(syn_dirpath)
             if (not os.path.isfile(os.path.join(syn_dirpath, st_id)))\
                     or input_dics['force_waveform']:
+                t_prod = datetime.now()
+                state_update(input_dics, event, state_id, dummy, 'in-flight')
 
                 if input_dics['syngine_geocentric_lat']:
                     rcvlatitude = geocen_calc(float(st_avail[4]))
@@ -410,48 +674,60 @@ def fdsn_download_core(st_avail, event, input_dics, target_path,
                 # kernelwidth=None
                 # sourceforce=None
                 # label=None
-                req_syngine_component = st_avail[3][-1]
-                if req_syngine_component == '1':
-                    req_syngine_component = 'E'
-                elif req_syngine_component == '2':
-                    req_syngine_component = 'N'
+                req_syngine_component = syngine_component(st_avail)
                 st_id = '%s.%s.%s.%s' % (st_avail[0],
                                          st_avail[1],
                                          st_avail[2],
                                          st_avail[3][:-1] + req_syngine_component)
-                syn_st = client_syngine.get_waveforms(
-                    model=input_dics['syngine_bg_model'],
-                    receiverlatitude=rcvlatitude,
-                    receiverlongitude=float(st_avail[5]),
-                    networkcode=st_avail[0],
-                    stationcode=st_avail[1],
-                    sourcelatitude=evlatitude,
-                    sourcelongitude=event['longitude'],
-                    sourcedepthinmeters=float(event['depth'])*1000.,
-                    origintime=event['datetime'],
-                    components=req_syngine_component,
-                    units=input_dics['syngine_units'],
-                    sourcemomenttensor=syngine_momenttensor,
-                    starttime=t_start,
-                    endtime=t_end)[0]
-
-                syn_st.stats.location = st_avail[2]
-                syn_st.stats.channel = st_avail[3][:-1] + req_syngine_component
-                syn_st.write(os.path.join(syn_dirpath, st_id),
-                             format='mseed')
+
+                def fetch_syngine(path_tmp):
+                    syn_st = client_syngine.get_waveforms(
+                        model=input_dics['syngine_bg_model'],
+                        receiverlatitude=rcvlatitude,
+                        receiverlongitude=float(st_avail[5]),
+                        networkcode=st_avail[0],
+                        stationcode=st_avail[1],
+                        sourcelatitude=evlatitude,
+                        sourcelongitude=event['longitude'],
+                        sourcedepthinmeters=float(event['depth'])*1000.,
+                        origintime=event['datetime'],
+                        components=req_syngine_component,
+                        units=input_dics['syngine_units'],
+                        sourcemomenttensor=syngine_momenttensor,
+                        starttime=t_start,
+                        endtime=t_end)[0]
+
+                    syn_st.stats.location = st_avail[2]
+                    syn_st.stats.channel = \
+                        st_avail[3][:-1] + req_syngine_component
+                    syn_st.write(path_tmp, format='mseed')
+                num_retry = request_to_file(fetch_syngine,
+                                            os.path.join(syn_dirpath, st_id),
+                                            input_dics, 'syngine', dummy)
 
                 identifier += 1000
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=os.path.join(syn_dirpath, st_id),
+                             duration=(datetime.now() -
+                                       t_prod).total_seconds())
+                record_metric(input_dics, target_path, req_cli, dummy, st_id,
+                              (datetime.now() - t_prod).total_seconds(),
+                              path=os.path.join(syn_dirpath, st_id),
+                              retries=num_retry)
                 print('%s -- %s -- saving syngine for: %s  ---> DONE' \
                       % (info_station, req_cli, st_id))
             else:
                 identifier += 1
+                state_update(input_dics, event, state_id, dummy, 'done')
 
         # if identifier in [0, 2, 3, 10, 11, 100]:
         #     raise Exception("CODE: %s will not be registered! (666)"
         #                     % identifier)
         t22 = datetime.now()
+        req_error = None
     except Exception as error:
         t22 = datetime.now()
+        req_error = error
         if len(st_avail) > 0:
             ee = '%s -- %s -- %s -- %s\n' % (req_cli, dummy, st_id, error)
         else:
@@ -460,6 +736,13 @@ def fdsn_download_core(st_avail, event, input_dics, target_path,
                                            'info', 'exception'), 'at+')
         Exception_file.writelines(ee)
         Exception_file.close()
+        state_failed(input_dics, event, st_avail, dummy, error)
+        if dummy != 'initializing':
+            record_metric(input_dics, target_path, req_cli, dummy, st_id,
+                          (t22 - t_prod).total_seconds(), error=error,
+                          retries=getattr(error, 'req_retries', 0))
+    return {'st_id': st_id, 'duration': (t22 - t11).total_seconds(),
+            'error_class': error_class(req_error)}
 
 # ##################### fdsn_bulk_request ##################################
 
@@ -467,6 +750,8 @@ def fdsn_download_core(st_avail, event, input_dics, target_path,
 def fdsn_bulk_request(target_path, req_cli, input_dics):
     """
     send bulk request to FDSN
+    the bulk list is sent in chunks of --bulk_chunk channels and the
+    retrieved records are written directly to raw/ (session_bulk_download)
     :param target_path:
     :param req_cli:
     :param input_dics:
@@ -474,22 +759,311 @@ def fdsn_bulk_request(target_path, req_cli, input_dics):
     """
     print('\n[INFO] sending bulk request to: %s' % req_cli)
 
-    client_fdsn = Client_fdsn(base_url=req_cli,
-                              user=input_dics['username_fdsn'],
-                              password=input_dics['password_fdsn'])
+    client_fdsn = fdsn_client(input_dics, req_cli)
 
     bulk_list_fio = open(os.path.join(target_path, 'info',
                                       'bulkdata_list_%s' % req_cli), 'rb')
     bulk_list = pickle.load(bulk_list_fio)
-    bulk_smgrs = client_fdsn.get_waveforms_bulk(bulk_list)
-    print('[INFO] saving the retrieved waveforms from %s...' % req_cli)
-    for bulk_st in bulk_smgrs:
-        bulk_st.write(os.path.join(target_path, 'raw', '%s.%s.%s.%s'
-                                   % (bulk_st.stats['network'],
-                                      bulk_st.stats['station'],
-                                      bulk_st.stats['location'],
-                                      bulk_st.stats['channel'])),
-                      'MSEED')
+    bulk_list_fio.close()
+    print('[INFO] %s -- %s channels in %s chunk(s)'
+          % (req_cli, len(bulk_list),
+             -(-len(bulk_list) // max(1, input_dics['bulk_chunk']))))
+    session_bulk_download(bulk_list, target_path, client_fdsn, req_cli,
+                          input_dics)
+
+# ##################### fdsn_bulk_response ##################################
+
+
+def fdsn_bulk_response(stas_avail, event, target_path, req_cli, input_dics):
+    """
+    retrieve the StationXML files of all channels with bulk station
+    requests of --bulk_chunk channels, parse each inventory once and split
+    it into resp/STXML.NET.STA.LOC.CHA files.
+    Channels missing in the bulk response are left to the
+    per-channel requests of fdsn_download_core.
+    :param stas_avail:
+    :param event:
+    :param target_path:
+    :param req_cli:
+    :param input_dics:
+    :return:
+    """
+    print('\n[INFO] sending bulk station request to: %s' % req_cli)
+    resp_cache = response_cache_dir(input_dics)
+    bulk_list = []
+    for st_avail in stas_avail:
+        if st_avail[2] == '--' or st_avail[2] == '  ':
+            st_avail[2] = ''
+        st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                 st_avail[2], st_avail[3])
+        if os.path.isfile(os.path.join(target_path, 'resp',
+                                       'STXML.%s' % st_id)) \
+                and not input_dics['force_response']:
+            continue
+        try:
+            t_start, t_end = time_window(event, st_avail, input_dics)
+        except Exception:
+            continue
+        if resp_cache and (not input_dics['force_response']) and \
+                cache_fetch(resp_cache, st_id, t_start, t_end,
+                            os.path.join(target_path, 'resp',
+                                         'STXML.%s' % st_id)):
+            continue
+        bulk_list.append((st_avail[0], st_avail[1], st_avail[2] or '--',
+                          st_avail[3], t_start, t_end))
+    if len(bulk_list) == 0:
+        return
+
+    client_fdsn, client_syngine = fdsn_client_init(input_dics, req_cli)
+    chunk_size = max(1, input_dics['bulk_chunk'])
+    bulk_chunks = [bulk_list[i:i + chunk_size]
+                   for i in range(0, len(bulk_list), chunk_size)]
+    for chunk_num, bulk_chunk in enumerate(bulk_chunks):
+        t_chunk = datetime.now()
+        try:
+            # retried as the other requests, but not hedged: a duplicate
+            # of a whole chunk would double the load of the data center
+            bulk_inv, num_retry = robust_request(
+                lambda: client_fdsn.get_stations_bulk(bulk_chunk,
+                                                      level='response'),
+                input_dics, req_cli, 'bulk_response', hedge=False)
+            num_saved = split_bulk_inventory(bulk_inv, bulk_chunk, event,
+                                             target_path, input_dics,
+                                             resp_cache)
+            record_metric(input_dics, target_path, req_cli, 'bulk_response',
+                          'chunk %s' % (chunk_num + 1),
+                          (datetime.now() - t_chunk).total_seconds(),
+                          retries=num_retry)
+            print('[INFO] %s -- saving %s/%s responses from bulk request'
+                  % (req_cli, num_saved, len(bulk_chunk)))
+        except Exception as error:
+            # the channels of this chunk are left to the per-channel
+            # requests, the other chunks are not affected
+            record_metric(input_dics, target_path, req_cli, 'bulk_response',
+                          'chunk %s' % (chunk_num + 1),
+                          (datetime.now() - t_chunk).total_seconds(),
+                          error=error,
+                          retries=getattr(error, 'req_retries', 0))
+            ee = '%s -- bulk_response -- chunk %s/%s -- %s\n' \
+                 % (req_cli, chunk_num + 1, len(bulk_chunks), error)
+            exc_file = open(os.path.join(target_path, 'info', 'exception'),
+                            'at+')
+            exc_file.writelines(ee)
+            exc_file.close()
+            print('ERROR: %s' % ee)
+
+# ##################### split_bulk_inventory ##############################
+
+
+def split_bulk_inventory(bulk_inv, bulk_chunk, event, target_path,
+                         input_dics, resp_cache):
+    """
+    write the channels of a bulk inventory into resp/STXML.NET.STA.LOC.CHA
+    files, the inventory is walked once and the files are written
+    in parallel (--req_np threads)
+    :param bulk_inv:
+    :param bulk_chunk: list of (net, sta, loc, cha, t_start, t_end)
+    :param event:
+    :param target_path:
+    :param input_dics:
+    :param resp_cache:
+    :return: number of files written
+    """
+    bulk_windows = {}
+    for bulk_item in bulk_chunk:
+        st_id = '%s.%s.%s.%s' % (bulk_item[0], bulk_item[1],
+                                 bulk_item[2].replace('--', ''), bulk_item[3])
+        bulk_windows[st_id] = (bulk_item[4], bulk_item[5])
+
+    # st_id: [network, station, [channel epochs in the time window]]
+    st_channels = {}
+    for network in bulk_inv:
+        for station in network:
+            for channel in station:
+                st_id = '%s.%s.%s.%s' % (network.code, station.code,
+                                         channel.location_code, channel.code)
+                if st_id not in bulk_windows:
+                    continue
+                t_start, t_end = bulk_windows[st_id]
+                if (channel.start_date and channel.start_date > t_end) or \
+                        (channel.end_date and channel.end_date < t_start):
+                    continue
+                st_channels.setdefault(st_id, [network, station, []])
+                st_channels[st_id][2].append(channel)
+
+    def write_task(st_item):
+        st_id, (network, station, channels) = st_item
+        st_station = copy.copy(station)
+        st_station.channels = channels
+        st_network = copy.copy(network)
+        st_network.stations = [st_station]
+        st_inv = Inventory(networks=[st_network], source=bulk_inv.source)
+        resp_path2write = os.path.join(target_path, 'resp', 'STXML.%s' % st_id)
+        st_inv.write(resp_path2write, format='stationxml')
+        if resp_cache:
+            cache_store(resp_cache, st_id, resp_path2write)
+        state_update(input_dics, event, st_id, 'response', 'done',
+                     path=resp_path2write)
+
+    if input_dics['req_parallel']:
+        num_req_np = input_dics['req_np']
+    else:
+        num_req_np = 1
+    pool = ThreadPool(processes=max(1, min(num_req_np, len(st_channels))))
+    try:
+        pool.map(write_task, list(st_channels.items()), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return len(st_channels)
+
+# ##################### syngine_component ##################################
+
+
+def syngine_component(st_avail):
+    """
+    syngine component of a channel (1 --> E, 2 --> N)
+    :param st_avail:
+    :return:
+    """
+    req_syngine_component = st_avail[3][-1]
+    if req_syngine_component == '1':
+        req_syngine_component = 'E'
+    elif req_syngine_component == '2':
+        req_syngine_component = 'N'
+    return req_syngine_component
+
+# ##################### syngine_bulk_request ##################################
+
+
+def syngine_bulk_request(stas_avail, event, input_dics, target_path, req_cli):
+    """
+    retrieve the synthetic waveforms of all channels with syngine bulk
+    requests. Receivers with the same time window and components are
+    sent together (at most --bulk_chunk receivers per request) and the
+    returned stream is split into syngine_<model>/NET.STA.LOC.CHA files.
+    :param stas_avail:
+    :param event:
+    :param input_dics:
+    :param target_path:
+    :param req_cli:
+    :return:
+    """
+    syn_dirpath = os.path.join(
+        target_path, 'syngine_%s' % input_dics['syngine_bg_model'])
+    if not os.path.isdir(syn_dirpath):
+        os.makedirs(syn_dirpath)
+
+    # receivers --> channels
+    syn_groups = {}
+    for st_avail in stas_avail:
+        if st_avail[2] == '--' or st_avail[2] == '  ':
+            st_avail[2] = ''
+        st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1], st_avail[2],
+                                 st_avail[3][:-1] + syngine_component(st_avail))
+        if os.path.isfile(os.path.join(syn_dirpath, st_id)) and \
+                not input_dics['force_waveform']:
+            continue
+        try:
+            t_start, t_end = time_window(event, st_avail, input_dics)
+        except Exception:
+            continue
+        rcv_key = (st_avail[0], st_avail[1], str(t_start), str(t_end))
+        if rcv_key not in syn_groups:
+            syn_groups[rcv_key] = (t_start, t_end, [])
+        syn_groups[rcv_key][2].append(st_avail)
+
+    # receivers --> requests (same time window and components)
+    syn_requests = {}
+    for rcv_key in syn_groups:
+        t_start, t_end, rcv_chas = syn_groups[rcv_key]
+        components = ''.join(sorted(set([syngine_component(st_avail)
+                                         for st_avail in rcv_chas])))
+        req_key = (rcv_key[2], rcv_key[3], components)
+        if req_key not in syn_requests:
+            syn_requests[req_key] = (t_start, t_end, [])
+        syn_requests[req_key][2].append(rcv_chas)
+    if len(syn_requests) == 0:
+        return
+
+    if input_dics['syngine_geocentric_lat']:
+        evlatitude = geocen_calc(event['latitude'])
+    else:
+        evlatitude = event['latitude']
+    if not event['focal_mechanism']:
+        syngine_momenttensor = None
+    else:
+        syngine_momenttensor = event['focal_mechanism']
+
+    client_syngine = syngine_client(input_dics['req_timeout'])
+    chunk_size = max(1, input_dics['bulk_chunk'])
+    print('[INFO] %s -- syngine bulk requests for %s receivers'
+          % (req_cli, len(syn_groups)))
+    for req_key in syn_requests:
+        t_start, t_end, rcv_list = syn_requests[req_key]
+        for chunk_start in range(0, len(rcv_list), chunk_size):
+            rcv_chunk = rcv_list[chunk_start:chunk_start + chunk_size]
+            rcv_lats = np.array([float(rcv_chas[0][4])
+                                 for rcv_chas in rcv_chunk])
+            if input_dics['syngine_geocentric_lat']:
+                rcv_lats = geocen_calc(rcv_lats)
+            syn_bulk = [{'latitude': rcv_lats[i],
+                         'longitude': float(rcv_chas[0][5]),
+                         'networkcode': rcv_chas[0][0],
+                         'stationcode': rcv_chas[0][1]}
+                        for i, rcv_chas in enumerate(rcv_chunk)]
+            try:
+                syn_st, num_retry = robust_request(
+                    lambda: client_syngine.get_waveforms_bulk(
+                        model=input_dics['syngine_bg_model'],
+                        bulk=syn_bulk,
+                        sourcelatitude=evlatitude,
+                        sourcelongitude=event['longitude'],
+                        sourcedepthinmeters=float(event['depth'])*1000.,
+                        origintime=event['datetime'],
+                        components=req_key[2],
+                        units=input_dics['syngine_units'],
+                        sourcemomenttensor=syngine_momenttensor,
+                        starttime=t_start,
+                        endtime=t_end),
+                    input_dics, 'syngine', 'bulk_syngine_waveform')
+            except Exception as error:
+                syn_st = None
+                syn_error = error
+            for rcv_chas in rcv_chunk:
+                for st_avail in rcv_chas:
+                    syn_cha = st_avail[3][:-1] + syngine_component(st_avail)
+                    st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                             st_avail[2], syn_cha)
+                    try:
+                        if syn_st is None:
+                            raise syn_error
+                        syn_tr = syn_st.select(
+                            network=st_avail[0], station=st_avail[1],
+                            component=syngine_component(st_avail))
+                        if len(syn_tr) == 0:
+                            raise Exception('No data available for request.')
+                        syn_tr = syn_tr[0].copy()
+                        syn_tr.stats.location = st_avail[2]
+                        syn_tr.stats.channel = syn_cha
+                        syn_tr.write(os.path.join(syn_dirpath, st_id),
+                                     format='mseed')
+                        state_update(input_dics, event, '%s.%s.%s.%s'
+                                     % (st_avail[0], st_avail[1],
+                                        st_avail[2], st_avail[3]),
+                                     'syngine_waveform', 'done',
+                                     path=os.path.join(syn_dirpath, st_id))
+                    except Exception as error:
+                        ee = '%s -- %s -- %s -- %s\n' \
+                             % (req_cli, 'syngine_waveform', st_id, error)
+                        Exception_file = open(os.path.join(
+                            target_path, 'info', 'exception'), 'at+')
+                        Exception_file.writelines(ee)
+                        Exception_file.close()
+                        state_failed(input_dics, event, st_avail,
+                                     'syngine_waveform', error)
+            print('[INFO] %s -- syngine bulk request (%s, %s receivers) '
+                  '---> DONE' % (req_cli, req_key[2], len(rcv_chunk)))
 
 # ##################### arc_waveform ###############################
 
@@ -527,46 +1101,21 @@ def arc_serial_parallel(stas_avail, event, input_dics, target_path,
     """
     print('%s -- event: %s' % (req_cli, target_path))
 
-    client_arclink = Client_arclink(user=input_dics['username_arclink'],
-                                    host=input_dics['host_arclink'],
-                                    port=input_dics['port_arclink'],
-                                    password=input_dics['password_arclink'],
-                                    timeout=input_dics['arc_wave_timeout'])
-    client_syngine = Client_syngine()
+    # only the pending/failed channels of the state database (--state_db)
+    stas_avail = state_filter(stas_avail, event, input_dics)
+
+    if input_dics['syngine'] and input_dics['syngine_bulk'] and \
+            len(stas_avail) > 0:
+        syngine_bulk_request(stas_avail, event, input_dics, target_path,
+                             req_cli)
+        input_dics = dict(input_dics, syngine=False)
 
     if input_dics['req_parallel']:
-        par_jobs = []
-        st_counter = 0
-        for st_avail in stas_avail:
-            st_counter += 1
-            info_station = '[%s-%s/%s]' % (info_event, st_counter,
-                                           len(stas_avail))
-            p = multiprocessing.Process(target=arc_download_core,
-                                        args=(st_avail, event,
-                                              input_dics, target_path,
-                                              client_arclink, client_syngine,
-                                              req_cli,
-                                              info_station))
-            par_jobs.append(p)
-
-        sub_par_jobs = []
-        for l in range(len(par_jobs)):
-            counter = input_dics['req_np']
-            while counter >= input_dics['req_np']:
-                counter = 0
-                for ll in range(len(sub_par_jobs)):
-                    if par_jobs[sub_par_jobs[ll]].is_alive():
-                        counter += 1
-            par_jobs[l].start()
-            sub_par_jobs.append(l)
-
-        counter = input_dics['req_np']
-        while counter > 0:
-            counter = 0
-            for ll in range(len(par_jobs)):
-                if par_jobs[ll].is_alive():
-                    counter += 1
+        pool_download(arc_download_core, arc_client_init, stas_avail,
+                      event, input_dics, target_path, req_cli, info_event,
+                      input_dics['req_np'])
     else:
+        client_arclink, client_syngine = arc_client_init(input_dics, req_cli)
         st_counter = 0
         for st_avail in stas_avail:
             st_counter += 1
@@ -576,6 +1125,24 @@ def arc_serial_parallel(stas_avail, event, input_dics, target_path,
                               client_arclink, client_syngine,
                               req_cli, info_station)
 
+# ##################### arc_client_init ##################################
+
+
+def arc_client_init(input_dics, req_cli):
+    """
+    create the ArcLink and syngine clients used to retrieve data
+    :param input_dics:
+    :param req_cli:
+    :return:
+    """
+    client_arclink = Client_arclink(user=input_dics['username_arclink'],
+                                    host=input_dics['host_arclink'],
+                                    port=input_dics['port_arclink'],
+                                    password=input_dics['password_arclink'],
+                                    timeout=input_dics['arc_wave_timeout'])
+    client_syngine = syngine_client(input_dics['req_timeout'])
+    return client_arclink, client_syngine
+
 # ##################### arc_download_core ##################################
 
 
@@ -597,65 +1164,55 @@ def arc_download_core(st_avail, event, input_dics, target_path,
     dummy = 'initializing'
 
     t11 = datetime.now()
+    t_prod = t11
     identifier = 0
     st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
                              st_avail[2], st_avail[3])
     try:
         if st_avail[2] == '--' or st_avail[2] == '  ':
                 st_avail[2] = ''
+        state_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                    st_avail[2], st_avail[3])
 
-        if input_dics['cut_time_phase']:
-            t_start, t_end = calculate_time_phase(event, st_avail)
-        else:
-            t_start = event['t1']
-            t_end = event['t2']
-
-        if input_dics['min_azi'] or input_dics['max_azi'] or \
-                input_dics['min_epi'] or input_dics['max_epi']:
-            dist, azi, bazi = gps2DistAzimuth(event['latitude'],
-                                              event['longitude'],
-                                              float(st_avail[4]),
-                                              float(st_avail[5]))
-            epi_dist = dist/111.194/1000.
-            if input_dics['min_epi']:
-                if epi_dist < input_dics['min_epi']:
-                    raise Exception('%s out of epi range: %s'
-                                    % (st_id, epi_dist))
-            if input_dics['max_epi']:
-                if epi_dist > input_dics['max_epi']:
-                    raise Exception('%s out of epi range: %s'
-                                    % (st_id, epi_dist))
-            if input_dics['min_azi']:
-                if azi < input_dics['min_azi']:
-                    raise Exception('%s outo f Azimuth range: %s'
-                                    % (st_id, azi))
-            if input_dics['max_azi']:
-                if azi > input_dics['max_azi']:
-                    raise Exception('%s out of Azimuth range: %s'
-                                    % (st_id, azi))
+        t_start, t_end = time_window(event, st_avail, input_dics)
 
         if input_dics['waveform']:
             dummy = 'waveform'
             if (not os.path.isfile(os.path.join(target_path, 'raw', st_id))) \
                     or input_dics['force_waveform']:
-
-                if hasattr(client_arclink, 'save_waveforms'):
-                    client_arclink.save_waveforms(os.path.join(target_path,
-                                                               'raw', st_id),
-                                                  st_avail[0], st_avail[1],
-                                                  st_avail[2], st_avail[3],
-                                                  t_start, t_end)
-                elif hasattr(client_arclink, 'saveWaveform'):
-                    client_arclink.saveWaveform(os.path.join(target_path,
-                                                             'raw', st_id),
-                                                st_avail[0], st_avail[1],
-                                                st_avail[2], st_avail[3],
-                                                t_start, t_end)
+                t_prod = datetime.now()
+                state_update(input_dics, event, state_id, dummy, 'in-flight')
+
+                def fetch_waveform(path_tmp):
+                    if hasattr(client_arclink, 'save_waveforms'):
+                        client_arclink.save_waveforms(path_tmp,
+                                                      st_avail[0], st_avail[1],
+                                                      st_avail[2], st_avail[3],
+                                                      t_start, t_end)
+                    elif hasattr(client_arclink, 'saveWaveform'):
+                        client_arclink.saveWaveform(path_tmp,
+                                                    st_avail[0], st_avail[1],
+                                                    st_avail[2], st_avail[3],
+                                                    t_start, t_end)
+                num_retry = request_to_file(fetch_waveform,
+                                            os.path.join(target_path, 'raw',
+                                                         st_id),
+                                            input_dics, req_cli, dummy)
                 identifier += 10
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=os.path.join(target_path, 'raw', st_id),
+                             duration=(datetime.now() -
+                                       t_prod).total_seconds())
+                record_metric(input_dics, target_path, req_cli, dummy, st_id,
+                              (datetime.now() - t_prod).total_seconds(),
+                              path=os.path.join(target_path, 'raw', st_id),
+                              retries=num_retry)
                 print('%s -- %s -- saving waveform for: %s  ---> DONE' \
                       % (info_station, req_cli, st_id))
             else:
                 identifier += 1
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=os.path.join(target_path, 'raw', st_id))
 
         if input_dics['response']:
             dummy = 'response'
@@ -665,18 +1222,24 @@ def arc_download_core(st_avail, event, input_dics, target_path,
                 if (not os.path.isfile(os.path.join(target_path, 'resp',
                                                     'DATALESS.' + st_id))) \
                         or input_dics['force_response']:
-                    if hasattr(client_arclink, 'save_response'):
-                        client_arclink.save_response(
-                            os.path.join(target_path, 'resp',
-                                         'DATALESS.%s' % st_id),
-                            st_avail[0], st_avail[1], st_avail[2], st_avail[3],
-                            t_start, t_end)
-                    if hasattr(client_arclink, 'saveResponse'):
-                        client_arclink.saveResponse(
-                            os.path.join(target_path, 'resp',
-                                         'DATALESS.%s' % st_id),
-                            st_avail[0], st_avail[1], st_avail[2], st_avail[3],
-                            t_start, t_end)
+                    t_prod = datetime.now()
+                    state_update(input_dics, event, state_id, dummy,
+                                 'in-flight')
+
+                    def fetch_response(path_tmp):
+                        if hasattr(client_arclink, 'save_response'):
+                            client_arclink.save_response(
+                                path_tmp, st_avail[0], st_avail[1],
+                                st_avail[2], st_avail[3], t_start, t_end)
+                        elif hasattr(client_arclink, 'saveResponse'):
+                            client_arclink.saveResponse(
+                                path_tmp, st_avail[0], st_avail[1],
+                                st_avail[2], st_avail[3], t_start, t_end)
+                    num_retry = request_to_file(
+                        fetch_response,
+                        os.path.join(target_path, 'resp',
+                                     'DATALESS.%s' % st_id),
+                        input_dics, req_cli, dummy)
                     if input_dics['dataless2xml']:
                         try:
                             datalessResp = read_inventory(
@@ -687,12 +1250,23 @@ def arc_download_core(st_avail, event, input_dics, target_path,
                         except Exception as error:
                             pass
                     identifier += 100
+                    state_update(input_dics, event, state_id, dummy, 'done',
+                                 duration=(datetime.now() -
+                                           t_prod).total_seconds())
+                    record_metric(input_dics, target_path, req_cli, dummy,
+                                  st_id,
+                                  (datetime.now() - t_prod).total_seconds(),
+                                  path=os.path.join(target_path, 'resp',
+                                                    'DATALESS.%s' % st_id),
+                                  retries=num_retry)
                     print("%s -- %s -- saving response for: %s  ---> DONE" \
                           % (info_station, req_cli, st_id))
                 else:
                     identifier += 1
+                    state_update(input_dics, event, state_id, dummy, 'done')
             else:
                 identifier += 1
+                state_update(input_dics, event, state_id, dummy, 'done')
 
         if input_dics['syngine']:
             dummy = 'syngine_waveform'
@@ -702,6 +1276,8 @@ def arc_download_core(st_avail, event, input_dics, target_path,
                 os.makedirs(syn_dirpath)
             if (not os.path.isfile(os.path.join(syn_dirpath, st_id)))\
                     or input_dics['force_waveform']:
+                t_prod = datetime.now()
+                state_update(input_dics, event, state_id, dummy, 'in-flight')
 
                 if input_dics['syngine_geocentric_lat']:
                     rcvlatitude = geocen_calc(float(st_avail[4]))
@@ -721,39 +1297,53 @@ def arc_download_core(st_avail, event, input_dics, target_path,
                 # kernelwidth=None
                 # sourceforce=None
                 # label=None
-                syn_st = client_syngine.get_waveforms(
-                    model=input_dics['syngine_bg_model'],
-                    receiverlatitude=rcvlatitude,
-                    receiverlongitude=float(st_avail[5]),
-                    networkcode=st_avail[0],
-                    stationcode=st_avail[1],
-                    sourcelatitude=evlatitude,
-                    sourcelongitude=event['longitude'],
-                    sourcedepthinmeters=float(event['depth'])*1000.,
-                    origintime=event['datetime'],
-                    components=st_avail[3][-1],
-                    units=input_dics['syngine_units'],
-                    sourcemomenttensor=syngine_momenttensor,
-                    starttime=t_start,
-                    endtime=t_end)[0]
-
-                syn_st.stats.location = st_avail[2]
-                syn_st.stats.channel = st_avail[3]
-                syn_st.write(os.path.join(syn_dirpath, st_id),
-                             format='mseed')
+                def fetch_syngine(path_tmp):
+                    syn_st = client_syngine.get_waveforms(
+                        model=input_dics['syngine_bg_model'],
+                        receiverlatitude=rcvlatitude,
+                        receiverlongitude=float(st_avail[5]),
+                        networkcode=st_avail[0],
+                        stationcode=st_avail[1],
+                        sourcelatitude=evlatitude,
+                        sourcelongitude=event['longitude'],
+                        sourcedepthinmeters=float(event['depth'])*1000.,
+                        origintime=event['datetime'],
+                        components=st_avail[3][-1],
+                        units=input_dics['syngine_units'],
+                        sourcemomenttensor=syngine_momenttensor,
+                        starttime=t_start,
+                        endtime=t_end)[0]
+
+                    syn_st.stats.location = st_avail[2]
+                    syn_st.stats.channel = st_avail[3]
+                    syn_st.write(path_tmp, format='mseed')
+                num_retry = request_to_file(fetch_syngine,
+                                            os.path.join(syn_dirpath, st_id),
+                                            input_dics, 'syngine', dummy)
 
                 identifier += 1000
+                state_update(input_dics, event, state_id, dummy, 'done',
+                             path=os.path.join(syn_dirpath, st_id),
+                             duration=(datetime.now() -
+                                       t_prod).total_seconds())
+                record_metric(input_dics, target_path, req_cli, dummy, st_id,
+                              (datetime.now() - t_prod).total_seconds(),
+                              path=os.path.join(syn_dirpath, st_id),
+                              retries=num_retry)
                 print('%s -- %s -- saving syngine for: %s  ---> DONE' \
                       % (info_station, req_cli, st_id))
             else:
                 identifier += 1
+                state_update(input_dics, event, state_id, dummy, 'done')
 
         # if identifier in [0, 2, 10, 11, 100]:
         #     raise Exception("CODE: %s will not be registered! (666)"
         #                     % identifier)
         t22 = datetime.now()
+        req_error = None
     except Exception as error:
         t22 = datetime.now()
+        req_error = error
 
         if len(st_avail) != 0:
             ee = '%s -- %s -- %s -- %s\n' % (req_cli, dummy, st_id, error)
@@ -763,53 +1353,103 @@ def arc_download_core(st_avail, event, input_dics, target_path,
                                            'info', 'exception'), 'at+')
         Exception_file.writelines(ee)
         Exception_file.close()
+        state_failed(input_dics, event, st_avail, dummy, error)
+        if dummy != 'initializing':
+            record_metric(input_dics, target_path, req_cli, dummy, st_id,
+                          (t22 - t_prod).total_seconds(), error=error,
+                          retries=getattr(error, 'req_retries', 0))
+    return {'st_id': st_id, 'duration': (t22 - t11).total_seconds(),
+            'error_class': error_class(req_error)}
+
+# ##################### time_window ##################################
+
+
+def time_window(event, st_avail, input_dics):
+    """
+    start and end time of the request for one channel
+    :param event:
+    :param st_avail:
+    :param input_dics:
+    :return:
+    """
+    if input_dics['cut_time_phase']:
+        t_start, t_end = calculate_time_phase(event, st_avail)
+    else:
+        t_start = event['t1']
+        t_end = event['t2']
+    return t_start, t_end
 
 # ##################### update_sta_ev_file ##################################
 
 
 def update_sta_ev_file(target_path, event):
     """
-    update the station_event file based on already stored waveforms
+    update the station_event file based on already stored waveforms.
+    Only the newly stored channels are appended, the file is rebuilt
+    if a waveform was removed or the availability has changed since
+    the last update.
     :param target_path:
     :param event:
     :return:
     """
-    avail_arr = np.loadtxt(os.path.join(target_path, 'info',
-                                        'availability.txt'),
-                           delimiter=',', dtype=bytes, ndmin=2).astype(np.str)
-    avail_arr = avail_arr.astype(np.object)
+    avail_add = avail_path(target_path)
     sta_ev_add = os.path.join(target_path, 'info', 'station_event')
-    sta_ev_fio = open(sta_ev_add, 'wt+')
-
-    if not np.shape(avail_arr)[0] < 1:
-        sta_ev_names = avail_arr[:, 0] + '.' + avail_arr[:, 1] + '.' + \
-                       avail_arr[:, 2] + '.' + avail_arr[:, 3]
-
-        sta_saved_path = glob.glob(
-            os.path.join(target_path, 'raw', '*.*.*.*'))
-        sta_saved_path.sort()
-        sta_sorted = []
-
-        for sta_sav_abs in sta_saved_path:
-            try:
-                sta_sav = os.path.basename(sta_sav_abs)
-                sta_indx = np.where(sta_ev_names == sta_sav)[0][-1]
-                sta_sorted.append(avail_arr[sta_indx])
-            except:
-                continue
-
-        if len(np.shape(sta_sorted)) == 1:
-            sta_sorted = np.reshape(sta_sorted, [1, len(sta_sorted)])
-        if not np.shape(sta_sorted)[1] < 1:
-            for sts in sta_sorted:
-                sta_ev_line = '%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,\n' \
-                              % (sts[0], sts[1], sts[2], sts[3], sts[4],
-                                 sts[5], sts[6], sts[7], sts[8],
-                                 event['event_id'], event['latitude'],
-                                 event['longitude'], event['depth'],
-                                 event['magnitude'], sts[10], sts[11], '10')
-                sta_ev_fio.writelines(sta_ev_line)
+    raw_add = os.path.join(target_path, 'raw')
+
+    rebuild = not os.path.isfile(sta_ev_add)
+    if not rebuild:
+        sta_ev_mtime = os.path.getmtime(sta_ev_add)
+        if os.path.isfile(avail_add) and \
+                os.path.getmtime(avail_add) >= sta_ev_mtime:
+            rebuild = True
+        elif not os.path.isdir(raw_add) or \
+                os.path.getmtime(raw_add) < sta_ev_mtime:
+            # no waveform was stored or removed since the last update
+            return
+
+    # NET.STA.LOC.CHA, the .part files of unfinished requests are skipped
+    sta_saved = set()
+    if os.path.isdir(raw_add):
+        sta_saved = set([sta_sav for sta_sav in os.listdir(raw_add)
+                         if sta_sav.count('.') == 3])
+
+    sta_ev_names = set()
+    if not rebuild:
+        sta_ev_fio = open(sta_ev_add, 'rt')
+        for sta_ev_line in sta_ev_fio:
+            sta_ev_names.add('.'.join(sta_ev_line.split(',')[:4]))
+        sta_ev_fio.close()
+        if not sta_ev_names.issubset(sta_saved):
+            rebuild = True
+            sta_ev_names = set()
+
+    sta_new = sorted(sta_saved - sta_ev_names)
+    if not rebuild and len(sta_new) == 0:
+        # touch the file to skip the comparison in the next update
+        os.utime(sta_ev_add, None)
+        return
+
+    # index of the availability, the last record of a channel is used
+    avail_index = {}
+    for sts in avail_rows(*avail_load(target_path)):
+        avail_index['%s.%s.%s.%s' % (sts[0], sts[1], sts[2], sts[3])] = sts
+
+    sta_ev_fio = open(sta_ev_add, 'wt+' if rebuild else 'at')
+    for sta_sav in sta_new:
+        sts = avail_index.get(sta_sav)
+        if sts is None:
+            continue
+        sta_ev_line = '%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,\n' \
+                      % (sts[0], sts[1], sts[2], sts[3], sts[4],
+                         sts[5], sts[6], sts[7], sts[8],
+                         event['event_id'], event['latitude'],
+                         event['longitude'], event['depth'],
+                         event['magnitude'], sts[10], sts[11], '10')
+        sta_ev_fio.writelines(sta_ev_line)
     sta_ev_fio.close()
+    # the channels without availability are not appended, touch the file
+    # so that the next update is skipped if nothing else changes
+    os.utime(sta_ev_add, None)
 
 # -------------------------------- TRASH
 
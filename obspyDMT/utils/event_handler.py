@@ -28,10 +28,6 @@ try:
     from obspy.geodetics import locations2degrees
 except Exception as e:
     from obspy.core.util import locations2degrees
-try:
-    from obspy.clients.fdsn import Client as Client_fdsn
-except Exception as e:
-    from obspy.fdsn import Client as Client_fdsn
 import os
 import pickle
 import sys
@@ -44,6 +40,7 @@ try:
     from urllib import urlencode as urlencodeparse
 except ImportError:
     from urllib.parse import urlencode as urlencodeparse
+from .client_handler import event_client
 from .input_handler import input_logger
 from .utility_codes import locate
 
@@ -226,7 +223,7 @@ def event_info(input_dics):
         print('\nEvent(s) are based on:\t%s' % input_dics['event_catalog'])
 
         if event_switch == 'fdsn':
-            client_fdsn = Client_fdsn(base_url=event_url)
+            client_fdsn = event_client(input_dics, event_url)
             events_QML = client_fdsn.get_events(
                 minlatitude=evlatmin,
                 maxlatitude=evlatmax,
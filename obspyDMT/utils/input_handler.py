@@ -157,6 +157,14 @@ def command_parse():
     group_general.add_option("--list_stas", action="store",
                              dest="list_stas", help=helpmsg)
 
+    helpmsg = "Check the availability and report the expected number of " \
+              "requests, volume per data center and per event and the " \
+              "runtime with the current speed up options, then stop " \
+              "without downloading. The rates of the data centers are " \
+              "measured in the runs with --metrics."
+    group_general.add_option("--plan", action="store_true",
+                             dest="plan", help=helpmsg)
+
     # XXX NOT in Table-2
     helpmsg = "test the program for the desired number of requests, " \
               "e.g.: '--test 10' will test the program for 10 " \
@@ -294,12 +302,143 @@ def command_parse():
     group_parallel.add_option("--req_np", action="store",
                               dest="req_np", help=helpmsg)
 
+    helpmsg = "Retrieve the channels of all events with one scheduler: " \
+              "at most <req_np_total> requests are in flight in total " \
+              "and --req_np requests per data center, the data centers " \
+              "are served in turn. The events are processed while the " \
+              "next ones are retrieved. Can not be combined with --bulk, " \
+              "--req_coalesce, --req_engine 'session', --syngine_bulk " \
+              "or --pipeline (default: False). Example: 32"
+    group_parallel.add_option("--req_np_total", action="store",
+                              dest="req_np_total", help=helpmsg)
+
     helpmsg = "Send a bulk request to a FDSN data center. " \
               "Returns multiple seismogram channels in a single request. " \
               "Can be combined with --req_parallel."
     group_parallel.add_option("--bulk", action="store_true",
                               dest="bulk", help=helpmsg)
 
+    helpmsg = "Maximum number of channels in one bulk request (--bulk). " \
+              "The chunks are sent in parallel (--req_parallel, --req_np) " \
+              "and their miniSEED records are written directly to the " \
+              "raw directory (default: 500). Example: 200"
+    group_parallel.add_option("--bulk_chunk", action="store",
+                              dest="bulk_chunk", help=helpmsg)
+
+    helpmsg = "Adapt the number of parallel requests (--req_parallel) " \
+              "to each data center between a minimum and a maximum, " \
+              "syntax: <min>/<max>. The number of requests grows while " \
+              "the data center answers without errors and shrinks when " \
+              "it throttles (HTTP 429/503, timeouts) or its latency " \
+              "increases. --req_np is the starting value " \
+              "(default: False). Example: '2/20'"
+    group_parallel.add_option("--req_adaptive", action="store",
+                              dest="req_adaptive", help=helpmsg)
+
+    helpmsg = "Number of retries of a failed waveform/response request. " \
+              "Only transient errors are retried (throttling, timeouts, " \
+              "server errors, broken connections), after an exponential " \
+              "backoff with random jitter (default: 0). Example: 2"
+    group_parallel.add_option("--req_retry", action="store",
+                              dest="req_retry", help=helpmsg)
+
+    helpmsg = "Timeout of each waveform/response request in seconds " \
+              "(default: 120). Example: 60"
+    group_parallel.add_option("--req_timeout", action="store",
+                              dest="req_timeout", help=helpmsg)
+
+    helpmsg = "Hedge slow waveform/response requests: a duplicate of a " \
+              "request is sent if it is still running after the " \
+              "<req_hedge> percentile of the latencies of its data " \
+              "center (collected by all the workers), the first " \
+              "response is kept. Bulk requests are not hedged " \
+              "(default: False). Example: 95"
+    group_parallel.add_option("--req_hedge", action="store",
+                              dest="req_hedge", help=helpmsg)
+
+    helpmsg = "Time to live (in hours) of the cached service discovery " \
+              "of the FDSN data centers in ~/.obspyDMT/fdsn_services. " \
+              "One client per data center is shared by all events " \
+              "and stages, 0 disables the cache (default: 24). Example: 0"
+    group_parallel.add_option("--services_ttl", action="store",
+                              dest="services_ttl", help=helpmsg)
+
+    helpmsg = "Retrieve the channel inventory of each FDSN data source " \
+              "once for the time span of all events and check the " \
+              "availability of each event locally (channel epochs, " \
+              "--net/--sta/--loc/--cha, --station_rect and " \
+              "--station_circle). The inventories are stored in " \
+              "<datapath>/INVENTORY-CACHE and reused by later runs."
+    group_parallel.add_option("--inventory_cache", action="store_true",
+                              dest="inventory_cache", help=helpmsg)
+
+    helpmsg = "Time to live (in hours) of the inventories in " \
+              "<datapath>/INVENTORY-CACHE, older inventories are " \
+              "retrieved again, 0: retrieved once per run " \
+              "(default: 24). Example: 168"
+    group_parallel.add_option("--inventory_ttl", action="store",
+                              dest="inventory_ttl", help=helpmsg)
+
+    helpmsg = "Check the availability of the FDSN data sources in the " \
+              "FDSN text format (format=text) instead of StationXML, " \
+              "which is faster for large requests. The data sources " \
+              "which do not support the text format are queried in " \
+              "StationXML."
+    group_parallel.add_option("--avail_text", action="store_true",
+                              dest="avail_text", help=helpmsg)
+
+    helpmsg = "Engine for sending FDSN waveform/response requests: " \
+              "'obspy' (one obspy client request per channel) or " \
+              "'session' (requests are sent over a pool of persistent " \
+              "keep-alive HTTP connections per data center, " \
+              "the size of the pool is set by --session_np) " \
+              "(default: 'obspy'). Example: 'session'"
+    group_parallel.add_option("--req_engine", action="store",
+                              dest="req_engine", help=helpmsg)
+
+    helpmsg = "Number of requests in flight (and of keep-alive " \
+              "connections) per data center with --req_engine 'session'. " \
+              "The requests of one data center are sent by one process, " \
+              "independently of --req_parallel and --req_np " \
+              "(default: 50). Example: 100"
+    group_parallel.add_option("--session_np", action="store",
+                              dest="session_np", help=helpmsg)
+
+    helpmsg = "Coalesce the waveform requests of one station: " \
+              "all channels of a station with the same time window are " \
+              "retrieved by one request and split locally into " \
+              "one file per channel."
+    group_parallel.add_option("--req_coalesce", action="store_true",
+                              dest="req_coalesce", help=helpmsg)
+
+    helpmsg = "Share the retrieved StationXML files between events: " \
+              "responses are stored in a cache (see --response_cache_dir) " \
+              "keyed by channel and response epoch, and linked into " \
+              "each event directory instead of being retrieved again."
+    group_parallel.add_option("--response_cache", action="store_true",
+                              dest="response_cache", help=helpmsg)
+
+    helpmsg = "Directory of the response cache " \
+              "(default: <datapath>/RESPONSE-CACHE). " \
+              "Example: /path/to/response_cache"
+    group_parallel.add_option("--response_cache_dir", action="store",
+                              dest="response_cache_dir", help=helpmsg)
+
+    helpmsg = "Record the state (pending, in-flight, done, failed) of " \
+              "each requested waveform/response in a database " \
+              "(<datapath>/download_state.sqlite). On restart, only the " \
+              "pending and failed items are requested again, " \
+              "see --state_retry."
+    group_parallel.add_option("--state_db", action="store_true",
+                              dest="state_db", help=helpmsg)
+
+    helpmsg = "Error classes of the failed items (--state_db) which " \
+              "are requested again: 'all' or a comma-separated list of " \
+              "no_data, throttled, timeout, other (default: 'all'). " \
+              "Example: 'throttled,timeout'"
+    group_parallel.add_option("--state_retry", action="store",
+                              dest="state_retry", help=helpmsg)
+
     helpmsg = "Enable parallel local processing of the waveforms, " \
               "useful on multicore hardware."
     group_parallel.add_option("--parallel_process", action="store_true",
@@ -309,6 +448,27 @@ def command_parse():
               "(default: 4)."
     group_parallel.add_option("--process_np", action="store",
                               dest="process_np", help=helpmsg)
+
+    helpmsg = "Pipeline the events: the availability of the next event " \
+              "is checked while the waveforms of the current event are " \
+              "retrieved, and each event is processed as soon as its " \
+              "waveforms are retrieved (see --pipeline_queue)."
+    group_parallel.add_option("--pipeline", action="store_true",
+                              dest="pipeline", help=helpmsg)
+
+    helpmsg = "Maximum number of events waiting between two stages " \
+              "of --pipeline (default: 2). Example: 4"
+    group_parallel.add_option("--pipeline_queue", action="store",
+                              dest="pipeline_queue", help=helpmsg)
+
+    helpmsg = "Record the latency, size and status of each request in " \
+              "<event>/info/metrics.jsonl. A report per data center and " \
+              "product (p50/p90/p99 latency, MB/s over the wall time, " \
+              "errors) is written to <datapath>/metrics_report.json and " \
+              "metrics.prom " \
+              "(Prometheus text format) at the end of the run."
+    group_parallel.add_option("--metrics", action="store_true",
+                              dest="metrics", help=helpmsg)
     parser.add_option_group(group_parallel)
 
     # --------------- restricted data ---------------------------------
@@ -441,6 +601,15 @@ def command_parse():
               "Example: '3600'"
     group_cont.add_option("--interval", action="store",
                           dest="interval", help=helpmsg)
+
+    helpmsg = "Retrieve each channel once per block of the specified " \
+              "length (in sec) into a local segment store " \
+              "(<datapath>/SEGMENT-STORE) and cut the waveforms of the " \
+              "intervals (including --preset/--offset) from the store. " \
+              "Only for FDSN data sources (default: False). " \
+              "Example: '86400'"
+    group_cont.add_option("--continuous_block", action="store",
+                          dest="continuous_block", help=helpmsg)
     parser.add_option_group(group_cont)
 
     # --------------- local processing ----------------------------------------
@@ -510,6 +679,13 @@ def command_parse():
     group_synthetic.add_option("--syngine_geocentric_lat", action="store",
                                dest="syngine_geocentric_lat", help=helpmsg)
 
+    helpmsg = "Retrieve the synthetic waveforms of an event with " \
+              "syngine bulk requests (all receivers and components with " \
+              "the same time window in one request, see --bulk_chunk) " \
+              "instead of one request per channel."
+    group_synthetic.add_option("--syngine_bulk", action="store_true",
+                               dest="syngine_bulk", help=helpmsg)
+
     # XXX NOT in Table-2
     helpmsg = "retrieve synthetic waveforms calculated by normal mode " \
               "summation code. (ShakeMovie project)"
@@ -700,6 +876,13 @@ def command_parse():
     group_others.add_option("--arc_avai_timeout", action="store",
                             dest="arc_avai_timeout", help=helpmsg)
 
+    helpmsg = "Timeout (in sec) for the availability query of each data " \
+              "source. The data sources are queried concurrently, the " \
+              "sources which did not answer in time are skipped for the " \
+              "event, 0: no timeout (default: 0). Example: 300"
+    group_others.add_option("--avail_timeout", action="store",
+                            dest="avail_timeout", help=helpmsg)
+
     helpmsg = "Timeout (in sec) for sending a waveform data or " \
               "metadata request via ArcLink (default: 2)."
     group_others.add_option("--arc_wave_timeout", action="store",
@@ -751,7 +934,20 @@ def read_input_command(parser, **kwargs):
                   'mlon_rbb': None, 'Mlon_rbb': None,
 
                   'req_np': 4,
+                  'req_np_total': False,
+                  'req_engine': 'obspy',
+                  'session_np': 50,
+                  'req_adaptive': False,
+                  'req_retry': 0,
+                  'req_timeout': 120,
+                  'req_hedge': False,
+                  'services_ttl': 24,
+                  'inventory_ttl': 24,
+                  'response_cache_dir': None,
+                  'state_retry': 'all',
+                  'bulk_chunk': 500,
                   'process_np': 4,
+                  'pipeline_queue': 2,
 
                   'username_fdsn': None,
                   'password_fdsn': None,
@@ -774,6 +970,7 @@ def read_input_command(parser, **kwargs):
                   'syngine_geocentric_lat': True,
 
                   'interval': 3600*24,
+                  'continuous_block': False,
 
                   'pre_process': 'process_unit',
                   'select_data': False,
@@ -797,6 +994,7 @@ def read_input_command(parser, **kwargs):
 
                   'email': False,
                   'arc_avai_timeout': 40,
+                  'avail_timeout': 0,
                   'arc_wave_timeout': 2,
                   }
 
@@ -1048,6 +1246,7 @@ def read_input_command(parser, **kwargs):
             [x.strip() for x in input_dics['dir_select'].split(',')]
 
     input_dics['list_stas'] = options.list_stas
+    input_dics['plan'] = options.plan
 
     if options.min_epi:
         input_dics['min_epi'] = float(options.min_epi)
@@ -1159,9 +1358,71 @@ def read_input_command(parser, **kwargs):
 
     input_dics['req_parallel'] = options.req_parallel
     input_dics['req_np'] = int(options.req_np)
+    if options.req_np_total and \
+            str(options.req_np_total).lower() not in ['false', '0']:
+        input_dics['req_np_total'] = int(options.req_np_total)
+    else:
+        input_dics['req_np_total'] = False
+    if options.req_adaptive and \
+            str(options.req_adaptive).lower() not in ['false']:
+        try:
+            input_dics['req_adaptive'] = \
+                [int(x) for x in options.req_adaptive.split('/')]
+            if len(input_dics['req_adaptive']) != 2:
+                print("Erroneous --req_adaptive given.")
+                sys.exit(2)
+        except Exception as e:
+            print("Erroneous --req_adaptive given: %s" % e)
+            sys.exit(2)
+    else:
+        input_dics['req_adaptive'] = False
+    input_dics['req_retry'] = max(0, int(options.req_retry))
+    input_dics['req_timeout'] = float(options.req_timeout)
+    if options.req_hedge and \
+            str(options.req_hedge).lower() not in ['false', '0']:
+        input_dics['req_hedge'] = float(options.req_hedge)
+        if not 0 < input_dics['req_hedge'] <= 100:
+            print("Erroneous --req_hedge given: %s\n"
+                  "The percentile should be between 0 and 100."
+                  % input_dics['req_hedge'])
+            sys.exit(2)
+    else:
+        input_dics['req_hedge'] = False
+    input_dics['services_ttl'] = max(0., float(options.services_ttl))
+    input_dics['inventory_cache'] = options.inventory_cache
+    input_dics['inventory_ttl'] = max(0., float(options.inventory_ttl))
+    input_dics['avail_text'] = options.avail_text
+    input_dics['req_engine'] = options.req_engine.lower()
+    if not input_dics['req_engine'] in ['obspy', 'session']:
+        print("Erroneous --req_engine given: %s\n"
+              "Available options: 'obspy' or 'session'"
+              % input_dics['req_engine'])
+        sys.exit(2)
+    input_dics['session_np'] = max(1, int(options.session_np))
+    input_dics['req_coalesce'] = options.req_coalesce
+    input_dics['response_cache'] = options.response_cache
+    input_dics['response_cache_dir'] = options.response_cache_dir
+    if input_dics['response_cache_dir'] and \
+            not os.path.isabs(input_dics['response_cache_dir']):
+        input_dics['response_cache_dir'] = \
+            os.path.join(os.getcwd(), input_dics['response_cache_dir'])
+    input_dics['state_db'] = options.state_db
+    if options.state_retry.lower() == 'all':
+        input_dics['state_retry'] = 'all'
+    else:
+        input_dics['state_retry'] = \
+            [x.strip().lower() for x in options.state_retry.split(',')]
+        for err_class in input_dics['state_retry']:
+            if err_class not in ['no_data', 'throttled', 'timeout', 'other']:
+                print("Erroneous --state_retry given: %s" % err_class)
+                sys.exit(2)
     input_dics['bulk'] = options.bulk
+    input_dics['bulk_chunk'] = int(options.bulk_chunk)
     input_dics['parallel_process'] = options.parallel_process
     input_dics['process_np'] = int(options.process_np)
+    input_dics['pipeline'] = options.pipeline
+    input_dics['pipeline_queue'] = max(1, int(options.pipeline_queue))
+    input_dics['metrics'] = options.metrics
 
     input_dics['username_fdsn'] = options.username_fdsn
     input_dics['password_fdsn'] = options.password_fdsn
@@ -1234,11 +1495,30 @@ def read_input_command(parser, **kwargs):
         input_dics['syngine_geocentric_lat'] = False
     else:
         input_dics['syngine_geocentric_lat'] = True
+    input_dics['syngine_bulk'] = options.syngine_bulk
+    # the download scheduler sends one request per channel
+    if input_dics['req_np_total']:
+        for option_name, option_set in [
+                ('--bulk', input_dics['bulk']),
+                ('--req_coalesce', input_dics['req_coalesce']),
+                ("--req_engine 'session'",
+                 input_dics['req_engine'] == 'session'),
+                ('--syngine_bulk', input_dics['syngine_bulk']),
+                ('--pipeline', input_dics['pipeline'])]:
+            if option_set:
+                print("Erroneous combination: --req_np_total can not be "
+                      "combined with %s" % option_name)
+                sys.exit(2)
 
     input_dics['specfem3D'] = options.specfem3D
     input_dics['normal_mode_syn'] = options.normal_mode_syn
 
     input_dics['interval'] = float(options.interval)
+    if options.continuous_block and \
+            str(options.continuous_block).lower() not in ['false', '0']:
+        input_dics['continuous_block'] = float(options.continuous_block)
+    else:
+        input_dics['continuous_block'] = False
 
     input_dics['instrument_correction'] = options.instrument_correction
     input_dics['corr_unit'] = options.corr_unit
@@ -1322,6 +1602,7 @@ def read_input_command(parser, **kwargs):
             print("********************************************************\n")
             input_dics['email'] = False
     input_dics['arc_avai_timeout'] = float(options.arc_avai_timeout)
+    input_dics['avail_timeout'] = float(options.avail_timeout)
     input_dics['arc_wave_timeout'] = float(options.arc_wave_timeout)
 
     return input_dics
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  inventory_handler.py
+#   Purpose:   channel inventory of the whole campaign shared by all
+#              events (--inventory_cache)
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+from datetime import datetime
+import fnmatch
+import hashlib
+import numpy as np
+from obspy import UTCDateTime
+import os
+import threading
+import time
+
+from .client_handler import fdsn_client
+from .metrics_handler import record_metric
+from .traveltime_handler import epi_distances
+
+# Layout of the inventory cache (one file per data source and request):
+# <datapath>/INVENTORY-CACHE/<data_source>_<sha1[:12]>.npz, the hash
+# covers all the request parameters, the file expires after --inventory_ttl
+#   codes   (N, 4) str     network, station, location, channel
+#   coords  (N, 4) float64 latitude, longitude, elevation, depth
+#   orient  (N, 2) float64 azimuth, dip (NaN if not known)
+#   epochs  (N, 2) float64 start, end of the channel (end: inf if open)
+#   span    (2,)   float64 time span of the request
+
+# inventories loaded in this process, key: path of the cache file
+inventories = {}
+inventories_locks = {}
+inventories_lock = threading.Lock()
+
+# ##################### inventory_span ##################################
+
+
+def inventory_span(events):
+    """
+    time span of all the events (timestamps)
+    :param events:
+    :return:
+    """
+    return (min([UTCDateTime(ev['t1']).timestamp for ev in events]),
+            max([UTCDateTime(ev['t2']).timestamp for ev in events]))
+
+# ##################### inventory_path ##################################
+
+
+def inventory_path(input_dics, data_source):
+    """
+    cache file of the inventory of data_source, the name depends on the
+    request (channels, area and restricted data)
+    :param input_dics:
+    :param data_source:
+    :return:
+    """
+    request = '#'.join(['%s' % input_dics[key] for key in
+                        ['net', 'sta', 'loc', 'cha',
+                         'mlat_rbb', 'Mlat_rbb', 'mlon_rbb', 'Mlon_rbb',
+                         'lat_cba', 'lon_cba', 'mr_cba', 'Mr_cba',
+                         'username_fdsn']])
+    req_hash = hashlib.sha1(request.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(input_dics['datapath'], 'INVENTORY-CACHE',
+                        '%s_%s.npz' % (data_source.replace('/', '_'),
+                                       req_hash))
+
+# ##################### inventory_fetch #################################
+
+
+def inventory_fetch(input_dics, data_source, span, target_path):
+    """
+    retrieve the channel inventory of data_source for the time span and
+    convert it to arrays
+    :param input_dics:
+    :param data_source:
+    :param span:
+    :param target_path: event directory (metrics)
+    :return:
+    """
+    print('[INFO] %s -- retrieving the inventory of %s - %s'
+          % (data_source, UTCDateTime(span[0]), UTCDateTime(span[1])))
+    if input_dics['username_fdsn']:
+        include_restricted = True
+    else:
+        include_restricted = None
+
+    t_req = datetime.now()
+    client_fdsn = fdsn_client(input_dics, data_source)
+    available = client_fdsn.get_stations(
+        network=input_dics['net'],
+        station=input_dics['sta'],
+        location=input_dics['loc'],
+        channel=input_dics['cha'],
+        starttime=UTCDateTime(span[0]),
+        endtime=UTCDateTime(span[1]),
+        latitude=input_dics['lat_cba'],
+        longitude=input_dics['lon_cba'],
+        minradius=input_dics['mr_cba'],
+        maxradius=input_dics['Mr_cba'],
+        minlatitude=input_dics['mlat_rbb'],
+        maxlatitude=input_dics['Mlat_rbb'],
+        minlongitude=input_dics['mlon_rbb'],
+        maxlongitude=input_dics['Mlon_rbb'],
+        includerestricted=include_restricted,
+        level='channel')
+    record_metric(input_dics, target_path, data_source, 'inventory',
+                  '%s.%s.%s.%s' % (input_dics['net'], input_dics['sta'],
+                                   input_dics['loc'], input_dics['cha']),
+                  (datetime.now() - t_req).total_seconds())
+
+    codes = []
+    coords = []
+    orient = []
+    epochs = []
+    for network in available.networks:
+        for station in network:
+            for channel in station:
+                codes.append([network.code, station.code,
+                              channel.location_code, channel.code])
+                coords.append([channel.latitude, channel.longitude,
+                               channel.elevation, channel.depth])
+                orient.append([channel.azimuth, channel.dip])
+                epochs.append([
+                    channel.start_date.timestamp
+                    if channel.start_date else -np.inf,
+                    channel.end_date.timestamp
+                    if channel.end_date else np.inf])
+    return {'codes': np.array(codes, dtype=np.unicode_).reshape(-1, 4),
+            'coords': np.array(coords, dtype=float).reshape(-1, 4),
+            'orient': np.array(orient, dtype=float).reshape(-1, 2),
+            'epochs': np.array(epochs, dtype=float).reshape(-1, 2),
+            'span': np.array(span, dtype=float)}
+
+# ##################### inventory_load ##################################
+
+
+def inventory_load(input_dics, data_source, span, target_path):
+    """
+    inventory of data_source covering span: from memory, from the cache
+    file if younger than --inventory_ttl or retrieved from the data source
+    (once per process)
+    :param input_dics:
+    :param data_source:
+    :param span:
+    :param target_path:
+    :return:
+    """
+    inv_path = inventory_path(input_dics, data_source)
+    with inventories_lock:
+        inv_lock = inventories_locks.setdefault(inv_path, threading.Lock())
+    with inv_lock:
+        inv = inventories.get(inv_path)
+        if inv is None and os.path.isfile(inv_path) and \
+                time.time() - os.path.getmtime(inv_path) <= \
+                input_dics['inventory_ttl']*3600.:
+            inv_fio = np.load(inv_path)
+            inv = dict([(key, inv_fio[key]) for key in inv_fio.files])
+            inv_fio.close()
+        if inv is None or \
+                not inv['span'][0] <= span[0] <= span[1] <= inv['span'][1]:
+            if inv is not None:
+                span = (min(span[0], inv['span'][0]),
+                        max(span[1], inv['span'][1]))
+            inv = inventory_fetch(input_dics, data_source, span,
+                                  target_path)
+            if not os.path.isdir(os.path.dirname(inv_path)):
+                os.makedirs(os.path.dirname(inv_path))
+            tmp_path = '%s.%s.tmp.npz' % (inv_path[:-4], os.getpid())
+            np.savez(tmp_path, **inv)
+            os.rename(tmp_path, inv_path)
+        inventories[inv_path] = inv
+    return inv
+
+# ##################### code_mask #######################################
+
+
+def code_mask(codes, patterns):
+    """
+    mask of the codes matching one of the comma-separated patterns
+    (FDSN wildcards, '--' is an empty location code)
+    :param codes:
+    :param patterns:
+    :return:
+    """
+    patterns = [x.strip() for x in patterns.split(',')]
+    patterns = ['' if x == '--' else x for x in patterns]
+    codes_unique, codes_inv = np.unique(codes, return_inverse=True)
+    unique_ok = np.array([any([fnmatch.fnmatchcase(code, pattern)
+                               for pattern in patterns])
+                          for code in codes_unique], dtype=bool)
+    return unique_ok[codes_inv]
+
+# ##################### inventory_filter ################################
+
+
+def inventory_filter(inv, input_dics, event):
+    """
+    mask of the channels available for the event: channel epochs,
+    --net/--sta/--loc/--cha, --station_rect and --station_circle
+    :param inv:
+    :param input_dics:
+    :param event:
+    :return:
+    """
+    inv_ok = (inv['epochs'][:, 0] <= UTCDateTime(event['t2']).timestamp) & \
+             (inv['epochs'][:, 1] >= UTCDateTime(event['t1']).timestamp)
+    for col, key in enumerate(['net', 'sta', 'loc', 'cha']):
+        inv_ok &= code_mask(inv['codes'][:, col], input_dics[key])
+
+    lats = inv['coords'][:, 0]
+    lons = inv['coords'][:, 1]
+    if input_dics['mlat_rbb'] is not None:
+        inv_ok &= lats >= float(input_dics['mlat_rbb'])
+    if input_dics['Mlat_rbb'] is not None:
+        inv_ok &= lats <= float(input_dics['Mlat_rbb'])
+    if input_dics['mlon_rbb'] is not None:
+        inv_ok &= lons >= float(input_dics['mlon_rbb'])
+    if input_dics['Mlon_rbb'] is not None:
+        inv_ok &= lons <= float(input_dics['Mlon_rbb'])
+    if input_dics['lat_cba'] is not None and \
+            input_dics['lon_cba'] is not None:
+        dist = epi_distances(float(input_dics['lat_cba']),
+                             float(input_dics['lon_cba']), lats, lons)
+        if input_dics['mr_cba'] is not None:
+            inv_ok &= dist >= float(input_dics['mr_cba'])
+        if input_dics['Mr_cba'] is not None:
+            inv_ok &= dist <= float(input_dics['Mr_cba'])
+    return inv_ok
+
+# ##################### inventory_available #############################
+
+
+def inventory_available(input_dics, data_source, event, target_path):
+    """
+    availability of one event from the cached inventory of data_source
+    :param input_dics:
+    :param data_source:
+    :param event:
+    :param target_path:
+    :return: list of channels (same columns as fdsn_available)
+    """
+    span = input_dics.get('inventory_span') or \
+        (UTCDateTime(event['t1']).timestamp,
+         UTCDateTime(event['t2']).timestamp)
+    span = (min(span[0], UTCDateTime(event['t1']).timestamp),
+            max(span[1], UTCDateTime(event['t2']).timestamp))
+    inv = inventory_load(input_dics, data_source, span, target_path)
+
+    sta_fdsn = []
+    # the same channel can have several epochs in the time span
+    st_ids = set()
+    for indx in np.where(inventory_filter(inv, input_dics, event))[0]:
+        net, sta, loc, cha = [str(code) for code in inv['codes'][indx]]
+        st_id = '%s_%s_%s_%s' % (net, sta, loc, cha)
+        if st_id in st_ids:
+            continue
+        st_ids.add(st_id)
+        lat, lon, ele, depth = [float(val) for val in inv['coords'][indx]]
+        azimuth, dip = [None if np.isnan(val) else float(val)
+                        for val in inv['orient'][indx]]
+        sta_fdsn.append([net, sta, loc, cha, lat, lon, ele, depth,
+                         data_source, st_id, azimuth, dip])
+    return sta_fdsn
@@ -23,23 +23,14 @@ try:
 except:
     from obspy.imaging.beachball import beachball as Beach
 from obspy import UTCDateTime, read
-try:
-    from obspy.geodetics import locations2degrees
-except:
-    from obspy.core.util import locations2degrees
-try:
-    from obspy.geodetics.base import gps2dist_azimuth as gps2DistAzimuth
-except:
-    try:
-        from obspy.geodetics import gps2DistAzimuth
-    except:
-        from obspy.core.util import gps2DistAzimuth
 import os
 import sys
 
+from .availability_handler import avail_load, avail_unique, avail_rows
 from .data_handler import update_sta_ev_file
 from .kml_handler import create_ev_sta_kml
 from .utility_codes import locate, check_par_jobs, plot_filter_station
+from .utility_codes import geodesic_columns
 
 # ###################### process_data #########################################
 
@@ -328,6 +319,9 @@ def plot_waveform(input_dics, events):
         for di in del_index:
             sta_ev_arr[di] = np.delete(sta_ev_arr, (di), axis=0)
 
+        geo_dist, geo_azi, geo_bazi = geodesic_columns(target_path,
+                                                       sta_ev_arr,
+                                                       events[ei])
         for si in range(len(sta_ev_arr)):
             sta_id = sta_ev_arr[si, 0] + '.' + sta_ev_arr[si, 1] + '.' + \
                      sta_ev_arr[si, 2] + '.' + sta_ev_arr[si, 3]
@@ -338,11 +332,8 @@ def plot_waveform(input_dics, events):
                 time_diff = tr.stats.starttime - events[ei]['datetime']
                 taxis = tr.times() + time_diff
 
-                dist, azi, bazi = gps2DistAzimuth(events[ei]['latitude'],
-                                                  events[ei]['longitude'],
-                                                  float(sta_ev_arr[si, 4]),
-                                                  float(sta_ev_arr[si, 5]))
-                epi_dist = dist/111.194/1000.
+                epi_dist = geo_dist[si]
+                azi = geo_azi[si]
                 if input_dics['min_azi'] or input_dics['max_azi'] or \
                         input_dics['min_epi'] or input_dics['max_epi']:
                     if input_dics['min_epi']:
@@ -495,27 +486,23 @@ def plot_sta_ev_ray(input_dics, events):
                 sta_ev_arr = np.loadtxt(os.path.join(target_path,
                                                      'info', 'station_event'),
                                         delimiter=',', dtype=bytes, ndmin=2).astype(np.str)
+                sta_ev_arr = sta_ev_arr.astype(np.object)
             else:
-                sta_ev_arr = np.loadtxt(os.path.join(target_path,
-                                                     'info',
-                                                     'availability.txt'),
-                                        delimiter=',', dtype=bytes, ndmin=2).astype(np.str)
-            sta_ev_arr = sta_ev_arr.astype(np.object)
+                avail_arr, avail_srcs = avail_load(target_path)
+                sta_ev_arr = avail_rows(avail_unique(avail_arr), avail_srcs)
 
             if events[ei]['magnitude'] > 0:
                 del_index = []
+                geo_dist, geo_azi, geo_bazi = geodesic_columns(target_path,
+                                                               sta_ev_arr,
+                                                               events[ei])
                 for sti in range(len(sta_ev_arr)):
 
                     if not plot_filter_station(input_dics, sta_ev_arr[sti]):
                         del_index.append(sti)
 
-                    dist, azi, bazi = gps2DistAzimuth(
-                        events[ei]['latitude'],
-                        events[ei]['longitude'],
-                        float(sta_ev_arr[sti, 4]),
-                        float(sta_ev_arr[sti, 5]))
-
-                    epi_dist = dist/111.194/1000.
+                    epi_dist = geo_dist[sti]
+                    azi = geo_azi[sti]
                     if input_dics['min_azi'] or input_dics['max_azi'] or \
                             input_dics['min_epi'] or input_dics['max_epi']:
                         if input_dics['min_epi']:
@@ -15,36 +15,39 @@
 from __future__ import print_function
 import copy
 from datetime import datetime
-from glob import glob
+from io import BytesIO
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from obspy import UTCDateTime
 try:
     from obspy.clients.arclink import Client as Client_arclink
 except:
     from obspy.arclink import Client as Client_arclink
-try:
-    from obspy.clients.fdsn import Client as Client_fdsn
-except:
-    from obspy.fdsn import Client as Client_fdsn
-try:
-    from obspy.clients.fdsn import RoutingClient
-except:
-    print("[WARNING] RoutingClient could not be imported.")
-try:
-    from obspy.geodetics import locations2degrees
-except:
-    from obspy.core.util import locations2degrees
 import os
 import pickle
+import threading
+import time
 
 from .utility_codes import create_folders_files
 from .utility_codes import print_data_sources
-from .utility_codes import read_list_stas, calculate_time_phase
+from .utility_codes import read_list_stas, calculate_time_phase_arr
+from .utility_codes import epi_azi_mask, write_geodesic
+from .availability_handler import avail_append, avail_unique, avail_rows
+from .client_handler import fdsn_client
+from .inventory_handler import inventory_available
+from .metrics_handler import record_metric
+from .request_handler import error_class, http_status
+from .traveltime_handler import epi_distances
 from .utility_codes import read_station_event
 
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 
+# data sources which do not support the FDSN text format (--avail_text)
+text_unsupported = set()
+
 # ###################### get_metadata ####################################
 
 
@@ -71,26 +74,50 @@ def get_metadata(input_dics, event, info_avail):
 
     stas_all = []
     if not input_dics['list_stas']:
-        stas_cli = []
-        for cl in range(len(input_dics['data_source'])):
-            if input_dics['data_source'][cl].lower() not in ['arclink']:
-                stas_cli = fdsn_available(input_dics, cl,
-                                          event, target_path)
-            elif input_dics['data_source'][cl].lower() == 'arclink':
-                stas_cli = arc_available(input_dics, event,
-                                         target_path)
-            else:
-                print('\nERROR: %s is not implemented!' \
-                      % input_dics['data_source'][cl])
-                print_data_sources()
-            # put all the available stations together
-            for st_fdarc in stas_cli:
-                if len(st_fdarc) == 0:
-                    continue
-                elif len(st_fdarc) == 1:
-                    stas_all.append([st_fdarc])
+        num_src = len(input_dics['data_source'])
+        if input_dics['avail_timeout'] > 0:
+            t_deadline = time.time() + input_dics['avail_timeout']
+        else:
+            t_deadline = None
+        # threads: the clients, the inventories and text_unsupported are
+        # shared by the data sources and the events
+        pool = ThreadPool(processes=max(1, num_src))
+        # all data sources are queried at the same time and the results
+        # are merged as they arrive
+        avail_iter = pool.imap_unordered(
+            source_task, [(input_dics, cl, event, target_path)
+                          for cl in range(num_src)])
+        src_done = []
+        try:
+            for i in range(num_src):
+                if t_deadline is None:
+                    cl, stas_cli = avail_iter.next()
                 else:
-                    stas_all.append(st_fdarc)
+                    cl, stas_cli = avail_iter.next(
+                        timeout=max(0., t_deadline - time.time()))
+                src_done.append(cl)
+                # put all the available stations together
+                for st_fdarc in stas_cli:
+                    if len(st_fdarc) == 0:
+                        continue
+                    elif len(st_fdarc) == 1:
+                        stas_all.append([st_fdarc])
+                    else:
+                        stas_all.append(st_fdarc)
+        except multiprocessing.TimeoutError:
+            for cl in range(num_src):
+                if cl in src_done:
+                    continue
+                ee = 'availability -- %s -- no answer after %s sec\n' \
+                     % (input_dics['data_source'][cl],
+                        input_dics['avail_timeout'])
+                source_exception(target_path, ee)
+        finally:
+            # a query without answer is not stopped, it ends with its
+            # own request timeout and its channels are not used
+            pool.close()
+            if len(src_done) == num_src:
+                pool.join()
     else:
         stas_all = read_list_stas(input_dics['list_stas'],
                                   input_dics['normal_mode_syn'],
@@ -99,50 +126,22 @@ def get_metadata(input_dics, event, info_avail):
             fdsn_create_bulk_list(target_path, input_dics,
                                   stas_all, event)
 
-    stas_arr = np.array(stas_all)
-    np.save(os.path.join(target_path, 'info', 'availability'), stas_arr)
-
-    avail_add_all = os.path.join(target_path, 'info', 'availability.txt')
-    avail_fi = open(avail_add_all, 'ab')
-    np.savetxt(avail_fi, stas_arr, delimiter=',', fmt='%s')
-    avail_fi.close()
-
-    saved_avail = np.loadtxt(avail_add_all, delimiter=',',
-                             dtype=bytes, ndmin=2).astype(np.str)
-    saved_avail = saved_avail.astype(np.object)
-    unique_avail = []
-    if len(saved_avail) >= 1:
-        unique_avail = unique_rows_avail(saved_avail)
-        avail_fi = open(avail_add_all, 'wb')
-        np.savetxt(avail_fi, unique_avail, delimiter=',', fmt='%s')
-        avail_fi.close()
-
-    avail_add_cur = os.path.join(
-        target_path, 'info', 'availability_%05i.txt'
-                             % len(glob(os.path.join(target_path,
-                                                     'info',
-                                                     'availab*.txt'))))
-    avail_fi = open(avail_add_cur, 'wb')
-    np.savetxt(avail_fi, stas_arr, delimiter=',', fmt='%s')
-    avail_fi.close()
-
-    saved_avail = np.loadtxt(avail_add_cur, delimiter=',',
-                             dtype=bytes, ndmin=2).astype(np.str)
-    saved_avail = saved_avail.astype(np.object)
-    unique_avail = []
-    if len(saved_avail) >= 1:
-        unique_avail = unique_rows_avail(saved_avail)
-        avail_fi = open(avail_add_cur, 'wb')
-        np.savetxt(avail_fi, unique_avail, delimiter=',', fmt='%s')
-        avail_fi.close()
-
-    # XXX remove duplications
-    # if (not input_dics['force_waveform']) \
-    #         and (not input_dics['force_response']):
-    #     stas_update = rm_duplicate(stas_all, target_path)
-    #     stas_arr_update = np.array(stas_update)
-    # else:
-    stas_arr_update = np.array(unique_avail)
+    # typed availability store (info/availability.bin), the unique
+    # channels of this check are used for the next steps
+    avail_arr, avail_srcs = avail_append(target_path, stas_all)
+    stas_arr_update = avail_rows(avail_unique(avail_arr), avail_srcs)
+
+    # distance/azimuth of all the channels (info/geodesic.txt) and
+    # --min_epi/--max_epi/--min_azi/--max_azi before any request is sent
+    if len(stas_arr_update) > 0 and abs(float(event['latitude'])) <= 90.:
+        epi_dist, azi, bazi = write_geodesic(target_path, stas_arr_update,
+                                             event)
+        if input_dics['min_azi'] or input_dics['max_azi'] or \
+                input_dics['min_epi'] or input_dics['max_epi']:
+            epi_azi_ok = epi_azi_mask(input_dics, epi_dist, azi)
+            print('[INFO] %s/%s channels in the epicentral distance and '
+                  'azimuth ranges' % (np.sum(epi_azi_ok), len(epi_azi_ok)))
+            stas_arr_update = stas_arr_update[epi_azi_ok]
 
     if not input_dics['bulk']:
         print('\navailability for event: %s ---> DONE' % info_avail)
@@ -154,19 +153,61 @@ def get_metadata(input_dics, event, info_avail):
 
     return stas_arr_update
 
-# ##################### unique_rows_avail ##################################
+# ##################### source_available ##############################
+
+
+def source_available(input_dics, cl, event, target_path):
+    """
+    check the availability of one data source
+    :param input_dics:
+    :param cl: index of the data source in input_dics['data_source']
+    :param event:
+    :param target_path:
+    :return:
+    """
+    if input_dics['data_source'][cl].lower() not in ['arclink']:
+        return fdsn_available(input_dics, cl, event, target_path)
+    elif input_dics['data_source'][cl].lower() == 'arclink':
+        return arc_available(input_dics, event, target_path)
+    else:
+        print('\nERROR: %s is not implemented!'
+              % input_dics['data_source'][cl])
+        print_data_sources()
+        return []
+
+# ##################### source_task #####################################
+
+
+def source_task(args):
+    """
+    availability of one data source in the pool of get_metadata, an error
+    is logged and does not affect the other data sources
+    :param args: input_dics, cl, event, target_path
+    :return: cl, list of channels
+    """
+    input_dics, cl, event, target_path = args
+    try:
+        return cl, source_available(input_dics, cl, event, target_path)
+    except Exception as error:
+        ee = 'availability -- %s -- %s\n' % (input_dics['data_source'][cl],
+                                            error)
+        source_exception(target_path, ee)
+        return cl, []
+
+# ##################### source_exception ################################
 
 
-def unique_rows_avail(av):
+def source_exception(target_path, ee):
     """
-    unique (row-wise) the availability array
-    :param av:
+    log an error of the availability check in info/exception
+    :param target_path:
+    :param ee:
     :return:
     """
-    av_hash = av[:, 0] + '#' + av[:, 1] + '#' + av[:, 2] + '#' +\
-              av[:, 3] + '#' + av[:, 8]
-    av_hash_unique, av_indx = np.unique(av_hash, return_index=True)
-    return av[av_indx]
+    exc_file = open(os.path.join(target_path, 'info', 'exception'), 'at+')
+    exc_file.writelines(ee)
+    exc_file.close()
+    print('ERROR: %s' % ee)
 
 # ##################### fdsn_available ##################################
 
@@ -188,9 +229,18 @@ def fdsn_available(input_dics, cl, event, target_path):
         include_restricted = None
 
     sta_fdsn = []
+    t_req = datetime.now()
     try:
-        if input_dics['data_source'][cl].lower() in ["iris-federator", "eida-routing"]:
-            client_fdsn = RoutingClient(input_dics['data_source'][cl].lower())
+        if input_dics['inventory_cache'] and \
+                input_dics['data_source'][cl].lower() not in \
+                ["iris-federator", "eida-routing"]:
+            sta_fdsn = inventory_available(input_dics,
+                                           input_dics['data_source'][cl],
+                                           event, target_path)
+            available = None
+
+        elif input_dics['data_source'][cl].lower() in ["iris-federator", "eida-routing"]:
+            client_fdsn = fdsn_client(input_dics, input_dics['data_source'][cl])
 
             available = client_fdsn.get_stations(
                 network=input_dics['net'],
@@ -202,12 +252,9 @@ def fdsn_available(input_dics, cl, event, target_path):
                 level='channel')
 
         else:
-            client_fdsn = Client_fdsn(
-                base_url=input_dics['data_source'][cl].upper(),
-                user=input_dics['username_fdsn'],
-                password=input_dics['password_fdsn'])
+            client_fdsn = fdsn_client(input_dics, input_dics['data_source'][cl])
 
-            available = client_fdsn.get_stations(
+            station_query = dict(
                 network=input_dics['net'],
                 station=input_dics['sta'],
                 location=input_dics['loc'],
@@ -225,31 +272,60 @@ def fdsn_available(input_dics, cl, event, target_path):
                 includerestricted=include_restricted,
                 level='channel')
 
-        for network in available.networks:
-            for station in network:
-                for channel in station:
-                    st_id = '%s_%s_%s_%s' % (network.code,
-                                             station.code,
-                                             channel.location_code,
-                                             channel.code)
-                    sta_fdsn.append([network.code, station.code,
-                                     channel.location_code, channel.code,
-                                     channel.latitude, channel.longitude,
-                                     channel.elevation, channel.depth,
-                                     input_dics['data_source'][cl], st_id,
-                                     channel.azimuth, channel.dip])
+            sta_text = None
+            if input_dics['avail_text']:
+                sta_text = fdsn_text_available(client_fdsn,
+                                               input_dics['data_source'][cl],
+                                               station_query)
+            if sta_text is not None:
+                record_metric(input_dics, target_path,
+                              input_dics['data_source'][cl], 'availability',
+                              '%s.%s.%s.%s' % (input_dics['net'],
+                                               input_dics['sta'],
+                                               input_dics['loc'],
+                                               input_dics['cha']),
+                              (datetime.now() - t_req).total_seconds())
+                sta_fdsn = sta_text
+                available = None
+            else:
+                available = client_fdsn.get_stations(**station_query)
+
+        if available is not None:
+            record_metric(input_dics, target_path,
+                          input_dics['data_source'][cl], 'availability',
+                          '%s.%s.%s.%s' % (input_dics['net'],
+                                           input_dics['sta'],
+                                           input_dics['loc'],
+                                           input_dics['cha']),
+                          (datetime.now() - t_req).total_seconds())
+
+            for network in available.networks:
+                for station in network:
+                    for channel in station:
+                        st_id = '%s_%s_%s_%s' % (network.code,
+                                                 station.code,
+                                                 channel.location_code,
+                                                 channel.code)
+                        sta_fdsn.append([network.code, station.code,
+                                         channel.location_code, channel.code,
+                                         channel.latitude, channel.longitude,
+                                         channel.elevation, channel.depth,
+                                         input_dics['data_source'][cl], st_id,
+                                         channel.azimuth, channel.dip])
 
         if input_dics['bulk']:
             print('creating a list for bulk request...')
             bulk_list = []
-            for bulk_sta in sta_fdsn:
-                if input_dics['cut_time_phase']:
-                    t_start, t_end = calculate_time_phase(event, bulk_sta)
-                else:
-                    t_start = event['t1']
-                    t_end = event['t2']
+            if input_dics['cut_time_phase']:
+                bulk_windows = calculate_time_phase_arr(event, sta_fdsn)
+            else:
+                bulk_windows = [(event['t1'], event['t2'])]*len(sta_fdsn)
+            for bulk_sta, bulk_window in zip(sta_fdsn, bulk_windows):
+                # no P, Pdiff or PKIKP arrival at the station
+                if bulk_window is None:
+                    continue
                 bulk_list.append((bulk_sta[0], bulk_sta[1], bulk_sta[2],
-                                  bulk_sta[3], t_start, t_end))
+                                  bulk_sta[3]) + tuple(bulk_window))
 
             bulk_list_fio = open(os.path.join(
                 target_path, 'info',
@@ -258,6 +334,12 @@ def fdsn_available(input_dics, cl, event, target_path):
             bulk_list_fio.close()
 
     except Exception as error:
+        record_metric(input_dics, target_path, input_dics['data_source'][cl],
+                      'availability', '%s.%s.%s.%s' % (input_dics['net'],
+                                                       input_dics['sta'],
+                                                       input_dics['loc'],
+                                                       input_dics['cha']),
+                      (datetime.now() - t_req).total_seconds(), error=error)
         exc_file = open(os.path.join(target_path, 'info', 'exception'), 'at+')
         ee = 'availability -- %s -- %s\n' % (input_dics['data_source'][cl],
                                              error)
@@ -271,6 +353,76 @@ def fdsn_available(input_dics, cl, event, target_path):
     sta_fdsn.sort()
     return sta_fdsn
 
+# ##################### fdsn_text_available #############################
+
+
+def fdsn_text_available(client_fdsn, data_source, station_query):
+    """
+    channel-level availability in the FDSN text format (--avail_text),
+    the pipe-separated lines are parsed directly into the availability
+    columns instead of building an Inventory from StationXML
+    :param client_fdsn:
+    :param data_source:
+    :param station_query: parameters of get_stations
+    :return: list of channels or None if the data source does not
+             support the text format (StationXML should be used)
+    """
+    if data_source in text_unsupported:
+        return None
+    text_fio = BytesIO()
+    try:
+        client_fdsn.get_stations(format='text', filename=text_fio,
+                                 **station_query)
+    except Exception as error:
+        if error_class(error) == 'no_data':
+            raise
+        print('[WARNING] %s -- text format failed, use StationXML: %s'
+              % (data_source, error))
+        if isinstance(error, (TypeError, ValueError)) or \
+                http_status(error) in [400, 406, 415, 501] or \
+                'bad request' in ('%s' % error).lower():
+            text_unsupported.add(data_source)
+        return None
+
+    sta_text = []
+    text_fio.seek(0)
+    for text_line in text_fio:
+        text_line = text_line.decode('utf-8', 'replace').strip()
+        if not text_line:
+            continue
+        if text_line.startswith('#'):
+            continue
+        if text_line.startswith('<'):
+            # the format parameter was ignored (StationXML)
+            print('[WARNING] %s does not support the text format, '
+                  'use StationXML' % data_source)
+            text_unsupported.add(data_source)
+            return None
+        cols = [col.strip() for col in text_line.split('|')]
+        if len(cols) < 10:
+            continue
+        st_id = '%s_%s_%s_%s' % (cols[0], cols[1], cols[2], cols[3])
+        sta_text.append([cols[0], cols[1], cols[2], cols[3],
+                         text_float(cols[4]), text_float(cols[5]),
+                         text_float(cols[6]), text_float(cols[7]),
+                         data_source, st_id,
+                         text_float(cols[8]), text_float(cols[9])])
+    return sta_text
+
+# ##################### text_float ######################################
+
+
+def text_float(value):
+    """
+    float of a column of the FDSN text format (None if it is empty)
+    :param value:
+    :return:
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
 # ##################### arc_available ###################################
 
 
@@ -284,79 +436,104 @@ def arc_available(input_dics, event, target_path):
     """
     print("check the availability: ArcLink")
 
-    client_arclink = Client_arclink(user=input_dics['username_arclink'],
-                                    host=input_dics['host_arclink'],
-                                    port=input_dics['port_arclink'],
-                                    password=input_dics['password_arclink'],
-                                    timeout=input_dics['arc_avai_timeout'])
-
-    if hasattr(client_arclink, 'get_inventory'):
-        arclink_get_inventory = client_arclink.get_inventory
-    elif hasattr(client_arclink, 'getInventory'):
-        arclink_get_inventory = client_arclink.getInventory
-
-    sta_arc = []
     nets_req = [x.strip() for x in input_dics['net'].split(',')]
     stas_req = [x.strip() for x in input_dics['sta'].split(',')]
     locs_req = [x.strip() for x in input_dics['loc'].split(',')]
     chas_req = [x.strip() for x in input_dics['cha'].split(',')]
-    for net_req in nets_req:
-        for sta_req in stas_req:
-            for loc_req in locs_req:
-                for cha_req in chas_req:
-                    try:
-                        inventories = arclink_get_inventory(
-                            network=net_req,
-                            station=sta_req,
-                            location=loc_req,
-                            channel=cha_req,
-                            starttime=UTCDateTime(event['t1']),
-                            endtime=UTCDateTime(event['t2']),
-                            min_latitude=input_dics['mlat_rbb'],
-                            max_latitude=input_dics['Mlat_rbb'],
-                            min_longitude=input_dics['mlon_rbb'],
-                            max_longitude=input_dics['Mlon_rbb'])
-
-                        for inv_key in inventories.keys():
-                            netsta = inv_key.split('.')
-                            if len(netsta) == 4:
-                                sta = '%s.%s' % (netsta[0], netsta[1])
-                                if not inventories[sta]['depth']:
-                                    inventories[sta]['depth'] = 0.0
-                                st_id = '%s_%s_%s_%s' % (netsta[0],
-                                                         netsta[1],
-                                                         netsta[2],
-                                                         netsta[3])
-                                sta_arc.append([netsta[0], netsta[1],
-                                                netsta[2], netsta[3],
-                                                inventories[sta]['latitude'],
-                                                inventories[sta]['longitude'],
-                                                inventories[sta]['elevation'],
-                                                inventories[sta]['depth'],
-                                                'ARCLINK', st_id, 'NA', 'NA'])
-                        if input_dics['lon_cba'] and input_dics['lat_cba']:
-                            index_rm = []
-                            lat1 = float(input_dics['lat_cba'])
-                            lon1 = float(input_dics['lon_cba'])
-                            for ai in range(len(sta_arc)):
-                                dist = locations2degrees(lat1, lon1,
-                                                         float(sta_arc[ai][4]),
-                                                         float(sta_arc[ai][5]))
-                                if not input_dics['mr_cba'] <= dist <= \
-                                        input_dics['Mr_cba']:
-                                    index_rm.append(ai)
-                            index_rm.sort(reverse=True)
-                            for ri in range(len(index_rm)):
-                                del sta_arc[ri]
-
-                    except Exception as error:
-                        exc_file = open(os.path.join(target_path, 'info',
-                                                     'exception'), 'at+')
-                        ee = 'availability -- arclink -- %s\n' % error
-                        exc_file.writelines(ee)
-                        exc_file.close()
-                        print('ERROR: %s' % ee)
-                        return []
+    combs_req = list(itertools.product(nets_req, stas_req,
+                                       locs_req, chas_req))
+
+    # ArcLink clients keep one connection open, one client per thread
+    thread_data = threading.local()
+
+    def arc_inventory(comb_req):
+        """
+        ArcLink inventory of one net/sta/loc/cha combination
+        :param comb_req:
+        :return: list of channels or None in case of an error
+        """
+        if not hasattr(thread_data, 'get_inventory'):
+            client_arclink = Client_arclink(
+                user=input_dics['username_arclink'],
+                host=input_dics['host_arclink'],
+                port=input_dics['port_arclink'],
+                password=input_dics['password_arclink'],
+                timeout=input_dics['arc_avai_timeout'])
+            if hasattr(client_arclink, 'get_inventory'):
+                thread_data.get_inventory = client_arclink.get_inventory
+            elif hasattr(client_arclink, 'getInventory'):
+                thread_data.get_inventory = client_arclink.getInventory
+        net_req, sta_req, loc_req, cha_req = comb_req
+        sta_comb = []
+        try:
+            inventories = thread_data.get_inventory(
+                network=net_req,
+                station=sta_req,
+                location=loc_req,
+                channel=cha_req,
+                starttime=UTCDateTime(event['t1']),
+                endtime=UTCDateTime(event['t2']),
+                min_latitude=input_dics['mlat_rbb'],
+                max_latitude=input_dics['Mlat_rbb'],
+                min_longitude=input_dics['mlon_rbb'],
+                max_longitude=input_dics['Mlon_rbb'])
+
+            for inv_key in inventories.keys():
+                netsta = inv_key.split('.')
+                if len(netsta) == 4:
+                    sta = '%s.%s' % (netsta[0], netsta[1])
+                    if not inventories[sta]['depth']:
+                        inventories[sta]['depth'] = 0.0
+                    st_id = '%s_%s_%s_%s' % (netsta[0], netsta[1],
+                                             netsta[2], netsta[3])
+                    sta_comb.append([netsta[0], netsta[1],
+                                     netsta[2], netsta[3],
+                                     inventories[sta]['latitude'],
+                                     inventories[sta]['longitude'],
+                                     inventories[sta]['elevation'],
+                                     inventories[sta]['depth'],
+                                     'ARCLINK', st_id, 'NA', 'NA'])
+        except Exception as error:
+            exc_file = open(os.path.join(target_path, 'info',
+                                         'exception'), 'at+')
+            ee = 'availability -- arclink -- %s -- %s\n' \
+                 % ('.'.join(comb_req), error)
+            exc_file.writelines(ee)
+            exc_file.close()
+            print('ERROR: %s' % ee)
+            return None
+        return sta_comb
+
+    num_np = max(1, min(input_dics['req_np'], len(combs_req)))
+    pool = ThreadPool(processes=num_np)
+    try:
+        stas_combs = pool.map(arc_inventory, combs_req, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    if None in stas_combs:
+        return []
+
+    # merge the combinations, overlapping wildcards return the same channel
+    sta_arc = []
+    st_ids = set()
+    for sta_comb in stas_combs:
+        for sta in sta_comb:
+            if sta[9] in st_ids:
+                continue
+            st_ids.add(sta[9])
+            sta_arc.append(sta)
+
+    if sta_arc and input_dics['lon_cba'] and input_dics['lat_cba']:
+        sta_lats = np.array([sta[4] for sta in sta_arc], dtype=float)
+        sta_lons = np.array([sta[5] for sta in sta_arc], dtype=float)
+        dist = epi_distances(float(input_dics['lat_cba']),
+                             float(input_dics['lon_cba']),
+                             sta_lats, sta_lons)
+        circle_ok = (dist >= input_dics['mr_cba']) & \
+                    (dist <= input_dics['Mr_cba'])
+        sta_arc = [sta for sta, sta_ok in zip(sta_arc, circle_ok) if sta_ok]
 
     if len(sta_arc) == 0:
         sta_arc.append([])
@@ -377,14 +554,16 @@ def fdsn_create_bulk_list(target_path, input_dics, stas_all, event):
     """
     print('creating a list for bulk request...')
     bulk_list = []
-    for bulk_sta in stas_all:
-        if input_dics['cut_time_phase']:
-            t_start, t_end = calculate_time_phase(event, bulk_sta)
-        else:
-            t_start = event['t1']
-            t_end = event['t2']
+    if input_dics['cut_time_phase']:
+        bulk_windows = calculate_time_phase_arr(event, stas_all)
+    else:
+        bulk_windows = [(event['t1'], event['t2'])]*len(stas_all)
+    for bulk_sta, bulk_window in zip(stas_all, bulk_windows):
+        # no P, Pdiff or PKIKP arrival at the station
+        if bulk_window is None:
+            continue
         bulk_list.append((bulk_sta[0], bulk_sta[1], bulk_sta[2],
-                          bulk_sta[3], t_start, t_end))
+                          bulk_sta[3]) + tuple(bulk_window))
 
     bulk_list_fio = open(os.path.join(target_path, 'info',
                                       'bulkdata_list_local'), 'ab+')
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  metrics_handler.py
+#   Purpose:   metrics of the requests sent to the data centers
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import glob
+import json
+import numpy as np
+import os
+import time
+
+from .request_handler import error_class, http_status
+
+# Every request appends one JSON line to <event>/info/metrics.jsonl:
+# {"time", "data_center", "product", "st_id", "latency", "bytes",
+#  "status", "retries", "error_class"}
+# The lines are short enough to be appended atomically by the
+# download processes of one event.
+
+# ##################### record_metric ###################################
+
+
+def record_metric(input_dics, target_path, req_cli, product, st_id,
+                  latency, n_bytes=0, path=None, error=None, retries=0):
+    """
+    record the metrics of one request (--metrics)
+    :param input_dics:
+    :param target_path: directory of the event
+    :param req_cli: data center
+    :param product: waveform, response, syngine_waveform, availability...
+    :param st_id:
+    :param latency: duration of the request in seconds
+    :param n_bytes: number of bytes retrieved
+    :param path: retrieved file, replaces n_bytes if it exists
+    :param error: exception raised by the request (None if successful)
+    :param retries: number of retries before the final result
+    :return:
+    """
+    if not input_dics.get('metrics'):
+        return
+    if path and os.path.isfile(path):
+        n_bytes = os.path.getsize(path)
+    metric = {'time': round(time.time(), 3),
+              'data_center': req_cli,
+              'product': product,
+              'st_id': st_id,
+              'latency': round(latency, 4),
+              'bytes': int(n_bytes or 0),
+              'status': http_status(error),
+              'retries': retries,
+              'error_class': error_class(error)}
+    try:
+        metrics_fio = open(os.path.join(target_path, 'info',
+                                        'metrics.jsonl'), 'at')
+        metrics_fio.write(json.dumps(metric) + '\n')
+        metrics_fio.close()
+    except Exception as error:
+        print('[WARNING] metrics -- %s -- %s' % (st_id, error))
+
+# ##################### read_metrics ####################################
+
+
+def read_metrics(metrics_paths):
+    """
+    read metrics.jsonl files
+    :param metrics_paths:
+    :return: list of metrics (dictionaries)
+    """
+    metrics = []
+    for metrics_path in metrics_paths:
+        if not os.path.isfile(metrics_path):
+            continue
+        metrics_fio = open(metrics_path, 'rt')
+        for metric_line in metrics_fio:
+            try:
+                metrics.append(json.loads(metric_line))
+            except ValueError:
+                continue
+        metrics_fio.close()
+    return metrics
+
+# ##################### metric_status #################################
+
+
+def metric_status(metric):
+    """
+    HTTP status of a metric as a label, 'unknown' if it is not known
+    (null or "None" in metrics.jsonl)
+    :param metric:
+    :return:
+    """
+    status = metric.get('status')
+    if status in [None, '', 'None', 'null']:
+        return 'unknown'
+    try:
+        return str(int(status))
+    except (TypeError, ValueError):
+        return str(status)
+
+# ##################### aggregate_metrics ###############################
+
+
+def aggregate_metrics(metrics):
+    """
+    aggregate the metrics per data center and product
+    :param metrics:
+    :return: dictionary data_center: product: statistics
+    """
+    groups = {}
+    for metric in metrics:
+        groups.setdefault(metric['data_center'], {}).setdefault(
+            metric['product'], []).append(metric)
+
+    report = {}
+    for data_center in groups:
+        report[data_center] = {}
+        for product in groups[data_center]:
+            group = groups[data_center][product]
+            latencies = np.array([metric['latency'] for metric in group])
+            n_bytes = sum([metric['bytes'] for metric in group])
+            statuses = {}
+            for metric in group:
+                status = metric_status(metric)
+                statuses[status] = statuses.get(status, 0) + 1
+            # from the start of the first to the end of the last request,
+            # the requests sent in parallel overlap
+            wall_time = max([metric['time'] for metric in group]) - \
+                min([metric['time'] - metric['latency'] for metric in group])
+            report[data_center][product] = {
+                'requests': len(group),
+                'errors': len([metric for metric in group
+                               if metric['error_class']]),
+                'retries': sum([metric['retries'] for metric in group]),
+                'bytes': n_bytes,
+                'wall_time': float(wall_time),
+                'latency_sum': float(np.sum(latencies)),
+                'latency_p50': float(np.percentile(latencies, 50)),
+                'latency_p90': float(np.percentile(latencies, 90)),
+                'latency_p99': float(np.percentile(latencies, 99)),
+                'latency_max': float(np.max(latencies)),
+                # throughput of all the requests (bytes over wall time)
+                'mb_per_s': float(n_bytes/1024.**2 / max(wall_time, 1.e-6)),
+                # transfer rate of one request (bytes over summed latency)
+                'request_mb_per_s': float(n_bytes/1024.**2 /
+                                          max(np.sum(latencies), 1.e-6)),
+                'status': statuses}
+    return report
+
+# ##################### event_metrics_report ############################
+
+
+def event_metrics_report(input_dics, target_path):
+    """
+    write the metrics report of one event (info/metrics_report.json)
+    :param input_dics:
+    :param target_path:
+    :return:
+    """
+    if not input_dics.get('metrics'):
+        return
+    metrics = read_metrics([os.path.join(target_path, 'info',
+                                         'metrics.jsonl')])
+    report_fio = open(os.path.join(target_path, 'info',
+                                   'metrics_report.json'), 'wt')
+    json.dump(aggregate_metrics(metrics), report_fio, indent=2,
+              sort_keys=True)
+    report_fio.close()
+
+# ##################### run_metrics_report ##############################
+
+
+def run_metrics_report(input_dics):
+    """
+    write the metrics report of all the events in datapath
+    (metrics_report.json and metrics.prom in Prometheus text format)
+    :param input_dics:
+    :return: aggregated metrics
+    """
+    metrics = read_metrics(glob.glob(os.path.join(input_dics['datapath'],
+                                                  '*', 'info',
+                                                  'metrics.jsonl')))
+    report = aggregate_metrics(metrics)
+    report_fio = open(os.path.join(input_dics['datapath'],
+                                   'metrics_report.json'), 'wt')
+    json.dump(report, report_fio, indent=2, sort_keys=True)
+    report_fio.close()
+    write_prometheus(report, os.path.join(input_dics['datapath'],
+                                          'metrics.prom'))
+    return report
+
+# ##################### write_prometheus ################################
+
+
+def write_prometheus(report, prom_path):
+    """
+    write the aggregated metrics in Prometheus text format
+    :param report:
+    :param prom_path:
+    :return:
+    """
+    prom_lines = [
+        '# HELP obspydmt_requests_total Number of requests.',
+        '# TYPE obspydmt_requests_total counter',
+    ]
+    for data_center in sorted(report):
+        for product in sorted(report[data_center]):
+            for status, num in sorted(
+                    report[data_center][product]['status'].items()):
+                prom_lines.append(
+                    'obspydmt_requests_total{data_center="%s",'
+                    'product="%s",status="%s"} %s'
+                    % (data_center, product, status, num))
+    prom_metrics = [
+        ('bytes', 'obspydmt_bytes_total', 'counter',
+         'Number of bytes retrieved.'),
+        ('retries', 'obspydmt_retries_total', 'counter',
+         'Number of retried requests.'),
+        ('mb_per_s', 'obspydmt_throughput_mb_per_second', 'gauge',
+         'Throughput of the requests (bytes over wall time).'),
+        ('request_mb_per_s', 'obspydmt_request_throughput_mb_per_second',
+         'gauge', 'Transfer rate of one request (bytes over latency).'),
+    ]
+    for key, name, prom_type, prom_help in prom_metrics:
+        prom_lines.append('# HELP %s %s' % (name, prom_help))
+        prom_lines.append('# TYPE %s %s' % (name, prom_type))
+        for data_center in sorted(report):
+            for product in sorted(report[data_center]):
+                prom_lines.append('%s{data_center="%s",product="%s"} %s'
+                                  % (name, data_center, product,
+                                     report[data_center][product][key]))
+    prom_lines.append('# HELP obspydmt_request_latency_seconds '
+                      'Latency of the requests.')
+    prom_lines.append('# TYPE obspydmt_request_latency_seconds summary')
+    for data_center in sorted(report):
+        for product in sorted(report[data_center]):
+            stats = report[data_center][product]
+            labels = 'data_center="%s",product="%s"' % (data_center, product)
+            for quantile in ['50', '90', '99']:
+                prom_lines.append(
+                    'obspydmt_request_latency_seconds{%s,quantile="0.%s"} %s'
+                    % (labels, quantile, stats['latency_p%s' % quantile]))
+            prom_lines.append('obspydmt_request_latency_seconds_sum{%s} %s'
+                              % (labels, stats['latency_sum']))
+            prom_lines.append('obspydmt_request_latency_seconds_count{%s} %s'
+                              % (labels, stats['requests']))
+    prom_fio = open(prom_path, 'wt')
+    prom_fio.write('\n'.join(prom_lines) + '\n')
+    prom_fio.close()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  plan_handler.py
+#   Purpose:   estimate the volume, number of requests and runtime
+#              of a request before downloading (--plan)
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import json
+import numpy as np
+import os
+
+from .metrics_handler import read_metrics, aggregate_metrics
+
+# nominal sampling rate of the SEED band codes (first letter of the channel)
+BAND_SAMPLE_RATES = {'F': 1000., 'G': 1000., 'D': 250., 'C': 250.,
+                     'E': 100., 'S': 50., 'H': 100., 'B': 40., 'M': 10.,
+                     'L': 1., 'V': 0.1, 'U': 0.01, 'R': 0.001, 'P': 0.0001,
+                     'T': 0.00001, 'Q': 0.000001}
+
+# rates used before they are measured for a data center (--metrics):
+# latency: seconds per request, mb_per_s: transfer rate of one request,
+# bytes_per_sample: miniSEED (Steim2) size, resp_bytes: StationXML size
+PLAN_DEFAULTS = {'latency': 0.5,
+                 'mb_per_s': 2.,
+                 'bytes_per_sample': 2.,
+                 'resp_bytes': 20.*1024,
+                 'syngine_latency': 2.,
+                 'syngine_bytes_per_s': 8.}
+
+# ##################### plan_rates_path #################################
+
+
+def plan_rates_path():
+    """
+    path of the rates measured in previous runs
+    :return:
+    """
+    return os.path.join(os.path.expanduser('~'), '.obspyDMT',
+                        'plan_rates.json')
+
+# ##################### read_plan_rates #################################
+
+
+def read_plan_rates():
+    """
+    rates measured in previous runs, key: data center
+    :return:
+    """
+    if not os.path.isfile(plan_rates_path()):
+        return {}
+    try:
+        rates_fio = open(plan_rates_path(), 'rt')
+        rates = json.load(rates_fio)
+        rates_fio.close()
+        return rates
+    except Exception as error:
+        print('[WARNING] plan rates %s: %s' % (plan_rates_path(), error))
+        return {}
+
+# ##################### plan_rate #######################################
+
+
+def plan_rate(rates, req_cli, key):
+    """
+    rate of one data center, the default if it was never measured
+    :param rates:
+    :param req_cli:
+    :param key:
+    :return:
+    """
+    return rates.get(req_cli.upper(), {}).get(key, PLAN_DEFAULTS[key])
+
+# ##################### sample_rate #####################################
+
+
+def sample_rate(cha):
+    """
+    nominal sampling rate of a channel from its band code
+    :param cha:
+    :return:
+    """
+    return BAND_SAMPLE_RATES.get(cha[:1].upper(), 1.)
+
+# ##################### plan_event ######################################
+
+
+def plan_event(stas_avail, event, input_dics, rates):
+    """
+    expected requests, bytes and request time of one event per data center
+    :param stas_avail: availability of the event
+    :param event:
+    :param input_dics:
+    :param rates:
+    :return: dictionary, key: data center
+    """
+    target_path = os.path.join(input_dics['datapath'], event['event_id'])
+    duration = event['t2'] - event['t1']
+    plans = {}
+    for st_avail in stas_avail:
+        req_cli = st_avail[8]
+        if req_cli not in plans:
+            plans[req_cli] = {'channels': 0, 'requests': 0, 'bytes': 0.,
+                              'seconds': 0., 'wave_bytes': [],
+                              'stations': set()}
+        plan = plans[req_cli]
+        st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                 st_avail[2].replace('--', ''), st_avail[3])
+        plan['channels'] += 1
+        if input_dics['waveform'] and (
+                input_dics['force_waveform'] or not os.path.isfile(
+                    os.path.join(target_path, 'raw', st_id))):
+            plan['wave_bytes'].append(
+                sample_rate(st_avail[3])*duration *
+                plan_rate(rates, req_cli, 'bytes_per_sample'))
+            plan['stations'].add((st_avail[0], st_avail[1]))
+        if input_dics['response'] and (
+                input_dics['force_response'] or not os.path.isfile(
+                    os.path.join(target_path, 'resp', 'STXML.%s' % st_id))):
+            plan_add(plan, rates, req_cli,
+                     [plan_rate(rates, req_cli, 'resp_bytes')])
+        if input_dics['syngine']:
+            plan['requests'] += 1
+            plan['bytes'] += \
+                duration*plan_rate(rates, req_cli, 'syngine_bytes_per_s')
+            plan['seconds'] += plan_rate(rates, req_cli, 'syngine_latency')
+
+    for req_cli in plans:
+        plan = plans[req_cli]
+        wave_bytes = plan.pop('wave_bytes')
+        num_stations = len(plan.pop('stations'))
+        if input_dics['bulk'] and len(wave_bytes) > 0:
+            # one request per chunk of --bulk_chunk channels
+            chunk_size = max(1, input_dics['bulk_chunk'])
+            wave_bytes = [sum(wave_bytes[i:i+chunk_size])
+                          for i in range(0, len(wave_bytes), chunk_size)]
+        elif input_dics['req_coalesce'] and num_stations > 0:
+            # one request per station
+            wave_bytes = [sum(wave_bytes)/num_stations]*num_stations
+        plan_add(plan, rates, req_cli, wave_bytes)
+    return plans
+
+# ##################### plan_add ########################################
+
+
+def plan_add(plan, rates, req_cli, req_bytes):
+    """
+    add requests of req_bytes each to the plan of one data center
+    :param plan:
+    :param rates:
+    :param req_cli:
+    :param req_bytes: list, bytes of each request
+    :return:
+    """
+    plan['requests'] += len(req_bytes)
+    plan['bytes'] += sum(req_bytes)
+    plan['seconds'] += \
+        len(req_bytes)*plan_rate(rates, req_cli, 'latency') + \
+        sum(req_bytes)/(plan_rate(rates, req_cli, 'mb_per_s')*1024.**2)
+
+# ##################### plan_runtime ####################################
+
+
+def plan_runtime(event_plans, input_dics):
+    """
+    predicted wall time of the download with the current concurrency
+    settings (--req_parallel, --req_np, --req_np_total)
+    :param event_plans: list of plans (one per event)
+    :param input_dics:
+    :return: seconds
+    """
+    num_req_np = input_dics['req_np'] if input_dics['req_parallel'] else 1
+    if input_dics['req_np_total']:
+        # one scheduler for all the events, num_req_np per data center
+        dc_seconds = {}
+        for plans in event_plans:
+            for req_cli in plans:
+                dc_seconds[req_cli] = dc_seconds.get(req_cli, 0.) + \
+                    plans[req_cli]['seconds']
+        if len(dc_seconds) == 0:
+            return 0.
+        return max(sum(dc_seconds.values())/input_dics['req_np_total'],
+                   max(dc_seconds.values())/num_req_np)
+    runtime = 0.
+    for plans in event_plans:
+        dc_times = [plans[req_cli]['seconds']/num_req_np
+                    for req_cli in plans]
+        if len(dc_times) == 0:
+            continue
+        if input_dics['req_parallel']:
+            # the data centers of one event are served in parallel
+            runtime += max(dc_times)
+        else:
+            runtime += sum(dc_times)
+    return runtime
+
+# ##################### plan_report #####################################
+
+
+def plan_report(input_dics, events, event_plans):
+    """
+    print the plan per event and per data center and write it to
+    <datapath>/plan.json
+    :param input_dics:
+    :param events:
+    :param event_plans: list of plans (one per event)
+    :return:
+    """
+    dc_totals = {}
+    print('\n==================================================')
+    print('download plan')
+    print('==================================================')
+    print('%-24s %9s %9s %12s' % ('event', 'channels', 'requests', 'MB'))
+    for event, plans in zip(events, event_plans):
+        for req_cli in plans:
+            if req_cli not in dc_totals:
+                dc_totals[req_cli] = {'channels': 0, 'requests': 0,
+                                      'bytes': 0., 'seconds': 0.}
+            for key in dc_totals[req_cli]:
+                dc_totals[req_cli][key] += plans[req_cli][key]
+        print('%-24s %9i %9i %12.1f'
+              % (event['event_id'],
+                 sum([plans[req_cli]['channels'] for req_cli in plans]),
+                 sum([plans[req_cli]['requests'] for req_cli in plans]),
+                 sum([plans[req_cli]['bytes']
+                      for req_cli in plans])/1024.**2))
+    print('--------------------------------------------------')
+    print('%-24s %9s %9s %12s' % ('data center', 'channels', 'requests',
+                                  'MB'))
+    for req_cli in sorted(dc_totals):
+        print('%-24s %9i %9i %12.1f'
+              % (req_cli, dc_totals[req_cli]['channels'],
+                 dc_totals[req_cli]['requests'],
+                 dc_totals[req_cli]['bytes']/1024.**2))
+    runtime = plan_runtime(event_plans, input_dics)
+    total_bytes = sum([dc_totals[req_cli]['bytes'] for req_cli in dc_totals])
+    total_requests = sum([dc_totals[req_cli]['requests']
+                          for req_cli in dc_totals])
+    print('--------------------------------------------------')
+    print('* Events: %s' % len(events))
+    print('* Requests: %s' % total_requests)
+    print('* Volume: %.3f GB' % (total_bytes/1024.**3))
+    print('* Predicted runtime: %.0f s (%.1f h)' % (runtime, runtime/3600.))
+    unmeasured = [req_cli for req_cli in dc_totals
+                  if req_cli.upper() not in read_plan_rates()]
+    if len(unmeasured) > 0:
+        print('[INFO] default rates are used for: %s (run with --metrics '
+              'to measure them)' % ', '.join(sorted(unmeasured)))
+    print('==================================================\n')
+
+    if not os.path.isdir(input_dics['datapath']):
+        os.makedirs(input_dics['datapath'])
+    plan_fio = open(os.path.join(input_dics['datapath'], 'plan.json'), 'wt')
+    json.dump({'events': dict([(event['event_id'], plans) for event, plans
+                               in zip(events, event_plans)]),
+               'data_centers': dc_totals,
+               'requests': total_requests,
+               'bytes': total_bytes,
+               'runtime': runtime}, plan_fio, indent=2, sort_keys=True)
+    plan_fio.close()
+
+# ##################### plan_measure ####################################
+
+
+def plan_measure(input_dics, events, weight=0.5):
+    """
+    update the rates of the planner with the metrics (--metrics) and
+    the waveforms of the events of this run
+    :param input_dics:
+    :param events:
+    :param weight: weight of the new measurements (exponential average)
+    :return:
+    """
+    event_paths = [os.path.join(input_dics['datapath'], event['event_id'])
+                   for event in events]
+    report = aggregate_metrics(read_metrics(
+        [os.path.join(event_path, 'info', 'metrics.jsonl')
+         for event_path in event_paths]))
+    measured = {}
+    for req_cli in report:
+        dc_rates = measured.setdefault(req_cli.upper(), {})
+        stats = report[req_cli].get('response')
+        if stats and stats['requests'] > stats['errors']:
+            dc_rates['latency'] = stats['latency_p50']
+            dc_rates['resp_bytes'] = \
+                stats['bytes']/float(stats['requests'] - stats['errors'])
+        stats = report[req_cli].get('waveform')
+        if stats and stats['bytes'] > 0:
+            transfer_s = stats['latency_sum'] - stats['requests'] * \
+                dc_rates.get('latency', 0.)
+            if transfer_s <= 0:
+                transfer_s = stats['latency_sum']
+            dc_rates['mb_per_s'] = stats['bytes']/1024.**2/transfer_s
+        stats = report[req_cli].get('syngine_waveform')
+        if stats and stats['requests'] > stats['errors']:
+            dc_rates['syngine_latency'] = stats['latency_p50']
+
+    # bytes per sample of the retrieved waveforms
+    wave_bytes = {}
+    for event, event_path in zip(events, event_paths):
+        sta_ev_path = os.path.join(event_path, 'info', 'station_event')
+        if not os.path.isfile(sta_ev_path):
+            continue
+        duration = event['t2'] - event['t1']
+        for sta_ev in open(sta_ev_path, 'rt'):
+            sta_ev = sta_ev.split(',')
+            if len(sta_ev) < 9:
+                continue
+            raw_path = os.path.join(event_path, 'raw', '%s.%s.%s.%s'
+                                    % tuple(sta_ev[:4]))
+            if os.path.isfile(raw_path) and duration > 0:
+                wave_bytes.setdefault(sta_ev[8].upper(), []).append(
+                    os.path.getsize(raw_path) /
+                    (sample_rate(sta_ev[3])*duration))
+    for req_cli in wave_bytes:
+        measured.setdefault(req_cli, {})['bytes_per_sample'] = \
+            float(np.median(wave_bytes[req_cli]))
+
+    if len(measured) == 0:
+        return
+    rates = read_plan_rates()
+    for req_cli in measured:
+        dc_rates = rates.setdefault(req_cli, {})
+        for key, value in measured[req_cli].items():
+            if not (value > 0 and np.isfinite(value)):
+                continue
+            if key in dc_rates:
+                value = (1. - weight)*dc_rates[key] + weight*value
+            dc_rates[key] = value
+    try:
+        if not os.path.isdir(os.path.dirname(plan_rates_path())):
+            os.makedirs(os.path.dirname(plan_rates_path()))
+        rates_tmp = '%s.part%s' % (plan_rates_path(), os.getpid())
+        rates_fio = open(rates_tmp, 'wt')
+        json.dump(rates, rates_fio, indent=2, sort_keys=True)
+        rates_fio.close()
+        if os.path.isfile(plan_rates_path()):
+            os.remove(plan_rates_path())
+        os.rename(rates_tmp, plan_rates_path())
+        print('[INFO] planner rates updated: %s' % plan_rates_path())
+    except Exception as error:
+        print('[WARNING] plan rates could not be saved: %s' % error)
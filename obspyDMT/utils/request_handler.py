@@ -0,0 +1,811 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  request_handler.py
+#   Purpose:   pool of download workers for waveform/response requests
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+from collections import deque
+import multiprocessing
+import itertools
+import os
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import random
+import re
+import sys
+import threading
+import time
+
+# state of one download worker, filled once by init_download_worker and
+# reused for all the channels that are sent to that worker
+worker_state = {}
+
+# latencies of the last successful requests, key: (data center, product),
+# used for hedging (--req_hedge). The workers of the download pools share
+# one history (latency_store, see share_latencies), a process without it
+# keeps its own history in request_latencies.
+request_latencies = {}
+latency_store = {}
+HEDGE_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+# backoff before the n-th retry: uniform(0, min(max, base * 2**(n-1)))
+RETRY_BACKOFF = 1.
+RETRY_BACKOFF_MAX = 60.
+
+# ##################### ConcurrencyWindow ###############################
+
+
+class ConcurrencyWindow(object):
+    """
+    AIMD (additive increase, multiplicative decrease) control of the
+    number of parallel requests sent to one data center.
+    The window grows by one request after a full window of successful
+    requests and is halved when the data center starts to throttle
+    (HTTP 429/503, timeouts) or its latency doubles.
+    """
+    def __init__(self, floor, ceiling, start):
+        self.floor = max(1, int(floor))
+        self.ceiling = max(self.floor, int(ceiling))
+        self.window = float(min(max(start, self.floor), self.ceiling))
+        self.latency = None
+        self.last_decrease = 0.
+        self.history = [int(self.window)]
+
+    @property
+    def size(self):
+        return int(self.window)
+
+    def update(self, duration, err_class):
+        """
+        update the window based on the result of one request
+        :param duration: duration of the request in seconds
+        :param err_class: error class of the request (None if successful)
+        :return:
+        """
+        congested = err_class in ['throttled', 'timeout']
+        if err_class is None and duration is not None:
+            if self.latency is None:
+                self.latency = duration
+            elif duration > 2.*self.latency and self.window > self.floor:
+                congested = True
+            self.latency = 0.9*self.latency + 0.1*duration
+
+        if congested:
+            # decrease at most once per round-trip time,
+            # all the requests in flight saw the same congestion
+            now = time.time()
+            if now - self.last_decrease > (self.latency or 1.):
+                self.window = max(self.floor, self.window/2.)
+                self.last_decrease = now
+        elif err_class is None:
+            self.window = min(self.ceiling, self.window + 1./self.window)
+        self.history.append(int(self.window))
+
+    def summary(self):
+        return 'final: %s, min: %s, max: %s, mean: %.1f' \
+               % (self.size, min(self.history), max(self.history),
+                  sum(self.history)/float(len(self.history)))
+
+# ##################### error_class #####################################
+
+
+def error_class(error):
+    """
+    classify an exception raised by a request
+    :param error:
+    :return: 'no_data', 'throttled', 'timeout' or 'other'
+    """
+    if error is None:
+        return None
+    err_msg = ('%s %s' % (type(error).__name__, error)).lower()
+    http_code = re.search(r'(http(?: error)?|status code)[^0-9]{0,3}'
+                          r'([0-9]{3})', err_msg)
+    http_code = http_code.group(2) if http_code else None
+    if 'nodata' in err_msg or 'no data' in err_msg or http_code == '204':
+        return 'no_data'
+    if http_code in ['429', '503'] or \
+            'too many requests' in err_msg or \
+            'service unavailable' in err_msg or \
+            'service temporarily unavailable' in err_msg:
+        return 'throttled'
+    if 'timeout' in err_msg or 'timed out' in err_msg:
+        return 'timeout'
+    return 'other'
+
+# ##################### http_status #####################################
+
+
+def http_status(error):
+    """
+    HTTP status code of a request from the exception it raised
+    :param error:
+    :return: status code (int) or None if it is unknown
+    """
+    if error is None:
+        return 200
+    err_msg = ('%s %s' % (type(error).__name__, error)).lower()
+    http_code = re.search(r'(http(?: error)?|status code)[^0-9]{0,3}'
+                          r'([0-9]{3})', err_msg)
+    if http_code:
+        return int(http_code.group(2))
+    if error_class(error) == 'no_data':
+        return 204
+    return None
+
+# ##################### transient_error #################################
+
+
+def transient_error(error):
+    """
+    check whether a failed request is worth to be retried
+    (throttling, timeouts, server errors and broken connections)
+    :param error:
+    :return:
+    """
+    err_class = error_class(error)
+    if err_class in ['throttled', 'timeout']:
+        return True
+    if err_class == 'no_data':
+        return False
+    if http_status(error) in [500, 502, 504]:
+        return True
+    err_msg = ('%s %s' % (type(error).__name__, error)).lower()
+    for err_pattern in ['connection', 'reset by peer', 'broken pipe',
+                        'incompleteread', 'remote end closed',
+                        'temporary failure']:
+        if err_pattern in err_msg:
+            return True
+    return False
+
+# ##################### retry_backoff ###################################
+
+
+def retry_backoff(num_retry):
+    """
+    waiting time before a retry, exponential backoff with full jitter
+    :param num_retry: 1 for the first retry
+    :return: seconds
+    """
+    return random.uniform(0., min(RETRY_BACKOFF_MAX,
+                                  RETRY_BACKOFF*2.**(num_retry - 1)))
+
+# ##################### hedge_delay #####################################
+
+
+def hedge_delay(input_dics, req_cli, product):
+    """
+    time after which a duplicate of a running request is sent (--req_hedge)
+    :param input_dics:
+    :param req_cli:
+    :param product:
+    :return: seconds or None if the request should not be hedged
+    """
+    if not input_dics.get('req_hedge'):
+        return None
+    if 'history' in latency_store:
+        latencies = latency_store['history'].get((req_cli, product))
+    else:
+        latencies = request_latencies.get((req_cli, product))
+    if latencies is None or len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    latencies = sorted(latencies)
+    return latencies[int(round(input_dics['req_hedge']/100. *
+                               (len(latencies) - 1)))]
+
+# ##################### share_latencies #################################
+
+
+def share_latencies(input_dics):
+    """
+    latency history shared by the worker processes (--req_hedge), it is
+    created once by the process which starts the pools and is inherited
+    by the processes it forks
+    :param input_dics:
+    :return: (history, lock) to be passed to init_latencies or None
+    """
+    if not input_dics.get('req_hedge'):
+        return None
+    if 'history' not in latency_store:
+        manager = multiprocessing.Manager()
+        latency_store['manager'] = manager
+        latency_store['history'] = manager.dict()
+        latency_store['lock'] = manager.Lock()
+    return latency_store['history'], latency_store['lock']
+
+# ##################### init_latencies ##################################
+
+
+def init_latencies(shared_latencies):
+    """
+    use the shared latency history in a worker process
+    :param shared_latencies: return value of share_latencies
+    :return:
+    """
+    if shared_latencies is not None:
+        latency_store['history'], latency_store['lock'] = shared_latencies
+
+# ##################### record_latency ##################################
+
+
+def record_latency(req_cli, product, latency):
+    """
+    add the latency of a successful request to the history
+    :param req_cli:
+    :param product:
+    :param latency: seconds
+    :return:
+    """
+    if 'history' in latency_store:
+        with latency_store['lock']:
+            latencies = latency_store['history'].get((req_cli, product), [])
+            latency_store['history'][(req_cli, product)] = \
+                (latencies + [latency])[-HEDGE_SAMPLES:]
+        return
+    if (req_cli, product) not in request_latencies:
+        request_latencies[(req_cli, product)] = deque(maxlen=HEDGE_SAMPLES)
+    request_latencies[(req_cli, product)].append(latency)
+
+# ##################### hedged_request ##################################
+
+
+def hedged_request(request, delay, discard=None):
+    """
+    send a request and, if it is still running after delay seconds,
+    a duplicate of it. The result of the first successful one is returned.
+    :param request: function without arguments which sends the request
+    :param delay: seconds
+    :param discard: function called with the result of the request which
+        lost the race
+    :return: result of request
+    """
+    results = queue.Queue()
+    race = {'finished': False}
+    race_lock = threading.Lock()
+
+    def hedge_attempt():
+        try:
+            result = (request(), None)
+        except Exception as error:
+            result = (None, error)
+        with race_lock:
+            if not race['finished']:
+                results.put(result)
+                return
+        if discard and result[1] is None:
+            discard(result[0])
+
+    num_running = 0
+    for num_attempt in range(2):
+        attempt_thread = threading.Thread(target=hedge_attempt)
+        attempt_thread.daemon = True
+        attempt_thread.start()
+        num_running += 1
+        try:
+            result, error = results.get(timeout=delay if num_attempt == 0
+                                        else None)
+            num_running -= 1
+            break
+        except queue.Empty:
+            continue
+    if error is not None and num_running > 0:
+        # the duplicate is still running
+        result, error = results.get()
+        num_running -= 1
+    with race_lock:
+        race['finished'] = True
+    while discard:
+        try:
+            late_result, late_error = results.get_nowait()
+        except queue.Empty:
+            break
+        if late_error is None:
+            discard(late_result)
+    if error is not None:
+        raise error
+    return result
+
+# ##################### robust_request ##################################
+
+
+def robust_request(request, input_dics, req_cli, product, discard=None,
+                   hedge=True):
+    """
+    send a request with retries on transient errors (--req_retry) and
+    hedging of slow requests (--req_hedge)
+    :param request: function without arguments which sends the request
+    :param input_dics:
+    :param req_cli:
+    :param product: latencies are collected per data center and product
+    :param discard: function called with the result of a hedged request
+        which lost the race
+    :param hedge: False for the requests which must not be duplicated
+    :return: result of request, number of retries
+    """
+    num_retry = 0
+    while True:
+        t_req = time.time()
+        try:
+            delay = None
+            if hedge:
+                delay = hedge_delay(input_dics, req_cli, product)
+            if delay is None:
+                result = request()
+            else:
+                result = hedged_request(request, delay, discard)
+            record_latency(req_cli, product, time.time() - t_req)
+            return result, num_retry
+        except Exception as error:
+            if num_retry >= input_dics.get('req_retry', 0) or \
+                    not transient_error(error):
+                try:
+                    error.req_retries = num_retry
+                except Exception:
+                    pass
+                raise
+            num_retry += 1
+            time.sleep(retry_backoff(num_retry))
+
+# ##################### request_to_file #################################
+
+
+def request_to_file(fetch, path2write, input_dics, req_cli, product):
+    """
+    retrieve one file with robust_request. Each attempt writes to its own
+    temporary file, only the one of the successful attempt is moved to
+    path2write.
+    :param fetch: function(path_tmp) which retrieves the data to path_tmp
+    :param path2write:
+    :param input_dics:
+    :param req_cli:
+    :param product:
+    :return: number of retries
+    """
+    num_attempts = itertools.count()
+
+    def request():
+        path_tmp = '%s.part%s_%s' % (path2write, os.getpid(),
+                                     next(num_attempts))
+        try:
+            fetch(path_tmp)
+            if not os.path.isfile(path_tmp):
+                raise Exception('No data available for request.')
+        except Exception:
+            if os.path.isfile(path_tmp):
+                os.remove(path_tmp)
+            raise
+        return path_tmp
+
+    def discard(path_tmp):
+        if os.path.isfile(path_tmp):
+            os.remove(path_tmp)
+
+    path_tmp, num_retry = robust_request(request, input_dics, req_cli,
+                                         product, discard)
+    if os.path.isfile(path2write):
+        os.remove(path2write)
+    os.rename(path_tmp, path2write)
+    return num_retry
+
+# ##################### pool_download ###################################
+
+
+def pool_download(download_core, client_init, stas_avail, event, input_dics,
+                  target_path, req_cli, info_event, num_req_np):
+    """
+    retrieve all the channels in stas_avail with a pool of long-lived
+    workers. Each worker creates its clients once (client_init) and
+    calls download_core for every channel it receives.
+    With --req_adaptive, the number of requests in flight follows an
+    AIMD window between the specified floor and ceiling.
+    :param download_core:
+    :param client_init:
+    :param stas_avail:
+    :param event:
+    :param input_dics:
+    :param target_path:
+    :param req_cli:
+    :param info_event:
+    :param num_req_np:
+    :return:
+    """
+    tasks = []
+    for st_counter, st_avail in enumerate(stas_avail):
+        info_station = '[%s-%s/%s]' % (info_event, st_counter + 1,
+                                       len(stas_avail))
+        tasks.append((st_avail, info_station))
+    if len(tasks) == 0:
+        return
+
+    if input_dics['req_adaptive']:
+        req_window = ConcurrencyWindow(input_dics['req_adaptive'][0],
+                                       input_dics['req_adaptive'][1],
+                                       num_req_np)
+        num_proc = req_window.ceiling
+    else:
+        req_window = None
+        num_proc = num_req_np
+
+    pool = multiprocessing.Pool(processes=max(1, min(num_proc, len(tasks))),
+                                initializer=init_download_worker,
+                                initargs=(download_core, client_init,
+                                          event, input_dics,
+                                          target_path, req_cli,
+                                          share_latencies(input_dics)))
+    try:
+        if req_window is None:
+            for _ in pool.imap_unordered(download_task, tasks, chunksize=1):
+                pass
+        else:
+            window_dispatch(pool, tasks, req_window)
+            window_report(target_path, req_cli, req_window)
+        pool.close()
+    except Exception as error:
+        print('[WARNING] download pool of %s: %s' % (req_cli, error))
+        pool.terminate()
+    pool.join()
+
+# ##################### window_dispatch #################################
+
+
+def window_dispatch(pool, tasks, req_window):
+    """
+    send the tasks to the pool, keeping at most req_window.size of them
+    in flight. Blocks until all the tasks are finished.
+    :param pool:
+    :param tasks:
+    :param req_window:
+    :return:
+    """
+    results = queue.Queue()
+    num_sent = 0
+    num_inflight = 0
+    while num_sent < len(tasks) or num_inflight > 0:
+        while num_sent < len(tasks) and num_inflight < req_window.size:
+            pool.apply_async(download_task, (tasks[num_sent],),
+                             callback=results.put,
+                             **error_callback(lambda error: results.put(None)))
+            num_sent += 1
+            num_inflight += 1
+        result = results.get()
+        num_inflight -= 1
+        if result:
+            req_window.update(result['duration'], result['error_class'])
+
+# ##################### error_callback ##################################
+
+
+def error_callback(callback):
+    """
+    error_callback argument of Pool.apply_async (Python 3), so that a task
+    which raises still puts a result on the queue of the dispatcher.
+    In Python 2, the tasks catch their exceptions themselves.
+    :param callback: function(error)
+    :return: keyword arguments of apply_async
+    """
+    if sys.version_info[0] < 3:
+        return {}
+    return {'error_callback': callback}
+
+# ##################### window_report ###################################
+
+
+def window_report(target_path, req_cli, req_window):
+    """
+    append the concurrency window used for req_cli to the event summary
+    :param target_path:
+    :param req_cli:
+    :param req_window:
+    :return:
+    """
+    summary = '%s -- concurrency window -- %s' % (req_cli,
+                                                  req_window.summary())
+    print('[INFO] %s' % summary)
+    window_fio = open(os.path.join(target_path, 'info', 'req_window'), 'at+')
+    window_fio.writelines(summary + '\n')
+    window_fio.close()
+
+# ##################### init_download_worker ############################
+
+
+def init_download_worker(download_core, client_init, event, input_dics,
+                         target_path, req_cli, shared_latencies=None):
+    """
+    initialize one worker of the download pool
+    :param download_core:
+    :param client_init:
+    :param event:
+    :param input_dics:
+    :param target_path:
+    :param req_cli:
+    :param shared_latencies: see share_latencies
+    :return:
+    """
+    init_latencies(shared_latencies)
+    # the clients are created by the first task: an exception raised in
+    # the initializer would kill the worker and the pool would restart it
+    # forever
+    worker_state['download_core'] = download_core
+    worker_state['client_init'] = client_init
+    worker_state['clients'] = None
+    worker_state['event'] = event
+    worker_state['input_dics'] = input_dics
+    worker_state['target_path'] = target_path
+    worker_state['req_cli'] = req_cli
+
+# ##################### download_task ###################################
+
+
+def download_task(task):
+    """
+    download one channel inside a worker of the download pool
+    :param task: (st_avail, info_station)
+    :return: result of download_core
+    """
+    st_avail, info_station = task
+    try:
+        if worker_state['clients'] is None:
+            worker_state['clients'] = worker_state['client_init'](
+                worker_state['input_dics'], worker_state['req_cli'])
+        args = [st_avail, worker_state['event'], worker_state['input_dics'],
+                worker_state['target_path']]
+        args.extend(worker_state['clients'])
+        args.extend([worker_state['req_cli'], info_station])
+        return worker_state['download_core'](*args)
+    except Exception as error:
+        print('[WARNING] %s: %s' % (info_station, error))
+        exc_file = open(os.path.join(worker_state['target_path'], 'info',
+                                     'exception'), 'at+')
+        exc_file.writelines('%s -- %s -- %s\n'
+                            % (worker_state['req_cli'], info_station, error))
+        exc_file.close()
+        return None
+
+# ##################### schedule_download ###############################
+
+
+def schedule_download(work_events, input_dics, core_init, event_done):
+    """
+    retrieve the channels of all events with one pool of workers.
+    Channels are queued per data center and dispatched round-robin
+    between the data centers, with at most --req_np_total requests in
+    flight in total and --req_np (or the --req_adaptive window) per
+    data center, so a slow data center does not stall the others.
+    Events are pulled from work_events when the queue of any data
+    center runs low (less than twice its number of parallel requests),
+    i.e. the availability of the next events is checked while the
+    requests of the previous ones are in flight.
+    :param work_events: iterable of (event, stas_avail, info_event)
+    :param input_dics:
+    :param core_init: function(req_cli) -> (download_core, client_init)
+    :param event_done: function(event) called when all the channels of
+        an event are finished, after the concurrency windows of its data
+        centers (--req_adaptive) are written to info/req_window
+    :return:
+    """
+    num_total = input_dics['req_np_total']
+    pending = {}
+    inflight = {}
+    windows = {}
+    dc_order = []
+    events = {}
+    ev_remaining = {}
+    ev_clients = {}
+    results = queue.Queue()
+    work_iter = iter(work_events)
+    exhausted = False
+    ev_counter = 0
+    rr_start = 0
+    total_inflight = 0
+
+    def dc_size(req_cli):
+        if req_cli in windows:
+            return windows[req_cli].size
+        return input_dics['req_np']
+
+    def dc_hungry():
+        if len(dc_order) == 0:
+            return True
+        return any([len(pending[dc]) < 2*dc_size(dc) for dc in dc_order])
+
+    pool = multiprocessing.Pool(processes=num_total,
+                                initializer=init_schedule_worker,
+                                initargs=(core_init, input_dics,
+                                          share_latencies(input_dics)))
+    try:
+        while True:
+            # pull new events while the queue of any data center is short:
+            # the backlog of a slow data center does not stop the others
+            while not exhausted and dc_hungry():
+                try:
+                    event, stas_avail, info_event = next(work_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if len(stas_avail) == 0:
+                    event_done(event)
+                    continue
+                ev_key = ev_counter
+                ev_counter += 1
+                events[ev_key] = event
+                ev_remaining[ev_key] = len(stas_avail)
+                ev_clients[ev_key] = []
+                for st_counter, st_avail in enumerate(stas_avail):
+                    req_cli = st_avail[8]
+                    if req_cli not in pending:
+                        pending[req_cli] = deque()
+                        inflight[req_cli] = 0
+                        dc_order.append(req_cli)
+                        if input_dics['req_adaptive']:
+                            windows[req_cli] = ConcurrencyWindow(
+                                input_dics['req_adaptive'][0],
+                                input_dics['req_adaptive'][1],
+                                input_dics['req_np'])
+                    if req_cli not in ev_clients[ev_key]:
+                        ev_clients[ev_key].append(req_cli)
+                    info_station = '[%s-%s/%s]' % (info_event,
+                                                   st_counter + 1,
+                                                   len(stas_avail))
+                    pending[req_cli].append((ev_key, st_avail,
+                                             info_station))
+
+            # round-robin between the data centers
+            dispatched = True
+            while dispatched and total_inflight < num_total:
+                dispatched = False
+                for dc_num in range(len(dc_order)):
+                    req_cli = dc_order[(rr_start + dc_num) % len(dc_order)]
+                    if total_inflight >= num_total:
+                        break
+                    if len(pending[req_cli]) == 0 or \
+                            inflight[req_cli] >= dc_size(req_cli):
+                        continue
+                    ev_key, st_avail, info_station = \
+                        pending[req_cli].popleft()
+                    pool.apply_async(schedule_task,
+                                     ((ev_key, events[ev_key], st_avail,
+                                       info_station, req_cli),),
+                                     callback=results.put,
+                                     **error_callback(
+                                         lambda error, ev_key=ev_key,
+                                         st_avail=st_avail,
+                                         req_cli=req_cli:
+                                         schedule_error(
+                                             results, input_dics,
+                                             ev_key, events[ev_key],
+                                             st_avail, req_cli, error)))
+                    inflight[req_cli] += 1
+                    total_inflight += 1
+                    dispatched = True
+                rr_start += 1
+
+            if total_inflight == 0:
+                if exhausted:
+                    break
+                continue
+
+            ev_key, req_cli, result = results.get()
+            inflight[req_cli] -= 1
+            total_inflight -= 1
+            if result and req_cli in windows:
+                windows[req_cli].update(result['duration'],
+                                        result['error_class'])
+            ev_remaining[ev_key] -= 1
+            if ev_remaining[ev_key] == 0:
+                del ev_remaining[ev_key]
+                target_path = os.path.join(input_dics['datapath'],
+                                           events[ev_key]['event_id'])
+                for ev_cli in ev_clients.pop(ev_key):
+                    if ev_cli in windows:
+                        window_report(target_path, ev_cli, windows[ev_cli])
+                event_done(events.pop(ev_key))
+        pool.close()
+    except Exception as error:
+        print('[WARNING] download scheduler: %s' % error)
+        pool.terminate()
+    pool.join()
+    for req_cli in dc_order:
+        if req_cli in windows:
+            print('[INFO] %s -- concurrency window -- %s'
+                  % (req_cli, windows[req_cli].summary()))
+
+# ##################### init_schedule_worker ############################
+
+
+def init_schedule_worker(core_init, input_dics, shared_latencies=None):
+    """
+    initialize one worker of the download scheduler, the clients of
+    each data center are created when the worker receives its first
+    channel of that data center.
+    :param core_init:
+    :param input_dics:
+    :param shared_latencies: see share_latencies
+    :return:
+    """
+    init_latencies(shared_latencies)
+    worker_state['core_init'] = core_init
+    worker_state['input_dics'] = input_dics
+    worker_state['dc_clients'] = {}
+
+# ##################### schedule_task ###################################
+
+
+def schedule_task(task):
+    """
+    download one channel inside a worker of the download scheduler
+    :param task: (ev_key, event, st_avail, info_station, req_cli)
+    :return: (ev_key, req_cli, result of download_core)
+    """
+    ev_key, event, st_avail, info_station, req_cli = task
+    input_dics = worker_state['input_dics']
+    try:
+        if req_cli not in worker_state['dc_clients']:
+            download_core, client_init = worker_state['core_init'](req_cli)
+            worker_state['dc_clients'][req_cli] = \
+                (download_core, client_init(input_dics, req_cli))
+        download_core, clients = worker_state['dc_clients'][req_cli]
+        args = [st_avail, event, input_dics,
+                os.path.join(input_dics['datapath'], event['event_id'])]
+        args.extend(clients)
+        args.extend([req_cli, info_station])
+        result = download_core(*args)
+    except Exception as error:
+        print('[WARNING] %s: %s' % (info_station, error))
+        schedule_exception(input_dics, event, st_avail, req_cli, error)
+        result = None
+    return ev_key, req_cli, result
+
+# ##################### schedule_error ##################################
+
+
+def schedule_error(results, input_dics, ev_key, event, st_avail, req_cli,
+                   error):
+    """
+    error_callback of a task of the download scheduler: the error is
+    reported and the task is counted as finished
+    :param results: queue of the finished tasks
+    :param input_dics:
+    :param ev_key:
+    :param event:
+    :param st_avail:
+    :param req_cli:
+    :param error:
+    :return:
+    """
+    schedule_exception(input_dics, event, st_avail, req_cli, error)
+    results.put((ev_key, req_cli, None))
+
+# ##################### schedule_exception ##############################
+
+
+def schedule_exception(input_dics, event, st_avail, req_cli, error):
+    """
+    append an error of the download scheduler to info/exception
+    :param input_dics:
+    :param event:
+    :param st_avail:
+    :param req_cli:
+    :param error:
+    :return:
+    """
+    st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1], st_avail[2],
+                             st_avail[3])
+    ee = '%s -- %s -- %s -- %s\n' % (req_cli, 'scheduler', st_id, error)
+    try:
+        exc_file = open(os.path.join(input_dics['datapath'],
+                                     event['event_id'], 'info',
+                                     'exception'), 'at+')
+        exc_file.writelines(ee)
+        exc_file.close()
+    except Exception as exc_error:
+        print('[WARNING] %s' % exc_error)
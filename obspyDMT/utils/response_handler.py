@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  response_handler.py
+#   Purpose:   shared cache of StationXML responses across events
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import hashlib
+from obspy import UTCDateTime
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+# Layout of the response cache:
+# <cache>/objects/<sha1[:2]>/<sha1>.xml   StationXML files (content-addressed,
+#                                         read-only, copied to the events)
+# <cache>/index/<NET.STA.LOC.CHA>/<epoch_start>_<epoch_end>_<sha1>
+#                                         empty files, one per response epoch
+
+# ##################### response_cache_dir ##############################
+
+
+def response_cache_dir(input_dics):
+    """
+    directory of the response cache or False if it is not used
+    :param input_dics:
+    :return:
+    """
+    if not input_dics['response_cache']:
+        return False
+    if input_dics['response_cache_dir']:
+        return input_dics['response_cache_dir']
+    return os.path.join(input_dics['datapath'], 'RESPONSE-CACHE')
+
+# ##################### cache_lookup ####################################
+
+
+def cache_lookup(cache_dir, st_id, t_start, t_end):
+    """
+    find a cached response of st_id whose epoch covers t_start-t_end
+    :param cache_dir:
+    :param st_id: NET.STA.LOC.CHA
+    :param t_start:
+    :param t_end:
+    :return: path of the cached StationXML file or None
+    """
+    index_dir = os.path.join(cache_dir, 'index', st_id)
+    if not os.path.isdir(index_dir):
+        return None
+    t_start = UTCDateTime(t_start).timestamp
+    t_end = UTCDateTime(t_end).timestamp
+    for entry in sorted(os.listdir(index_dir), reverse=True):
+        try:
+            epoch_start, epoch_end, sha1 = entry.split('_')
+        except ValueError:
+            continue
+        if float(epoch_start) <= t_start and t_end <= float(epoch_end):
+            obj_path = cache_object_path(cache_dir, sha1)
+            if os.path.isfile(obj_path):
+                return obj_path
+    return None
+
+# ##################### cache_fetch #####################################
+
+
+def cache_fetch(cache_dir, st_id, t_start, t_end, path2write):
+    """
+    copy a cached response into the event directory (a copy, so that the
+    processing of the event can not modify the cached object)
+    :param cache_dir:
+    :param st_id:
+    :param t_start:
+    :param t_end:
+    :param path2write:
+    :return: True if the response was found in the cache
+    """
+    obj_path = cache_lookup(cache_dir, st_id, t_start, t_end)
+    if obj_path is None:
+        return False
+    path_tmp = '%s.part%s' % (path2write, os.getpid())
+    shutil.copyfile(obj_path, path_tmp)
+    if os.path.isfile(path2write):
+        os.remove(path2write)
+    os.rename(path_tmp, path2write)
+    return True
+
+# ##################### cache_store #####################################
+
+
+def cache_store(cache_dir, st_id, resp_path):
+    """
+    add a downloaded StationXML file to the response cache.
+    The entry is keyed by the epoch of the channel(s) in the file.
+    Open epochs are closed at the time of the download so that they are
+    never used for a time window after an (unknown) instrument change.
+    :param cache_dir:
+    :param st_id:
+    :param resp_path:
+    :return:
+    """
+    try:
+        epoch_start, epoch_end = stationxml_epoch(resp_path)
+        resp_fio = open(resp_path, 'rb')
+        sha1 = hashlib.sha1(resp_fio.read()).hexdigest()
+        resp_fio.close()
+
+        obj_path = cache_object_path(cache_dir, sha1)
+        if not os.path.isfile(obj_path):
+            if not os.path.isdir(os.path.dirname(obj_path)):
+                try:
+                    os.makedirs(os.path.dirname(obj_path))
+                except OSError:
+                    pass
+            obj_tmp = '%s.part%s' % (obj_path, os.getpid())
+            shutil.copyfile(resp_path, obj_tmp)
+            # the objects are never modified
+            os.chmod(obj_tmp, 0o444)
+            os.rename(obj_tmp, obj_path)
+
+        index_dir = os.path.join(cache_dir, 'index', st_id)
+        if not os.path.isdir(index_dir):
+            try:
+                os.makedirs(index_dir)
+            except OSError:
+                pass
+        open(os.path.join(index_dir, '%i_%i_%s' % (epoch_start, epoch_end,
+                                                   sha1)), 'a').close()
+    except Exception as error:
+        print('[WARNING] response cache -- %s -- %s' % (st_id, error))
+
+# ##################### stationxml_epoch ################################
+
+
+def stationxml_epoch(resp_path):
+    """
+    first start and last end date of the channels in a StationXML file
+    :param resp_path:
+    :return: epoch_start, epoch_end as timestamps
+    """
+    epoch_start = None
+    epoch_end = None
+    for ev, elem in ET.iterparse(resp_path):
+        if elem.tag.endswith('}Channel') or elem.tag == 'Channel':
+            ch_start = UTCDateTime(elem.attrib['startDate']).timestamp
+            if elem.attrib.get('endDate'):
+                ch_end = UTCDateTime(elem.attrib['endDate']).timestamp
+            else:
+                ch_end = UTCDateTime().timestamp
+            ch_end = min(ch_end, UTCDateTime().timestamp)
+            if epoch_start is None or ch_start < epoch_start:
+                epoch_start = ch_start
+            if epoch_end is None or ch_end > epoch_end:
+                epoch_end = ch_end
+            elem.clear()
+    if epoch_start is None:
+        raise Exception('no channel epoch found in %s' % resp_path)
+    return epoch_start, epoch_end
+
+# ##################### cache_object_path ###############################
+
+
+def cache_object_path(cache_dir, sha1):
+    """
+    path of a content-addressed object in the response cache
+    :param cache_dir:
+    :param sha1:
+    :return:
+    """
+    return os.path.join(cache_dir, 'objects', sha1[:2], '%s.xml' % sha1)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  segment_handler.py
+#   Purpose:   local store of long continuous segments (continuous mode)
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import errno
+import math
+from obspy import read, Stream, UTCDateTime
+import os
+import socket
+import time
+
+from .request_handler import error_class, robust_request, RETRY_BACKOFF_MAX
+
+# a block which ended less than NODATA_RECENT seconds before its request
+# can still get data (latency of the data center): its .nodata marker
+# expires after NODATA_TTL seconds.
+NODATA_RECENT = 86400.
+NODATA_TTL = 3600.
+
+# Layout of the segment store:
+# <datapath>/SEGMENT-STORE/<NET.STA.LOC.CHA>/<NET.STA.LOC.CHA>.<block_start>
+# one miniSEED file per channel and block (--continuous_block seconds,
+# aligned to multiples of the block length since 1970-01-01).
+# Blocks without data are marked by an empty <...>.nodata file, its
+# modification time is the time of the request (see nodata_marked).
+# A block being retrieved has a <...>.lock file (content: host pid).
+
+# ##################### segment_store_dir ###############################
+
+
+def segment_store_dir(input_dics):
+    """
+    directory of the segment store or False if it is not used
+    :param input_dics:
+    :return:
+    """
+    if not (input_dics['continuous_block'] and input_dics['continuous']):
+        return False
+    return os.path.join(input_dics['datapath'], 'SEGMENT-STORE')
+
+# ##################### block_starts ####################################
+
+
+def block_starts(t_start, t_end, block):
+    """
+    start times of the blocks which cover t_start-t_end
+    :param t_start:
+    :param t_end:
+    :param block: length of one block in seconds
+    :return:
+    """
+    first_block = int(math.floor(UTCDateTime(t_start).timestamp/block))
+    last_block = int(math.ceil(UTCDateTime(t_end).timestamp/block))
+    return [UTCDateTime(num_block*block)
+            for num_block in range(first_block, max(last_block,
+                                                    first_block + 1))]
+
+# ##################### segment_path ####################################
+
+
+def segment_path(store_dir, st_id, block_start):
+    """
+    path of one block of one channel in the segment store
+    :param store_dir:
+    :param st_id:
+    :param block_start:
+    :return:
+    """
+    return os.path.join(store_dir, st_id,
+                        '%s.%i' % (st_id, block_start.timestamp))
+
+# ##################### segment_fetch ###################################
+
+
+def segment_fetch(client_fdsn, st_avail, block_start, block, seg_path,
+                  input_dics, req_cli, lock_timeout=3600):
+    """
+    retrieve one block of one channel into the segment store, with
+    retries on transient errors (--req_retry).
+    A lock file makes sure that a block is requested only once even if
+    several intervals (processes) need it at the same time.
+    :param client_fdsn:
+    :param st_avail:
+    :param block_start:
+    :param block:
+    :param seg_path:
+    :param input_dics:
+    :param req_cli:
+    :param lock_timeout: a lock older than this (seconds) is stale
+    :return: number of retries
+    """
+    if os.path.isfile(seg_path) or nodata_marked(seg_path, block_start, block):
+        return 0
+    if not os.path.isdir(os.path.dirname(seg_path)):
+        try:
+            os.makedirs(os.path.dirname(seg_path))
+        except OSError:
+            pass
+    lock_path = seg_path + '.lock'
+    while True:
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(lock_fd, ('%s %s' % (socket.gethostname(),
+                                          os.getpid())).encode('utf-8'))
+            os.close(lock_fd)
+            break
+        except OSError:
+            # another worker is retrieving this block
+            if os.path.isfile(seg_path) or \
+                    nodata_marked(seg_path, block_start, block):
+                return 0
+            if lock_stale(lock_path, lock_timeout):
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+                continue
+            time.sleep(1)
+    try:
+        try:
+            dl_waveform, num_retry = robust_request(
+                lambda: client_fdsn.get_waveforms(
+                    network=st_avail[0],
+                    station=st_avail[1],
+                    location=st_avail[2],
+                    channel=st_avail[3],
+                    starttime=block_start,
+                    endtime=block_start + block),
+                input_dics, req_cli, 'segment')
+        except Exception as error:
+            if error_class(error) == 'no_data':
+                open(seg_path + '.nodata', 'a').close()
+                return getattr(error, 'req_retries', 0)
+            raise
+        if len(dl_waveform) == 0:
+            open(seg_path + '.nodata', 'a').close()
+            return num_retry
+        seg_tmp = '%s.part%s' % (seg_path, os.getpid())
+        dl_waveform.write(seg_tmp, format='mseed')
+        os.rename(seg_tmp, seg_path)
+        return num_retry
+    finally:
+        os.remove(lock_path)
+
+# ##################### nodata_marked ###################################
+
+
+def nodata_marked(seg_path, block_start, block):
+    """
+    check whether a block is marked without data. The marker of a block
+    which was recent at the time of the request is removed after
+    NODATA_TTL seconds so that the block is requested again.
+    :param seg_path:
+    :param block_start:
+    :param block: length of one block in seconds
+    :return:
+    """
+    nodata_path = seg_path + '.nodata'
+    try:
+        t_request = os.path.getmtime(nodata_path)
+    except OSError:
+        return False
+    if t_request - (block_start.timestamp + block) > NODATA_RECENT:
+        return True
+    if time.time() - t_request < NODATA_TTL:
+        return True
+    try:
+        os.remove(nodata_path)
+    except OSError:
+        pass
+    return False
+
+# ##################### lock_stale ######################################
+
+
+def lock_stale(lock_path, lock_timeout):
+    """
+    check whether the lock of a block is left by a process which does not
+    run anymore (same host) or is older than lock_timeout
+    :param lock_path:
+    :param lock_timeout: seconds
+    :return:
+    """
+    try:
+        if time.time() - os.path.getmtime(lock_path) > lock_timeout:
+            return True
+        lock_fio = open(lock_path, 'rt')
+        lock_owner = lock_fio.read().split()
+        lock_fio.close()
+    except (IOError, OSError):
+        return False
+    if len(lock_owner) != 2 or lock_owner[0] != socket.gethostname() or \
+            os.name != 'posix':
+        return False
+    try:
+        os.kill(int(lock_owner[1]), 0)
+    except ValueError:
+        return False
+    except OSError as error:
+        # EPERM: the process runs under another user
+        return error.errno != errno.EPERM
+    return False
+
+# ##################### segment_cut #####################################
+
+
+def segment_cut(client_fdsn, st_avail, t_start, t_end, input_dics,
+                req_cli, path2write):
+    """
+    cut the waveform of one channel and one interval from the segment
+    store, the missing blocks are retrieved first (and retried one by one).
+    :param client_fdsn:
+    :param st_avail:
+    :param t_start:
+    :param t_end:
+    :param input_dics:
+    :param req_cli:
+    :param path2write:
+    :return: number of retries
+    """
+    store_dir = segment_store_dir(input_dics)
+    block = input_dics['continuous_block']
+    # the holder of a lock gives up after its retries
+    lock_timeout = (input_dics['req_timeout'] + RETRY_BACKOFF_MAX) * \
+        (input_dics['req_retry'] + 1)
+    st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                             st_avail[2], st_avail[3])
+    st_cut = Stream()
+    num_retry = 0
+    for block_start in block_starts(t_start, t_end, block):
+        seg_path = segment_path(store_dir, st_id, block_start)
+        num_retry += segment_fetch(client_fdsn, st_avail, block_start, block,
+                                   seg_path, input_dics, req_cli,
+                                   lock_timeout=lock_timeout)
+        if os.path.isfile(seg_path):
+            st_cut += read(seg_path, format='MSEED',
+                           starttime=t_start, endtime=t_end)
+    # records which cross the block limits are stored in both blocks
+    st_cut.merge(method=-1)
+    st_cut.trim(t_start, t_end)
+    if len(st_cut) == 0:
+        raise Exception('No data available for request.')
+    path_tmp = '%s.part%s' % (path2write, os.getpid())
+    st_cut.write(path_tmp, format='mseed')
+    if os.path.isfile(path2write):
+        os.remove(path2write)
+    os.rename(path_tmp, path2write)
+    return num_retry
@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  session_handler.py
+#   Purpose:   FDSN requests over persistent (keep-alive) HTTP sessions
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import itertools
+from multiprocessing.pool import ThreadPool
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+import struct
+import threading
+import time
+
+from .metrics_handler import record_metric
+from .request_handler import error_class, request_to_file, robust_request
+from .response_handler import response_cache_dir, cache_fetch, cache_store
+from .state_handler import state_update, state_failed
+
+# one requests.Session (i.e. one pool of keep-alive connections)
+# per data center and process
+fdsn_sessions = {}
+fdsn_sessions_lock = threading.Lock()
+
+# ##################### get_session #####################################
+
+
+def get_session(base_url, pool_size):
+    """
+    return the persistent HTTP session of a data center
+    :param base_url:
+    :param pool_size: maximum number of connections kept alive
+    :return:
+    """
+    with fdsn_sessions_lock:
+        key = (os.getpid(), base_url)
+        if key not in fdsn_sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=max(1, pool_size),
+                                  pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            fdsn_sessions[key] = session
+        return fdsn_sessions[key]
+
+# ##################### fdsn_service_url ################################
+
+
+def fdsn_service_url(client_fdsn, service, input_dics):
+    """
+    URL of the query resource of an FDSN service (dataselect/station)
+    :param client_fdsn:
+    :param service:
+    :param input_dics:
+    :return:
+    """
+    if input_dics['username_fdsn']:
+        resource_type = 'queryauth'
+    else:
+        resource_type = 'query'
+    major_version = getattr(client_fdsn, 'major_versions', {}).get(service, 1)
+    return '%s/fdsnws/%s/%s/%s' % (client_fdsn.base_url.rstrip('/'),
+                                   service, major_version, resource_type)
+
+# ##################### fdsn_time_str ###################################
+
+
+def fdsn_time_str(utc_time):
+    """
+    format a UTCDateTime as required by FDSN web services
+    :param utc_time:
+    :return:
+    """
+    return utc_time.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+# ##################### fdsn_query_params ###############################
+
+
+def fdsn_query_params(st_avail, t_start, t_end, **kwargs):
+    """
+    query parameters of one channel for dataselect/station services
+    :param st_avail:
+    :param t_start:
+    :param t_end:
+    :param kwargs: additional parameters, e.g. level='response'
+    :return:
+    """
+    params = {'network': st_avail[0],
+              'station': st_avail[1],
+              'location': st_avail[2] if st_avail[2] else '--',
+              'channel': st_avail[3],
+              'starttime': fdsn_time_str(t_start),
+              'endtime': fdsn_time_str(t_end)}
+    params.update(kwargs)
+    return params
+
+# ##################### session_get_to_file #############################
+
+
+def session_get_to_file(session, url, params, path2write, input_dics,
+                        timeout=120):
+    """
+    send one GET request and stream its content into path2write.
+    The content is first written to a temporary file which is moved
+    to path2write only if the request was successful.
+    :param session:
+    :param url:
+    :param params:
+    :param path2write:
+    :param input_dics:
+    :param timeout:
+    :return: number of bytes written
+    """
+    auth = None
+    if input_dics['username_fdsn']:
+        auth = HTTPDigestAuth(input_dics['username_fdsn'],
+                              input_dics['password_fdsn'])
+    resp = session.get(url, params=params, auth=auth,
+                       stream=True, timeout=timeout)
+    try:
+        if resp.status_code in [204, 404]:
+            raise Exception('No data available for request (HTTP %s)'
+                            % resp.status_code)
+        if resp.status_code != 200:
+            raise Exception('HTTP %s: %s' % (resp.status_code,
+                                             resp.reason))
+        path_tmp = '%s.part%s' % (path2write, os.getpid())
+        size_written = 0
+        with open(path_tmp, 'wb') as fio:
+            for chunk in resp.iter_content(chunk_size=64*1024):
+                fio.write(chunk)
+                size_written += len(chunk)
+        if size_written == 0:
+            os.remove(path_tmp)
+            raise Exception('Empty response')
+        if os.path.isfile(path2write):
+            os.remove(path2write)
+        os.rename(path_tmp, path2write)
+    finally:
+        resp.close()
+    return size_written
+
+# ##################### session_download ################################
+
+
+def session_download(stas_avail, event, input_dics, target_path,
+                     client_fdsn, req_cli, info_event,
+                     time_window):
+    """
+    retrieve waveforms and StationXML files of all channels in stas_avail
+    over a pool of --session_np persistent connections to req_cli, with
+    --session_np requests in flight.
+    The files are written to the same raw/ and resp/ directories as the
+    default obspy engine.
+    :param stas_avail:
+    :param event:
+    :param input_dics:
+    :param target_path:
+    :param client_fdsn: used to resolve the service URLs
+    :param req_cli:
+    :param info_event:
+    :param time_window: function(event, st_avail, input_dics) -> t1, t2
+    :return:
+    """
+    # requests in flight to req_cli (--session_np)
+    num_req_np = input_dics['session_np']
+    session = get_session(client_fdsn.base_url, num_req_np)
+    url_dataselect = fdsn_service_url(client_fdsn, 'dataselect', input_dics)
+    url_station = fdsn_service_url(client_fdsn, 'station', input_dics)
+
+    resp_cache = response_cache_dir(input_dics)
+    tasks = []
+    for st_counter, st_avail in enumerate(stas_avail):
+        if st_avail[2] == '--' or st_avail[2] == '  ':
+            st_avail[2] = ''
+        info_station = '[%s-%s/%s]' % (info_event, st_counter + 1,
+                                       len(stas_avail))
+        st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                 st_avail[2], st_avail[3])
+        try:
+            t_start, t_end = time_window(event, st_avail, input_dics)
+        except Exception as error:
+            session_exception(target_path, req_cli, 'initializing',
+                              st_id, error)
+            state_failed(input_dics, event, st_avail, 'initializing', error)
+            continue
+
+        if input_dics['waveform']:
+            path2write = os.path.join(target_path, 'raw', st_id)
+            if (not os.path.isfile(path2write)) or \
+                    input_dics['force_waveform']:
+                tasks.append(('waveform', st_id, info_station,
+                              url_dataselect,
+                              fdsn_query_params(st_avail, t_start, t_end),
+                              path2write))
+        if input_dics['response']:
+            path2write = os.path.join(target_path, 'resp', 'STXML.%s' % st_id)
+            if (not os.path.isfile(path2write)) or \
+                    input_dics['force_response']:
+                if resp_cache and (not input_dics['force_response']) and \
+                        cache_fetch(resp_cache, st_id, t_start, t_end,
+                                    path2write):
+                    state_update(input_dics, event, st_id, 'response',
+                                 'done', path=path2write)
+                    continue
+                tasks.append(('response', st_id, info_station,
+                              url_station,
+                              fdsn_query_params(st_avail, t_start, t_end,
+                                                level='response'),
+                              path2write))
+    if len(tasks) == 0:
+        return
+
+    def session_task(task):
+        product, st_id, info_station, url, params, path2write = task
+        t_prod = time.time()
+        state_update(input_dics, event, st_id, product, 'in-flight')
+        try:
+            num_retry = request_to_file(
+                lambda path_tmp: session_get_to_file(
+                    session, url, params, path_tmp, input_dics,
+                    timeout=input_dics['req_timeout']),
+                path2write, input_dics, req_cli, product)
+            record_metric(input_dics, target_path, req_cli, product, st_id,
+                          time.time() - t_prod, path=path2write,
+                          retries=num_retry)
+            if product == 'response' and resp_cache:
+                cache_store(resp_cache, st_id, path2write)
+            state_update(input_dics, event, st_id, product, 'done',
+                         path=path2write, duration=time.time() - t_prod)
+            print('%s -- %s -- saving %s for: %s  ---> DONE'
+                  % (info_station, req_cli, product, st_id))
+        except Exception as error:
+            session_exception(target_path, req_cli, product, st_id, error)
+            record_metric(input_dics, target_path, req_cli, product, st_id,
+                          time.time() - t_prod, error=error,
+                          retries=getattr(error, 'req_retries', 0))
+            state_update(input_dics, event, st_id, product, 'failed',
+                         duration=time.time() - t_prod,
+                         err_class=error_class(error), error=error)
+
+    pool = ThreadPool(processes=max(1, min(num_req_np, len(tasks))))
+    try:
+        pool.map(session_task, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+# ##################### session_bulk_download ###########################
+
+
+def session_bulk_download(bulk_list, target_path, client_fdsn, req_cli,
+                          input_dics):
+    """
+    send the bulk waveform request in chunks of --bulk_chunk channels,
+    --req_np chunks in parallel. The miniSEED records of each response
+    are written directly into raw/NET.STA.LOC.CHA (see
+    session_post_demux), no Stream is built in memory.
+    :param bulk_list: list of (net, sta, loc, cha, t_start, t_end)
+    :param target_path:
+    :param client_fdsn: used to resolve the service URL
+    :param req_cli:
+    :param input_dics:
+    :return:
+    """
+    if input_dics['req_parallel']:
+        num_req_np = input_dics['req_np']
+    else:
+        num_req_np = 1
+    # the session is shared with session_download
+    session = get_session(client_fdsn.base_url,
+                          max(num_req_np, input_dics['session_np']))
+    url_dataselect = fdsn_service_url(client_fdsn, 'dataselect', input_dics)
+    raw_dir = os.path.join(target_path, 'raw')
+
+    chunk_size = max(1, input_dics['bulk_chunk'])
+    bulk_chunks = [bulk_list[i:i + chunk_size]
+                   for i in range(0, len(bulk_list), chunk_size)]
+
+    def bulk_task(chunk_info):
+        chunk_num, bulk_chunk = chunk_info
+        body = '\n'.join(['%s %s %s %s %s %s'
+                          % (bulk_item[0], bulk_item[1],
+                             bulk_item[2] if bulk_item[2] else '--',
+                             bulk_item[3],
+                             fdsn_time_str(bulk_item[4]),
+                             fdsn_time_str(bulk_item[5]))
+                          for bulk_item in bulk_chunk])
+        t_chunk = time.time()
+        try:
+            # a failed response leaves nothing in raw/ and is retried, it is
+            # not hedged: the duplicate of a chunk would write the same files
+            saved, num_retry = robust_request(
+                lambda: session_post_demux(session, url_dataselect, body,
+                                           raw_dir, input_dics),
+                input_dics, req_cli, 'bulk_waveform', hedge=False)
+            record_metric(input_dics, target_path, req_cli, 'bulk_waveform',
+                          'chunk %s' % (chunk_num + 1),
+                          time.time() - t_chunk,
+                          n_bytes=sum(saved.values()), retries=num_retry)
+            print('[INFO] %s -- bulk chunk %s/%s -- saving %s channels '
+                  '(%.1f MB)  ---> DONE'
+                  % (req_cli, chunk_num + 1, len(bulk_chunks), len(saved),
+                     sum(saved.values())/1024.**2))
+        except Exception as error:
+            record_metric(input_dics, target_path, req_cli, 'bulk_waveform',
+                          'chunk %s' % (chunk_num + 1),
+                          time.time() - t_chunk, error=error,
+                          retries=getattr(error, 'req_retries', 0))
+            session_exception(target_path, req_cli, 'bulk_waveform',
+                              'chunk %s/%s' % (chunk_num + 1,
+                                               len(bulk_chunks)),
+                              error)
+
+    pool = ThreadPool(processes=max(1, min(num_req_np, len(bulk_chunks))))
+    try:
+        pool.map(bulk_task, list(enumerate(bulk_chunks)), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+# ##################### session_post_demux ##############################
+
+
+def session_post_demux(session, url, body, raw_dir, input_dics):
+    """
+    POST a bulk dataselect request and demultiplex the returned miniSEED
+    records into one file per channel while the response is streamed.
+    The records are written to temporary files which are moved into
+    raw_dir only if the whole response was received.
+    :param session:
+    :param url:
+    :param body: bulk request (one channel and time window per line)
+    :param raw_dir:
+    :param input_dics: the read timeout of the response is --req_timeout
+    :return: dictionary NET.STA.LOC.CHA: number of bytes written
+    """
+    auth = None
+    if input_dics['username_fdsn']:
+        auth = HTTPDigestAuth(input_dics['username_fdsn'],
+                              input_dics['password_fdsn'])
+    resp = session.post(url, data=body, auth=auth,
+                        stream=True, timeout=input_dics['req_timeout'])
+    raw_files = {}
+    saved = {}
+    try:
+        if resp.status_code in [204, 404]:
+            return saved
+        if resp.status_code != 200:
+            raise Exception('HTTP %s: %s' % (resp.status_code, resp.reason))
+        buf = bytearray()
+        # None marks the end of the response
+        for chunk in itertools.chain(resp.iter_content(chunk_size=64*1024),
+                                     [None]):
+            if chunk is not None:
+                buf.extend(chunk)
+            while len(buf) > 0:
+                rec_info = mseed_record_info(buf, chunk is None)
+                if rec_info is None:
+                    break
+                st_id, rec_len = rec_info
+                if len(buf) < rec_len:
+                    if chunk is None:
+                        raise Exception('incomplete miniSEED record at the '
+                                        'end of the response (%s bytes)'
+                                        % len(buf))
+                    break
+                if st_id not in raw_files:
+                    path_tmp = os.path.join(raw_dir, '%s.part%s-%s'
+                                            % (st_id, os.getpid(),
+                                               threading.current_thread()
+                                               .ident))
+                    raw_files[st_id] = (open(path_tmp, 'wb'), path_tmp)
+                    saved[st_id] = 0
+                raw_files[st_id][0].write(buf[:rec_len])
+                saved[st_id] += rec_len
+                del buf[:rec_len]
+        for st_id in raw_files:
+            raw_files[st_id][0].close()
+            path2write = os.path.join(raw_dir, st_id)
+            if os.path.isfile(path2write):
+                os.remove(path2write)
+            os.rename(raw_files[st_id][1], path2write)
+        raw_files = {}
+    finally:
+        resp.close()
+        # partially received channels are not kept
+        for raw_fio, path_tmp in raw_files.values():
+            raw_fio.close()
+            if os.path.isfile(path_tmp):
+                os.remove(path_tmp)
+    return saved
+
+# ##################### mseed_record_info ###############################
+
+
+def mseed_record_info(buf, end=False):
+    """
+    channel id and length of the miniSEED record at the start of buf.
+    The length is read from blockette 1000, a record without it ends
+    where the next record starts (or at the end of the response).
+    :param buf: bytearray
+    :param end: True if buf holds the rest of the response
+    :return: (NET.STA.LOC.CHA, record length) or None if more bytes
+        are needed to decode the header
+    """
+    if len(buf) < 48:
+        if end:
+            raise Exception('incomplete miniSEED record at the end of the '
+                            'response (%s bytes)' % len(buf))
+        return None
+    if not mseed_header_start(buf, 0):
+        raise Exception('no miniSEED record header in the response: %r'
+                        % bytes(buf[:20]))
+    # the byte order is found from the year of the start time
+    byte_order = '>'
+    if not 1900 <= struct.unpack('>H', bytes(buf[20:22]))[0] <= 2100:
+        byte_order = '<'
+    st_id = '%s.%s.%s.%s' % (
+        bytes(buf[18:20]).decode('ascii', 'replace').strip(),
+        bytes(buf[8:13]).decode('ascii', 'replace').strip(),
+        bytes(buf[13:15]).decode('ascii', 'replace').strip(),
+        bytes(buf[15:18]).decode('ascii', 'replace').strip())
+
+    # walk the blockettes to find the record length (blockette 1000)
+    blkt_offset = struct.unpack(byte_order + 'H', bytes(buf[46:48]))[0]
+    while blkt_offset >= 48:
+        if len(buf) < blkt_offset + 7:
+            if end:
+                raise Exception('incomplete miniSEED record of %s at the '
+                                'end of the response' % st_id)
+            return None
+        blkt_type, blkt_next = struct.unpack(
+            byte_order + 'HH', bytes(buf[blkt_offset:blkt_offset + 4]))
+        if blkt_type == 1000:
+            rec_exp = buf[blkt_offset + 6]
+            if not 7 <= rec_exp <= 16:
+                raise Exception('miniSEED record of %s with a record '
+                                'length of 2**%s bytes' % (st_id, rec_exp))
+            return st_id, 2**rec_exp
+        if blkt_next <= blkt_offset:
+            break
+        blkt_offset = blkt_next
+
+    # no blockette 1000: the next record header is searched at the
+    # possible record lengths (powers of two, 128 to 65536 bytes)
+    for rec_exp in range(7, 17):
+        if len(buf) < 2**rec_exp + 48:
+            break
+        if mseed_header_start(buf, 2**rec_exp):
+            return st_id, 2**rec_exp
+    if end:
+        return st_id, len(buf)
+    if len(buf) >= 2**16 + 48:
+        raise Exception('miniSEED record of %s without blockette 1000 '
+                        'and without a following record' % st_id)
+    return None
+
+# ##################### mseed_header_start ##############################
+
+
+def mseed_header_start(buf, offset):
+    """
+    True if a miniSEED fixed header starts at offset of buf: sequence
+    number (6 digits or spaces), data quality (D, R, Q or M) and a
+    reserved byte (space or null)
+    :param buf:
+    :param offset:
+    :return:
+    """
+    seq_num = bytes(buf[offset:offset + 6])
+    return all([c in bytearray(b'0123456789 ')
+                for c in bytearray(seq_num)]) and \
+        buf[offset + 6] in bytearray(b'DRQM') and \
+        buf[offset + 7] in bytearray(b' \x00')
+
+# ##################### session_exception ###############################
+
+
+def session_exception(target_path, req_cli, product, st_id, error):
+    """
+    log a failed request in the exception file of the event
+    :param target_path:
+    :param req_cli:
+    :param product:
+    :param st_id:
+    :param error:
+    :return:
+    """
+    ee = '%s -- %s -- %s -- %s\n' % (req_cli, product, st_id, error)
+    exception_file = open(os.path.join(target_path, 'info', 'exception'),
+                          'at+')
+    exception_file.writelines(ee)
+    exception_file.close()
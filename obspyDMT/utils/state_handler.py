@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  state_handler.py
+#   Purpose:   database of the download state of each requested item
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+
+from .request_handler import error_class
+
+# One row per (event, channel, product), product is one of
+# 'waveform', 'response' or 'syngine_waveform'.
+# status: pending --> in-flight --> done / failed
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    event_id TEXT NOT NULL,
+    st_id TEXT NOT NULL,
+    product TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER,
+    duration REAL,
+    error_class TEXT,
+    error TEXT,
+    updated REAL,
+    PRIMARY KEY (event_id, st_id, product)
+)
+"""
+
+# one connection per database and process, shared by the threads
+state_connections = {}
+state_lock = threading.Lock()
+
+# ##################### state_db_path ###################################
+
+
+def state_db_path(input_dics):
+    """
+    path of the state database or False if it is not used
+    :param input_dics:
+    :return:
+    """
+    if not input_dics.get('state_db'):
+        return False
+    return os.path.join(input_dics['datapath'], 'download_state.sqlite')
+
+# ##################### state_connect ###################################
+
+
+def state_connect(db_path):
+    """
+    connection to the state database of this process
+    :param db_path:
+    :return:
+    """
+    key = (os.getpid(), db_path)
+    if key not in state_connections:
+        if not os.path.isdir(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        conn = sqlite3.connect(db_path, timeout=60,
+                               check_same_thread=False)
+        # WAL: readers do not block the writers of other processes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(STATE_SCHEMA)
+        conn.commit()
+        state_connections[key] = conn
+    return state_connections[key]
+
+# ##################### state_products ##################################
+
+
+def state_products(input_dics):
+    """
+    products requested for each channel
+    :param input_dics:
+    :return:
+    """
+    products = []
+    if input_dics['waveform']:
+        products.append('waveform')
+    if input_dics['response']:
+        products.append('response')
+    if input_dics['syngine']:
+        products.append('syngine_waveform')
+    return products
+
+# ##################### state_filter ####################################
+
+
+def state_filter(stas_avail, event, input_dics):
+    """
+    remove the channels whose requested products are all done
+    (or failed with an error class which should not be retried)
+    and register the new channels as pending.
+    One query per event replaces the stat of the files on restart.
+    :param stas_avail:
+    :param event:
+    :param input_dics:
+    :return: channels that still have to be requested
+    """
+    db_path = state_db_path(input_dics)
+    products = state_products(input_dics)
+    if not db_path or len(products) == 0 or len(stas_avail) == 0:
+        return stas_avail
+    if input_dics['force_waveform'] or input_dics['force_response']:
+        return stas_avail
+
+    retry_classes = input_dics['state_retry']
+    with state_lock:
+        conn = state_connect(db_path)
+        state_items = {}
+        for st_id, product, status, err_class in conn.execute(
+                'SELECT st_id, product, status, error_class FROM items '
+                'WHERE event_id=?', (event['event_id'],)):
+            state_items[(st_id, product)] = (status, err_class)
+
+        stas_req = []
+        new_items = []
+        for st_avail in stas_avail:
+            st_loc = st_avail[2]
+            if st_loc == '--' or st_loc == '  ':
+                st_loc = ''
+            st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1],
+                                     st_loc, st_avail[3])
+            st_required = False
+            for product in products:
+                status, err_class = \
+                    state_items.get((st_id, product), (None, None))
+                if status is None:
+                    new_items.append((event['event_id'], st_id, product,
+                                      'pending', time.time()))
+                    st_required = True
+                elif status == 'failed':
+                    if retry_classes == 'all' or \
+                            err_class in retry_classes:
+                        st_required = True
+                elif status != 'done':
+                    st_required = True
+            stas_req.append(st_required)
+
+        conn.executemany('INSERT OR IGNORE INTO items '
+                         '(event_id, st_id, product, status, updated) '
+                         'VALUES (?, ?, ?, ?, ?)', new_items)
+        conn.commit()
+
+    if sum(stas_req) < len(stas_avail):
+        print('[INFO] state database -- %s/%s channels already done'
+              % (len(stas_avail) - sum(stas_req), len(stas_avail)))
+    return stas_avail[np.array(stas_req, dtype=bool)]
+
+# ##################### state_update ####################################
+
+
+def state_update(input_dics, event, st_id, product, status,
+                 path=None, duration=None, err_class=None, error=None):
+    """
+    update the state of one item
+    :param input_dics:
+    :param event:
+    :param st_id:
+    :param product:
+    :param status: 'in-flight', 'done' or 'failed'
+    :param path: retrieved file, its size is stored for 'done' items
+    :param duration: duration of the request in seconds
+    :param err_class: error class of a failed request (see error_class)
+    :param error:
+    :return:
+    """
+    db_path = state_db_path(input_dics)
+    if not db_path:
+        return
+    size_bytes = None
+    if path and os.path.isfile(path):
+        size_bytes = os.path.getsize(path)
+    attempt = 1 if status == 'in-flight' else 0
+    try:
+        with state_lock:
+            conn = state_connect(db_path)
+            conn.execute(
+                'INSERT OR IGNORE INTO items '
+                '(event_id, st_id, product, status, updated) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (event['event_id'], st_id, product, status, time.time()))
+            conn.execute(
+                'UPDATE items SET status=?, attempts=attempts+?, '
+                'bytes=COALESCE(?, bytes), duration=COALESCE(?, duration), '
+                'error_class=?, error=?, updated=? '
+                'WHERE event_id=? AND st_id=? AND product=?',
+                (status, attempt, size_bytes, duration, err_class,
+                 None if error is None else str(error)[:1000], time.time(),
+                 event['event_id'], st_id, product))
+            conn.commit()
+    except Exception as error:
+        print('[WARNING] state database -- %s -- %s' % (st_id, error))
+
+# ##################### state_failed ####################################
+
+
+def state_failed(input_dics, event, st_avail, product, error):
+    """
+    register a failed request of one channel
+    :param input_dics:
+    :param event:
+    :param st_avail:
+    :param product: failed product, 'initializing' marks all the
+        requested products of the channel as failed
+    :param error:
+    :return:
+    """
+    if not state_db_path(input_dics) or len(st_avail) == 0:
+        return
+    st_loc = st_avail[2]
+    if st_loc == '--' or st_loc == '  ':
+        st_loc = ''
+    st_id = '%s.%s.%s.%s' % (st_avail[0], st_avail[1], st_loc, st_avail[3])
+    if product == 'initializing':
+        products = state_products(input_dics)
+    else:
+        products = [product]
+    for product in products:
+        state_update(input_dics, event, st_id, product, 'failed',
+                     err_class=error_class(error), error=error)
+
+# ##################### state_summary ###################################
+
+
+def state_summary(input_dics, event):
+    """
+    number of items per product and status for one event
+    :param input_dics:
+    :param event:
+    :return: list of (product, status, number, bytes)
+    """
+    db_path = state_db_path(input_dics)
+    if not db_path:
+        return []
+    with state_lock:
+        conn = state_connect(db_path)
+        return conn.execute(
+            'SELECT product, status, COUNT(*), SUM(bytes) FROM items '
+            'WHERE event_id=? GROUP BY product, status '
+            'ORDER BY product, status', (event['event_id'],)).fetchall()
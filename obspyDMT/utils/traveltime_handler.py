@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+#   Filename:  traveltime_handler.py
+#   Purpose:   precomputed travel-time grids for --cut_time_phase
+#   Author:    Kasra Hosseini
+#   Email:     kasra.hosseinizad@earth.ox.ac.uk
+#   License:   GNU Lesser General Public License, Version 3
+# -------------------------------------------------------------------
+
+# -----------------------------------------------------------------------
+# ----------------Import required Modules (Python and Obspy)-------------
+# -----------------------------------------------------------------------
+from __future__ import print_function
+import numpy as np
+import os
+
+# first arrival of the first phase of this list which exists
+TT_PHASES = ['P', 'Pdiff', 'PKIKP']
+# grid nodes: epicentral distance (deg) x source depth (km)
+TT_DISTS = np.arange(0., 180.25, 0.5)
+TT_DEPTHS = np.array([0., 5., 10., 15., 20., 25., 30., 35., 40., 50.,
+                      60., 70., 80., 100., 120., 150., 200., 250., 300.,
+                      350., 400., 450., 500., 550., 600., 650., 700., 800.])
+TT_VERSION = 1
+# exact TauP calculations of a process before the grid is computed,
+# small runs are faster without the grid (~10000 TauP calculations)
+TT_DIRECT_MAX = 500
+
+# grids already loaded in this process, key: bg_model
+tt_grids = {}
+# TauPyModel and exact travel times of this process (small runs),
+# keys: bg_model and (bg_model, distance, depth)
+tt_models = {}
+tt_direct = {}
+
+# ##################### tt_cache_dir ####################################
+
+
+def tt_cache_dir():
+    """
+    directory of the cached travel-time grids
+    :return:
+    """
+    return os.path.join(os.path.expanduser('~'), '.obspyDMT', 'traveltime')
+
+# ##################### first_arrival ###################################
+
+
+def first_arrival(tau_bg, dist, evdp, phase_list=TT_PHASES):
+    """
+    exact travel time of the first phase in phase_list (TauP)
+    :param tau_bg: TauPyModel
+    :param dist: epicentral distance in degrees
+    :param evdp: source depth in km
+    :param phase_list:
+    :return: travel time in seconds or NaN if none of the phases exists
+    """
+    arrivals = tau_bg.get_travel_times(evdp, dist, phase_list=phase_list)
+    for ph in phase_list:
+        ph_times = [arr.time for arr in arrivals if arr.name == ph]
+        if len(ph_times) > 0:
+            return min(ph_times)
+    return np.nan
+
+# ##################### build_tt_grid ###################################
+
+
+def build_tt_grid(bg_model='iasp91', dists=TT_DISTS, depths=TT_DEPTHS):
+    """
+    compute the travel-time grid of bg_model with TauP
+    :param bg_model:
+    :param dists:
+    :param depths:
+    :return: dictionary with dists, depths and times (len(dists) x
+        len(depths), NaN where none of TT_PHASES exists)
+    """
+    from obspy.taup import TauPyModel
+    tau_bg = TauPyModel(model=bg_model)
+    times = np.empty([len(dists), len(depths)])
+    for j, evdp in enumerate(depths):
+        for i, dist in enumerate(dists):
+            times[i, j] = first_arrival(tau_bg, dist, evdp)
+    return {'dists': np.asarray(dists, dtype=float),
+            'depths': np.asarray(depths, dtype=float),
+            'times': times}
+
+# ##################### get_tt_grid #####################################
+
+
+def get_tt_grid(bg_model='iasp91', build=True):
+    """
+    travel-time grid of bg_model, computed once and cached on disk
+    :param bg_model:
+    :param build: compute the grid if it is not cached
+    :return: grid or None (not cached and build=False)
+    """
+    if bg_model in tt_grids:
+        return tt_grids[bg_model]
+    grid_path = os.path.join(tt_cache_dir(), 'tt_grid_%s_v%s.npz'
+                             % (bg_model, TT_VERSION))
+    tt_grid = None
+    if os.path.isfile(grid_path):
+        try:
+            grid_npz = np.load(grid_path)
+            tt_grid = {'dists': grid_npz['dists'],
+                       'depths': grid_npz['depths'],
+                       'times': grid_npz['times']}
+        except Exception as error:
+            print('[WARNING] travel-time grid %s: %s' % (grid_path, error))
+    if tt_grid is None and not build:
+        return None
+    if tt_grid is None:
+        print('[INFO] computing the travel-time grid of %s (only once)...'
+              % bg_model)
+        tt_grid = build_tt_grid(bg_model)
+        try:
+            if not os.path.isdir(tt_cache_dir()):
+                os.makedirs(tt_cache_dir())
+            # np.savez appends .npz to file names without this extension
+            grid_tmp = '%s.part%s.npz' % (grid_path, os.getpid())
+            np.savez(grid_tmp, **tt_grid)
+            os.rename(grid_tmp, grid_path)
+        except Exception as error:
+            print('[WARNING] travel-time grid could not be saved: %s'
+                  % error)
+    tt_grids[bg_model] = tt_grid
+    return tt_grid
+
+# ##################### interp_tt_grid ##################################
+
+
+def interp_tt_grid(tt_grid, dists, depths):
+    """
+    bilinear interpolation of a travel-time grid
+    :param tt_grid:
+    :param dists: epicentral distances in degrees (array)
+    :param depths: source depths in km (array or scalar)
+    :return: travel times in seconds, NaN if one of the surrounding
+        nodes has no arrival (e.g. core shadow)
+    """
+    grid_dists = tt_grid['dists']
+    grid_depths = tt_grid['depths']
+    dists = np.clip(np.asarray(dists, dtype=float),
+                    grid_dists[0], grid_dists[-1])
+    depths = np.clip(np.asarray(depths, dtype=float) *
+                     np.ones(np.shape(dists)),
+                     grid_depths[0], grid_depths[-1])
+    i = np.clip(np.searchsorted(grid_dists, dists, side='right') - 1,
+                0, len(grid_dists) - 2)
+    j = np.clip(np.searchsorted(grid_depths, depths, side='right') - 1,
+                0, len(grid_depths) - 2)
+    w_dist = (dists - grid_dists[i])/(grid_dists[i+1] - grid_dists[i])
+    w_depth = (depths - grid_depths[j])/(grid_depths[j+1] - grid_depths[j])
+    times = tt_grid['times']
+    return (1. - w_dist)*(1. - w_depth)*times[i, j] + \
+        w_dist*(1. - w_depth)*times[i+1, j] + \
+        (1. - w_dist)*w_depth*times[i, j+1] + \
+        w_dist*w_depth*times[i+1, j+1]
+
+# ##################### epi_distances ###################################
+
+
+def epi_distances(ev_lat, ev_lon, sta_lats, sta_lons):
+    """
+    epicentral distances (deg) between one event and many stations
+    :param ev_lat:
+    :param ev_lon:
+    :param sta_lats:
+    :param sta_lons:
+    :return:
+    """
+    ev_lat = np.radians(ev_lat)
+    sta_lats = np.radians(np.asarray(sta_lats, dtype=float))
+    d_lon = np.radians(np.asarray(sta_lons, dtype=float) - ev_lon)
+    d_lat = sta_lats - ev_lat
+    hav = np.sin(d_lat/2.)**2 + \
+        np.cos(ev_lat)*np.cos(sta_lats)*np.sin(d_lon/2.)**2
+    return np.degrees(2.*np.arcsin(np.sqrt(np.clip(hav, 0., 1.))))
+
+# ##################### direct_times ####################################
+
+
+def direct_times(dists, evdp, bg_model='iasp91'):
+    """
+    exact travel times (TauP) of the first P/Pdiff/PKIKP arrival,
+    each distance is calculated once per process
+    :param dists: epicentral distances in degrees (array)
+    :param evdp: source depth in km
+    :param bg_model:
+    :return: array of travel times in seconds, NaN if no arrival exists
+    """
+    if bg_model not in tt_models:
+        from obspy.taup import TauPyModel
+        tt_models[bg_model] = TauPyModel(model=bg_model)
+    times = np.empty(len(dists))
+    for i, dist in enumerate(dists):
+        tt_key = (bg_model, round(float(dist), 4), round(float(evdp), 3))
+        if tt_key not in tt_direct:
+            tt_direct[tt_key] = first_arrival(tt_models[bg_model],
+                                              tt_key[1], tt_key[2])
+        times[i] = tt_direct[tt_key]
+    return times
+
+# ##################### phase_times #####################################
+
+
+def phase_times(event, stas_lat, stas_lon, bg_model='iasp91'):
+    """
+    travel times of the first P/Pdiff/PKIKP arrival from event to
+    many stations. Exact TauP calculations are used until
+    TT_DIRECT_MAX distances have been calculated in this process,
+    the travel-time grid afterwards.
+    :param event:
+    :param stas_lat:
+    :param stas_lon:
+    :param bg_model:
+    :return: array of travel times in seconds, NaN for the stations
+        without P/Pdiff/PKIKP arrival
+    """
+    dists = np.atleast_1d(epi_distances(event['latitude'],
+                                        event['longitude'],
+                                        stas_lat, stas_lon))
+    evdp = abs(float(event['depth']))
+    tt_grid = get_tt_grid(bg_model, build=False)
+    if tt_grid is None:
+        num_new = len(set([(bg_model, round(float(dist), 4),
+                            round(evdp, 3)) for dist in dists]) -
+                      set(tt_direct))
+        if len(tt_direct) + num_new <= TT_DIRECT_MAX:
+            return direct_times(dists, evdp, bg_model)
+        try:
+            tt_grid = get_tt_grid(bg_model)
+        except Exception as error:
+            print('[WARNING] travel-time grid of %s: %s' % (bg_model, error))
+            return direct_times(dists, evdp, bg_model)
+    return interp_tt_grid(tt_grid, dists, evdp)
@@ -22,9 +22,12 @@ try:
 except:
     from obspy.fdsn.header import URL_MAPPINGS
 try:
-    from obspy.geodetics import locations2degrees
+    from obspy.geodetics.base import gps2dist_azimuth as gps2DistAzimuth
 except:
-    from obspy.core.util import locations2degrees
+    try:
+        from obspy.geodetics import gps2DistAzimuth
+    except:
+        from obspy.core.util import gps2DistAzimuth
 try:
     from obspy.signal.util import next_pow_2 as nextpow2
 except:
@@ -36,9 +39,14 @@ import smtplib
 import sys
 import time
 
+from .traveltime_handler import phase_times
+
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+# geodesic.txt files read in this process, key: path of the file
+geodesic_cache = {}
+
 # ##################### header_printer ##################################
 
 
@@ -83,6 +91,19 @@ def goodbye_printer(input_dics, t1_pro):
         print(input_dics['datapath'])
         print("* Total time of execution: %s (h:m:s)" \
               % str(timedelta(seconds=round(float(time.time() - t1_pro)))))
+        if input_dics.get('metrics'):
+            from .metrics_handler import run_metrics_report
+            report = run_metrics_report(input_dics)
+            print("* Requests (latency p50/p90/p99 in seconds):")
+            for data_center in sorted(report):
+                for product in sorted(report[data_center]):
+                    stats = report[data_center][product]
+                    print("  %s -- %s: %s requests (%s errors), "
+                          "%.2f/%.2f/%.2f s, %.3f MB/s"
+                          % (data_center, product, stats['requests'],
+                             stats['errors'], stats['latency_p50'],
+                             stats['latency_p90'], stats['latency_p99'],
+                             stats['mb_per_s']))
         print("==================================================\n\n")
     except Exception as error:
         print('ERROR: %s' % error)
@@ -428,12 +449,14 @@ def locate(root='.', target='info', num_matches=-1):
 # ##################### convert_to_sac ########################################
 
 
-def convert_to_sac(tr, save_path, sta_ev_arr):
+def convert_to_sac(tr, save_path, sta_ev_arr, target_path=None):
     """
     convert tr format to SAC and try to fill in some header information
     :param tr:
     :param save_path:
     :param sta_ev_arr:
+    :param target_path: event directory, the distance, azimuth and
+        back-azimuth are read from its info/geodesic.txt
     :return:
     """
     tr.write(save_path, format='SAC')
@@ -480,6 +503,18 @@ def convert_to_sac(tr, save_path, sta_ev_arr):
         tr.stats.sac.cmpinc = float(sta_ev_arr[15])
     except:
         pass
+    if target_path:
+        st_id = '%s.%s.%s.%s' % (sta_ev_arr[0], sta_ev_arr[1],
+                                 sta_ev_arr[2], sta_ev_arr[3])
+        geo_dict = read_geodesic(target_path)
+        if st_id in geo_dict:
+            epi_dist, azi, bazi = geo_dict[st_id]
+            tr.stats.sac.gcarc = epi_dist
+            tr.stats.sac.dist = epi_dist*111.194
+            tr.stats.sac.az = azi
+            tr.stats.sac.baz = bazi
+            # the stored values are not computed again by obspy
+            tr.stats.sac.lcalda = 0
     return tr
 
 # ##################### calculate_time_phase ##################################
@@ -488,64 +523,185 @@ def convert_to_sac(tr, save_path, sta_ev_arr):
 def calculate_time_phase(event, sta, bg_model='iasp91'):
     """
     calculate arrival time of the requested phase
+    (first arrival of P, Pdiff or PKIKP, see traveltime_handler)
     :param event:
     :param sta:
     :param bg_model:
     :return:
     """
-    phase_list = ['P', 'Pdiff', 'PKIKP']
+    time_ph = float(phase_times(event, [float(sta[4])], [float(sta[5])],
+                                bg_model=bg_model)[0])
+    if np.isnan(time_ph):
+        raise ValueError('no P, Pdiff or PKIKP arrival at the station')
 
-    time_ph = 0
-    ev_lat = event['latitude']
-    ev_lon = event['longitude']
-    evdp = abs(float(event['depth']))
-    sta_lat = float(sta[4])
-    sta_lon = float(sta[5])
-    dist = locations2degrees(ev_lat, ev_lon, sta_lat, sta_lon)
+    t_start = event['t1'] + time_ph
+    t_end = event['t2'] + time_ph
+    return t_start, t_end
 
-    try:
-        from obspy.taup import tau
-        tau_bg = tau.TauPyModel(model=bg_model)
-    except:
-        tau_bg = False
+# ##################### geodesic_arr ##################################
 
-    if not tau_bg:
-        try:
-            try:
-                from obspy.taup import getTravelTimes
-            except:
-                from obspy.taup.taup import getTravelTimes
-            tt = getTravelTimes(dist, evdp)
-            flag = False
-            for ph in phase_list:
-                for i in range(len(tt)):
-                    if tt[i]['phase_name'] == ph:
-                        flag = True
-                        time_ph = tt[i]['time']
-                        break
-                    else:
-                        continue
-            if not flag:
-                time_ph = 0
-        except:
-            time_ph = 0
-    else:
+
+def geodesic_arr(ev_lat, ev_lon, sta_lats, sta_lons):
+    """
+    epicentral distance, azimuth and back-azimuth between one event and
+    many stations on the WGS84 ellipsoid (gps2DistAzimuth), computed once
+    per station location
+    :param ev_lat:
+    :param ev_lon:
+    :param sta_lats:
+    :param sta_lons:
+    :return: epi_dist (deg), azi (deg), bazi (deg)
+    """
+    if abs(float(ev_lat)) > 90.:
+        raise ValueError('latitude of the event out of range: %s' % ev_lat)
+    sta_locs = np.column_stack([np.asarray(sta_lats, dtype=float),
+                                np.asarray(sta_lons, dtype=float)])
+    if len(sta_locs) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    # the channels of one station share the same location
+    locs_unique, locs_inv = np.unique(sta_locs, axis=0, return_inverse=True)
+    geo_unique = np.array([gps2DistAzimuth(float(ev_lat), float(ev_lon),
+                                           sta_lat, sta_lon)
+                           for sta_lat, sta_lon in locs_unique.tolist()])
+    geo_arr = geo_unique[locs_inv.reshape(-1)]
+    return geo_arr[:, 0]/111.194/1000., geo_arr[:, 1], geo_arr[:, 2]
+
+# ##################### epi_azi_mask ##################################
+
+
+def epi_azi_mask(input_dics, epi_dist, azi):
+    """
+    mask of the stations inside the requested epicentral distance and
+    azimuth ranges (--min_epi, --max_epi, --min_azi, --max_azi)
+    :param input_dics:
+    :param epi_dist:
+    :param azi:
+    :return:
+    """
+    mask = np.ones(np.shape(epi_dist), dtype=bool)
+    if input_dics['min_epi']:
+        mask &= epi_dist >= input_dics['min_epi']
+    if input_dics['max_epi']:
+        mask &= epi_dist <= input_dics['max_epi']
+    if input_dics['min_azi']:
+        mask &= azi >= input_dics['min_azi']
+    if input_dics['max_azi']:
+        mask &= azi <= input_dics['max_azi']
+    return mask
+
+# ##################### geodesic_columns ##################################
+
+
+def geodesic_columns(target_path, sta_arr, event):
+    """
+    epicentral distance, azimuth and back-azimuth of the stations in
+    sta_arr, read from info/geodesic.txt (see write_geodesic) and
+    computed only for the stations which are not in that file.
+    :param target_path:
+    :param sta_arr: availability or station_event array
+    :param event:
+    :return: epi_dist, azi, bazi (arrays of len(sta_arr))
+    """
+    geo_dict = read_geodesic(target_path)
+    epi_dist = np.zeros(len(sta_arr))
+    azi = np.zeros(len(sta_arr))
+    bazi = np.zeros(len(sta_arr))
+    missing = []
+    for sti in range(len(sta_arr)):
+        st_id = '%s.%s.%s.%s' % (sta_arr[sti][0], sta_arr[sti][1],
+                                 sta_arr[sti][2], sta_arr[sti][3])
+        if st_id in geo_dict:
+            epi_dist[sti], azi[sti], bazi[sti] = geo_dict[st_id]
+        else:
+            missing.append(sti)
+    if len(missing) > 0:
         try:
-            for ph in phase_list:
-                tt = tau_bg.get_travel_times(evdp, dist,
-                                             phase_list=[ph])[0].time
-                if not tt:
-                    time_ph = 0
-                    continue
-                else:
-                    time_ph = tt
-                    break
-        except:
-            time_ph = 0
+            epi_dist[missing], azi[missing], bazi[missing] = geodesic_arr(
+                event['latitude'], event['longitude'],
+                [float(sta_arr[sti][4]) for sti in missing],
+                [float(sta_arr[sti][5]) for sti in missing])
+        except ValueError:
+            # e.g. continuous requests have no event location
+            epi_dist[missing] = azi[missing] = bazi[missing] = np.nan
+    return epi_dist, azi, bazi
+
+# ##################### read_geodesic ##################################
+
+
+def read_geodesic(target_path):
+    """
+    read info/geodesic.txt
+    :param target_path:
+    :return: dictionary NET.STA.LOC.CHA: (epi_dist, azi, bazi)
+    """
+    geo_dict = {}
+    geo_path = os.path.join(target_path, 'info', 'geodesic.txt')
+    if not os.path.isfile(geo_path):
+        return geo_dict
+    geo_stat = os.stat(geo_path)
+    geo_key = (geo_stat.st_mtime, geo_stat.st_size)
+    if geodesic_cache.get(geo_path, (None, None))[0] == geo_key:
+        return dict(geodesic_cache[geo_path][1])
+    geo_fio = open(geo_path, 'rt')
+    for geo_line in geo_fio:
+        geo_line = geo_line.strip().split(',')
+        if len(geo_line) != 4:
+            continue
+        geo_dict[geo_line[0]] = (float(geo_line[1]), float(geo_line[2]),
+                                 float(geo_line[3]))
+    geo_fio.close()
+    geodesic_cache[geo_path] = (geo_key, dict(geo_dict))
+    return geo_dict
+
+# ##################### write_geodesic ##################################
+
+
+def write_geodesic(target_path, sta_arr, event):
+    """
+    compute the epicentral distance, azimuth and back-azimuth of all
+    the stations in sta_arr and store them in info/geodesic.txt
+    (NET.STA.LOC.CHA,epi_dist,azi,bazi) for the later stages.
+    :param target_path:
+    :param sta_arr: availability array
+    :param event:
+    :return: epi_dist, azi, bazi (arrays of len(sta_arr))
+    """
+    epi_dist, azi, bazi = geodesic_arr(
+        event['latitude'], event['longitude'],
+        [float(sta[4]) for sta in sta_arr], [float(sta[5]) for sta in sta_arr])
+    geo_dict = read_geodesic(target_path)
+    for sti in range(len(sta_arr)):
+        geo_dict['%s.%s.%s.%s' % (sta_arr[sti][0], sta_arr[sti][1],
+                                  sta_arr[sti][2], sta_arr[sti][3])] = \
+            (epi_dist[sti], azi[sti], bazi[sti])
+    geo_fio = open(os.path.join(target_path, 'info', 'geodesic.txt'), 'wt')
+    for st_id in sorted(geo_dict):
+        geo_fio.writelines('%s,%.4f,%.4f,%.4f\n' % ((st_id,) +
+                                                    tuple(geo_dict[st_id])))
+    geo_fio.close()
+    return epi_dist, azi, bazi
 
-    t_start = event['t1'] + time_ph
-    t_end = event['t2'] + time_ph
-    return t_start, t_end
+# ##################### calculate_time_phase_arr ##############################
+
+
+def calculate_time_phase_arr(event, stas, bg_model='iasp91'):
+    """
+    calculate_time_phase for all the stations of an availability array
+    :param event:
+    :param stas: list/array of stations (lat, lon in columns 4, 5)
+    :param bg_model:
+    :return: list of (t_start, t_end), None for the stations without
+        P, Pdiff or PKIKP arrival
+    """
+    if len(stas) == 0:
+        return []
+    times_ph = phase_times(event,
+                           [float(sta[4]) for sta in stas],
+                           [float(sta[5]) for sta in stas],
+                           bg_model=bg_model)
+    return [None if np.isnan(time_ph) else
+            (event['t1'] + time_ph, event['t2'] + time_ph)
+            for time_ph in times_ph.tolist()]
 
 # ##################### plot_filter_station ###############################
 
@@ -676,24 +832,23 @@ def spectrum_calc(tr):
 def geocen_calc(geog_lat):
     """
     Calculate geocentric latitudes
-    :param geog_lat:
-    :return:
+    :param geog_lat: geographic latitude(s), scalar or array
+    :return: geocentric latitude(s), same shape as geog_lat
     """
     fac = 0.993305621334896
 
-    colat = 90.0 - geog_lat
-    if abs(colat) < 1.0e-5:
-        colat = np.sign(colat)*1.0e-5
+    colat = 90.0 - np.asarray(geog_lat, dtype=float)
+    colat = np.where(np.abs(colat) < 1.0e-5, np.sign(colat)*1.0e-5, colat)
     # arg = colat*rpd
-    colat *= np.pi/180.
-    colat_sin = np.sin(colat)
-    if colat_sin < 1.0e-30:
-        colat_sin = 1.0e-30
+    colat = colat*np.pi/180.
+    colat_sin = np.maximum(np.sin(colat), 1.0e-30)
     # geocen=pi2-atan(fac*cos(arg)/(max(1.0e-30,sin(arg))))
     geocen_colat = np.pi/2. - np.arctan(fac*np.cos(colat)/colat_sin)
     geocen_colat = geocen_colat*180./np.pi
     geocen_lat = 90.0 - geocen_colat
 
+    if np.ndim(geocen_lat) == 0:
+        return float(geocen_lat)
     return geocen_lat
 
 # ----------------------------------------------------------------------------